@@ -0,0 +1,126 @@
+"""
+Stand-in for the parts of the Ollama API the ai-server uses (/api/pull and streaming /api/chat),
+answering with made up tokens at a configurable pace so the ai-server can be benchmarked without models.
+
+    uv run fake_ollama.py --port 11435 --prefill 0.2 --tokens-per-second 50 --tokens 200
+    OLLAMA_HOST=http://127.0.0.1:11435 uv run main.py
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+class FakeSettings:
+    # Seconds spent "loading" a model the first time it is used
+    load_latency = 0.0
+    # Seconds before the first token, standing in for prompt evaluation
+    prefill_latency = 0.1
+    tokens_per_second = 50.0
+    tokens = 100
+
+
+settings = FakeSettings()
+loaded_models: set[str] = set()
+
+WORDS = ["the", "method", "returns", "a", "value", "computed", "from", "its", "arguments", "and", "state"]
+
+app = FastAPI(title="Fake Ollama")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@app.post("/api/pull")
+async def pull(request: Request):
+    body = await request.json()
+    if body.get("stream", True):
+        async def progress():
+            yield json.dumps({"status": "success"}) + "\n"
+        return StreamingResponse(progress(), media_type="application/x-ndjson")
+    return JSONResponse({"status": "success"})
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    model = body.get("model", "")
+    prompt_chars = sum(len(message.get("content", "")) for message in body.get("messages", []))
+
+    async def stream():
+        started = time.perf_counter_ns()
+        load_duration = 0
+        if model not in loaded_models:
+            await asyncio.sleep(settings.load_latency)
+            loaded_models.add(model)
+            load_duration = time.perf_counter_ns() - started
+
+        prefill_started = time.perf_counter_ns()
+        await asyncio.sleep(settings.prefill_latency)
+        prompt_eval_duration = time.perf_counter_ns() - prefill_started
+
+        decode_started = time.perf_counter_ns()
+        interval = 1 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0
+        for i in range(settings.tokens):
+            # Sleep until the token is due, so a slow event loop does not lower the rate
+            due = decode_started + int(i * interval * 1e9)
+            delay = (due - time.perf_counter_ns()) / 1e9
+            if delay > 0:
+                await asyncio.sleep(delay)
+            chunk = {
+                "model": model,
+                "created_at": _now(),
+                "message": {"role": "assistant", "content": WORDS[i % len(WORDS)] + " "},
+                "done": False,
+            }
+            yield json.dumps(chunk) + "\n"
+        eval_duration = time.perf_counter_ns() - decode_started
+
+        final = {
+            "model": model,
+            "created_at": _now(),
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": time.perf_counter_ns() - started,
+            "load_duration": load_duration,
+            # Roughly four characters per token
+            "prompt_eval_count": prompt_chars // 4,
+            "prompt_eval_duration": prompt_eval_duration,
+            "eval_count": settings.tokens,
+            "eval_duration": eval_duration,
+        }
+        yield json.dumps(final) + "\n"
+
+    if body.get("stream", True):
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    # Non streaming requests get the whole answer in one response
+    content = ""
+    final = {}
+    async for line in stream():
+        final = json.loads(line)
+        content += final["message"]["content"]
+    final["message"]["content"] = content
+    return JSONResponse(final)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama chat server for load testing the ai-server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--load", type=float, default=settings.load_latency, help="model load latency in seconds")
+    parser.add_argument("--prefill", type=float, default=settings.prefill_latency, help="latency before the first token in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=settings.tokens_per_second)
+    parser.add_argument("--tokens", type=int, default=settings.tokens, help="tokens per answer")
+    args = parser.parse_args()
+    settings.load_latency = args.load
+    settings.prefill_latency = args.prefill
+    settings.tokens_per_second = args.tokens_per_second
+    settings.tokens = args.tokens
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
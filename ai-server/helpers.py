@@ -1,11 +1,37 @@
-import json
+import os
+import sqlite3
+import threading
+import time
 import ollama
 import asyncio
 import requests
+from urllib.parse import urlparse
 from typing import List
 from typing import List, AsyncGenerator
 
-API_BASE = "http://localhost:8000/"
+from index_reader import IndexReader
+from index_reader.paths import shard_path
+from metrics import RequestStats
+from single_flight import Generation, SingleFlight
+from scheduler import Priority, Scheduler
+from streaming import read_frames, sse_event
+
+API_BASE = os.environ.get("GIM_SQLITE_SERVER_URL", "http://localhost:8000/")
+# Directory of the sqlite-server, when it runs on this machine its database is read directly instead of over HTTP
+SQLITE_SERVER_DIR = os.environ.get(
+    "GIM_SQLITE_SERVER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sqlite-server")
+)
+# Set to 0 to always ask the sqlite-server over HTTP
+DIRECT_DB = os.environ.get("GIM_DIRECT_DB", "1") not in ("", "0", "false")
+# Nearest neighbours mixed into the related code context, and how similar they must be
+SIMILAR_METHODS = int(os.environ.get("GIM_SIMILAR_METHODS", "3"))
+SIMILAR_MIN_SCORE = float(os.environ.get("GIM_SIMILAR_MIN_SCORE", "0.6"))
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("GIM_MAX_CONCURRENT_GENERATIONS", "2"))
+
+# Identical generations that are in flight at the same time share one upstream stream
+inflight = SingleFlight()
+# Bounds how many generations run against Ollama at once, interactive requests first
+scheduler = Scheduler(MAX_CONCURRENT_GENERATIONS)
 
 
 async def ensure_model_exists(model: str) -> bool:
@@ -21,10 +47,13 @@ async def ensure_model_exists(model: str) -> bool:
         return False
 
 
-async def get_chat_stream(model: str, sys_prompt: str, user_prompt: str):
+async def get_chat_stream(model: str, sys_prompt: str, user_prompt: str, stats: dict | None = None):
     # Ensure model exists before trying to use it
+    started = time.perf_counter()
     if not await ensure_model_exists(model):
         raise Exception(f"Model {model} is not available and could not be pulled")
+    if stats is not None:
+        stats["model_check_seconds"] = time.perf_counter() - started
 
     client = ollama.AsyncClient()
     stream = await client.chat(
@@ -38,39 +67,138 @@ async def get_chat_stream(model: str, sys_prompt: str, user_prompt: str):
     return stream
 
 
-async def generate_response(
-    model: str, sys_prompt: str, user_prompt: str
-) -> AsyncGenerator[str, None]:
-    stream = await get_chat_stream(model, sys_prompt, user_prompt)
-    data = ""
-    async for chunk in stream:
-        content = chunk.get("message", {}).get("content")
-        if content:
-            data += content
-            yield f"data: {json.dumps({'token': content})}\n\n"
-    print(data)
+def record_final_chunk(stats: dict, chunk):
+    """Keep the timings Ollama reports on the last chunk of a stream, they are in nanoseconds"""
+    load = chunk.get("load_duration")
+    if load is not None:
+        stats["model_load_seconds"] = stats.get("model_check_seconds", 0) + load / 1e9
+    if chunk.get("prompt_eval_duration") is not None:
+        stats["prefill_seconds"] = chunk.get("prompt_eval_duration") / 1e9
+    if chunk.get("eval_duration") is not None:
+        stats["decode_seconds"] = chunk.get("eval_duration") / 1e9
+    stats["prompt_eval_count"] = chunk.get("prompt_eval_count")
+    stats["eval_count"] = chunk.get("eval_count")
 
 
-def get_used_methods(method_id):
-    data = requests.get(f"{API_BASE}used-methods/{method_id}")
-    return data.json().values()
+async def chat_tokens(
+    generation: Generation, model: str, sys_prompt: str, user_prompt: str
+) -> AsyncGenerator[str, None]:
+    queued = time.perf_counter()
+    # Subscribers joining while it waits may raise generation.priority, and promote it under its key
+    async with scheduler.slot(Priority(generation.priority), generation.key):
+        generation.stats["queue_wait_seconds"] = time.perf_counter() - queued
+        stream = await get_chat_stream(model, sys_prompt, user_prompt, generation.stats)
+        count = 0
+        try:
+            async for chunk in stream:
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    count += 1
+                    yield content
+                if chunk.get("done"):
+                    record_final_chunk(generation.stats, chunk)
+        finally:
+            # Closes the HTTP response to Ollama right away when we are cancelled
+            await stream.aclose()
+        print(f"Generated {count} tokens with {model}")
 
 
-def get_method_from_signature(signature: str, file_name: str) -> tuple[str, int]:
-    data = requests.get(
-        API_BASE + "method-from-signature",
-        params={"signature": signature, "file_name": file_name},
+async def generate_response(
+    model: str,
+    sys_prompt: str,
+    user_prompt: str,
+    priority: Priority = Priority.INTERACTIVE,
+    request=None,
+    coalesce: bool = True,
+    stats: RequestStats | None = None,
+    include_stats: bool = False,
+) -> AsyncGenerator[str, None]:
+    """
+    Stream the answer as server sent events, coalescing tokens into larger frames unless coalesce is False.
+    When the starlette request is given, the stream stops as soon as the client disconnects,
+    which cancels the upstream generation if nobody else is subscribed to it.
+    Timings are recorded into stats, and sent as a final "stats" event when include_stats is set.
+    """
+    if stats is None:
+        stats = RequestStats("unknown")
+    generation, joined = inflight.join(
+        model, sys_prompt, user_prompt,
+        lambda generation: chat_tokens(generation, model, sys_prompt, user_prompt),
+        priority,
     )
-    return data.json().values()  # method, id
-
-
-def get_related_methods(method_id: str) -> tuple[str, int]:
+    stats.cache = "hit" if joined else "miss"
+    stats.generation = generation.stats
+    if joined:
+        # An interactive request must not wait behind the bulk request it joined
+        scheduler.promote(generation.key, Priority(generation.priority))
+        print(f"Joining in-flight generation {generation.key[:12]} ({generation.subscribers} subscribers)")
+    try:
+        async for frame in read_frames(generation, coalesce, request):
+            if stats.ttft_seconds is None:
+                stats.ttft_seconds = stats.elapsed()
+            yield sse_event({"token": frame})
+        stats.tokens = len(generation.tokens)
+        stats.total_seconds = stats.elapsed()
+        if include_stats:
+            yield sse_event(stats.as_dict(), event="stats")
+    finally:
+        inflight.leave(generation)
+        if stats.total_seconds is None:
+            stats.total_seconds = stats.elapsed()
+        stats.record()
+
+
+# Read only readers of the sqlite-server's databases, by path. Filled from the worker threads of several requests
+_index_readers = {}
+_index_readers_lock = threading.Lock()
+
+
+def get_index_reader(workspace: str | None = None) -> IndexReader | None:
+    """
+    Reader of the database of the workspace, see the index-reader package,
+    or None when the sqlite-server is on another machine or has not created the database yet.
+    """
+    if not DIRECT_DB or urlparse(API_BASE).hostname not in ("localhost", "127.0.0.1", "::1"):
+        return None
+    path = os.path.join(SQLITE_SERVER_DIR, shard_path(workspace))
+    with _index_readers_lock:
+        reader = _index_readers.get(path)
+        if reader is None:
+            if not os.path.exists(path):
+                return None
+            reader = _index_readers[path] = IndexReader(path)
+        return reader
+
+
+def get_method_context(signature: str, file_name: str, workspace: str | None = None, **params) -> dict:
+    """
+    The method with its callees, callers and similar methods, see /method-context on the sqlite-server for params.
+    Read directly from the database when possible. Similar methods are always asked from the sqlite-server,
+    which keeps the vectors in memory.
+    """
+    reader = None if params.get("similar") else get_index_reader(workspace)
+    if reader is not None:
+        try:
+            context = reader.method_context(signature, file_name, **params)
+        except sqlite3.Error as e:
+            print(f"Could not read the index directly, asking the sqlite-server instead: {e}")
+        else:
+            if context is None:
+                raise LookupError(f"Method not found: {signature} in {file_name}")
+            return context
     data = requests.get(
-        API_BASE + f"related-methods/{method_id}",
+        API_BASE + "method-context",
+        params={"signature": signature, "file_name": file_name, "workspace": workspace, **params},
     )
+    data.raise_for_status()
     return data.json()
 
 
+def format_method(method: dict) -> str:
+    """Signature and body, the way /method-from-signature formats a method"""
+    return f"{method['method_signature']}\n\t\t{method['method_body']}"
+
+
 def json_method_to_string(header, body):
     return header + body
 
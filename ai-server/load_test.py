@@ -0,0 +1,191 @@
+"""
+Load generator for the ai-server. Seeds the sqlite-server with a synthetic solution, then drives
+/docstring, /explain and /related-code concurrently and reports throughput, time to first token
+and event loop lag, both of this process and of the ai-server (read from its /metrics endpoint).
+
+Run it against the fake Ollama to measure the ai-server's own overhead:
+
+    uv run fake_ollama.py --tokens-per-second 100 --tokens 200 &
+    (cd ../sqlite-server && uv run main.py) &
+    OLLAMA_HOST=http://127.0.0.1:11435 uv run main.py &
+    uv run load_test.py --requests 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import re
+import time
+
+import httpx
+
+ENDPOINTS = ["docstring", "explain", "related-code"]
+PROJECT = "LoadTest"
+
+
+class Result:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.ttft: float | None = None
+        self.total: float | None = None
+        self.events = 0
+        self.error: str | None = None
+
+
+def synthetic_solution(documents: int, methods_per_class: int) -> tuple[list[dict], list[tuple[str, str]]]:
+    """One class per document, every method calls the next one so /used-methods and /related-methods have answers"""
+    projects = []
+    targets = []
+    for d in range(documents):
+        class_name = f"{PROJECT}.Class{d}"
+        path = f"/loadtest/{PROJECT}/Class{d}.cs"
+        methods = []
+        calls = []
+        for m in range(methods_per_class):
+            signature = f"{class_name}.Method{m}(int)"
+            body = "{\n" + "\n".join(f"    var x{i} = value * {i};" for i in range(10)) + "\n    return x9;\n}"
+            methods.append({"Signature": signature, "Body": body, "StartLine": m * 15, "EndLine": m * 15 + 13})
+            if m + 1 < methods_per_class:
+                calls.append({"Caller": signature, "Callee": f"{class_name}.Method{m + 1}"})
+            targets.append((signature, path))
+        projects.append({"Project": PROJECT, "Document": path, "Classes": [class_name], "Methods": methods, "Calls": calls})
+    return projects, targets
+
+
+async def seed(client: httpx.AsyncClient, sqlite_url: str, documents: int, methods_per_class: int):
+    projects, targets = synthetic_solution(documents, methods_per_class)
+    response = await client.post(f"{sqlite_url}/update-indexes", json=projects, timeout=120)
+    response.raise_for_status()
+    return targets
+
+
+async def run_one(client: httpx.AsyncClient, ai_url: str, endpoint: str, signature: str, file_name: str, model: str) -> Result:
+    result = Result(endpoint)
+    body = {"signature": signature, "file_name": file_name, "model_name": model}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", f"{ai_url}/{endpoint}", json=body, timeout=None) as response:
+            if response.status_code != 200:
+                result.error = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - started
+                    result.events += 1
+        result.total = time.perf_counter() - started
+    except httpx.HTTPError as e:
+        result.error = type(e).__name__
+    return result
+
+
+async def sample_loop_lag(samples: list[float], interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def parse_histogram(text: str, name: str) -> tuple[dict[float, float], float, float]:
+    """Sum a histogram over all its label sets, returning cumulative buckets, sum and count"""
+    buckets: dict[float, float] = {}
+    total = count = 0.0
+    for line in text.splitlines():
+        if line.startswith(f"{name}_bucket"):
+            le = re.search(r'le="([^"]+)"', line).group(1)
+            bound = float("inf") if le == "+Inf" else float(le)
+            buckets[bound] = buckets.get(bound, 0) + float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_sum"):
+            total += float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count"):
+            count += float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+
+def histogram_delta(before: str, after: str, name: str) -> tuple[dict[float, float], float, float]:
+    b_buckets, b_sum, b_count = parse_histogram(before, name)
+    a_buckets, a_sum, a_count = parse_histogram(after, name)
+    buckets = {bound: value - b_buckets.get(bound, 0) for bound, value in a_buckets.items()}
+    return buckets, a_sum - b_sum, a_count - b_count
+
+
+def histogram_quantile(buckets: dict[float, float], count: float, q: float) -> float | None:
+    """Upper bound of the bucket holding the q-th quantile"""
+    if count <= 0:
+        return None
+    for bound in sorted(buckets):
+        if buckets[bound] >= q * count:
+            return bound
+    return None
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def fmt(seconds: float | None) -> str:
+    return "n/a" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+
+async def main(args):
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency + 4)) as client:
+        print(f"Seeding {args.sqlite_url} with {args.documents * args.methods} methods...")
+        targets = await seed(client, args.sqlite_url, args.documents, args.methods)
+        metrics_before = (await client.get(f"{args.ai_url}/metrics")).text
+
+        lag_samples: list[float] = []
+        lag_task = asyncio.create_task(sample_loop_lag(lag_samples))
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(i: int) -> Result:
+            async with semaphore:
+                signature, file_name = targets[i % len(targets)]
+                endpoint = ENDPOINTS[i % len(ENDPOINTS)]
+                return await run_one(client, args.ai_url, endpoint, signature, file_name, args.model)
+
+        print(f"Sending {args.requests} requests, {args.concurrency} at a time...")
+        started = time.perf_counter()
+        results = await asyncio.gather(*(limited(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started
+        lag_task.cancel()
+
+        metrics_after = (await client.get(f"{args.ai_url}/metrics")).text
+
+    ok = [r for r in results if r.error is None]
+    errors = [r for r in results if r.error is not None]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    totals = [r.total for r in ok if r.total is not None]
+    print()
+    print(f"requests      {len(results)} ({len(errors)} failed) in {elapsed:.2f} s")
+    print(f"throughput    {len(ok) / elapsed:.1f} req/s, {sum(r.events for r in ok) / elapsed:.1f} events/s")
+    print(f"ttft          p50 {fmt(percentile(ttfts, 0.5))}  p90 {fmt(percentile(ttfts, 0.9))}  p99 {fmt(percentile(ttfts, 0.99))}")
+    print(f"total         p50 {fmt(percentile(totals, 0.5))}  p90 {fmt(percentile(totals, 0.9))}  p99 {fmt(percentile(totals, 0.99))}")
+    for endpoint in ENDPOINTS:
+        endpoint_ttfts = [r.ttft for r in ok if r.endpoint == endpoint and r.ttft is not None]
+        print(f"  {endpoint:<14}ttft p50 {fmt(percentile(endpoint_ttfts, 0.5))}  p99 {fmt(percentile(endpoint_ttfts, 0.99))}")
+    print(f"client lag    p50 {fmt(percentile(lag_samples, 0.5))}  p99 {fmt(percentile(lag_samples, 0.99))}  max {fmt(max(lag_samples, default=None))}")
+    buckets, lag_sum, lag_count = histogram_delta(metrics_before, metrics_after, "gim_event_loop_lag_seconds")
+    mean = lag_sum / lag_count if lag_count else None
+    print(
+        f"server lag    mean {fmt(mean)}  p99 <= {fmt(histogram_quantile(buckets, lag_count, 0.99))}"
+        f"  ({int(lag_count)} samples)"
+    )
+    if errors:
+        kinds = {}
+        for r in errors:
+            kinds[r.error] = kinds.get(r.error, 0) + 1
+        print(f"errors        {kinds}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the ai-server")
+    parser.add_argument("--ai-url", default="http://127.0.0.1:9999")
+    parser.add_argument("--sqlite-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--documents", type=int, default=20, help="synthetic documents to seed")
+    parser.add_argument("--methods", type=int, default=10, help="methods per synthetic document")
+    asyncio.run(main(parser.parse_args()))
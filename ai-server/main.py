@@ -1,20 +1,58 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
 from helpers import *
 from prompts import *
+from metrics import RequestStats, monitor_event_loop_lag, render_metrics
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    yield
+    lag_monitor.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 class ReqBody(BaseModel):
     file_name: str
     signature: str
     model_name: str
+    # Interactive requests are scheduled before bulk ones when the backend is busy
+    priority: Literal["interactive", "bulk"] = "interactive"
+    # "coalesced" batches tokens into fewer, larger events, "token" sends one event per token
+    stream_mode: Literal["coalesced", "token"] = "coalesced"
+    # Send the timings of the request as a final "stats" event
+    include_stats: bool = False
+    # Path of the solution or folder, selects its database on the sqlite-server, the shared one when left out
+    workspace: str | None = None
+
+def stream_response(body: ReqBody, request: Request, sys_prompt: str, user_prompt: str, stats: RequestStats):
+    return StreamingResponse(
+        generate_response(
+            body.model_name,
+            sys_prompt,
+            user_prompt,
+            priority=Priority[body.priority.upper()],
+            request=request,
+            coalesce=body.stream_mode == "coalesced",
+            stats=stats,
+            include_stats=body.include_stats,
+        ),
+        media_type="text/event-stream",
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    '''Latency histograms of the generation pipeline, in the prometheus text format'''
+    return render_metrics()
 
 @app.post("/docstring")
-async def docstring(body: ReqBody):
+async def docstring(body: ReqBody, request: Request):
     '''Generate docstring for given method in the given file'''
     if not body.signature:
         raise HTTPException(detail="Missing signature in body", status_code=400)
@@ -23,16 +61,20 @@ async def docstring(body: ReqBody):
     if not body.model_name:
         raise HTTPException(detail="Missing model name in body", status_code=400)
     try:
-        method, used_methods = get_methods_for_prompts(body.signature, body.file_name)
+        stats = RequestStats("docstring")
+        # In a worker thread, the lookup reads the index or waits for the sqlite-server
+        method, used_methods = await asyncio.to_thread(get_methods_for_prompts, body.signature, body.file_name, body.workspace)
+        stats.lookup_seconds = stats.elapsed()
         sys_prompt, user_prompt = get_docstring_prompts(method, used_methods)
-        return StreamingResponse(generate_response(body.model_name, sys_prompt, user_prompt), media_type="text/event-stream")
+        stats.prompt_chars = len(sys_prompt) + len(user_prompt)
+        return stream_response(body, request, sys_prompt, user_prompt, stats)
     except Exception as e:
         raise HTTPException(
             detail="somehting went wrong, do better", status_code=500
         ) from e
 
 @app.post("/explain")
-async def explain(body: ReqBody):
+async def explain(body: ReqBody, request: Request):
     '''Explain the code in the given signature in the given file'''
     if not body.signature:
         raise HTTPException(detail="Missing signature in body", status_code=400)
@@ -41,15 +83,18 @@ async def explain(body: ReqBody):
     if not body.model_name:
         raise HTTPException(detail="Missing model name in body", status_code=400)
     try:
-        method, used_methods = get_methods_for_prompts(body.signature, body.file_name)
+        stats = RequestStats("explain")
+        method, used_methods = await asyncio.to_thread(get_methods_for_prompts, body.signature, body.file_name, body.workspace)
+        stats.lookup_seconds = stats.elapsed()
         sys_prompt, user_prompt = get_explain_code_prompts(method, used_methods)
-        return StreamingResponse(generate_response(body.model_name, sys_prompt, user_prompt), media_type="text/event-stream")
+        stats.prompt_chars = len(sys_prompt) + len(user_prompt)
+        return stream_response(body, request, sys_prompt, user_prompt, stats)
     except Exception as e:
         raise HTTPException(
             detail="somehting went wrong, do better", status_code=500
         ) from e
 @app.post("/related-code")
-async def related_code(body: ReqBody):
+async def related_code(body: ReqBody, request: Request):
     if not body.signature:
         raise HTTPException(detail="Missing signature in body", status_code=400)
     if not body.file_name:
@@ -57,29 +102,32 @@ async def related_code(body: ReqBody):
     if not body.model_name:
         raise HTTPException(detail="Missing model name in body", status_code=400)
     try:
-        method, used_methods = get_methods_for_related_code(body.signature, body.file_name)
+        stats = RequestStats("related-code")
+        method, used_methods = await asyncio.to_thread(get_methods_for_related_code, body.signature, body.file_name, body.workspace)
+        stats.lookup_seconds = stats.elapsed()
         sys_prompt, user_prompt = get_related_code_prompts(method, used_methods)
-        return StreamingResponse(generate_response(body.model_name, sys_prompt, user_prompt), media_type="text/event-stream")
+        stats.prompt_chars = len(sys_prompt) + len(user_prompt)
+        return stream_response(body, request, sys_prompt, user_prompt, stats)
     except Exception as e:
         raise HTTPException(detail="somehting went wrong, do better", status_code=500) from e
 
-def get_methods_for_related_code(signature, file_name):
-    method, id = get_method_from_signature(signature, file_name)
-    related_methods = get_related_methods(id)
-    print(related_methods)
+def get_methods_for_related_code(signature, file_name, workspace=None):
+    # Callers only, plus the nearest neighbours by embedding which find duplicated logic the call graph does not know about
+    context = get_method_context(signature, file_name, max_callees=0, similar=SIMILAR_METHODS, workspace=workspace)
     used_methods = []
-    for related_method in related_methods["related_methods"]:
-        method_id = related_method["method_id"]
-        method_signature = related_method["method_signature"]
-        document_path = related_method["document_path"]
-        used_method_body, used_method_id = get_method_from_signature(method_signature, document_path)
-        used_methods.append({"method":used_method_body, "path":document_path})
-    return method, used_methods
+    for caller in context["callers"]:
+        used_methods.append({"method":format_method(caller), "path":caller["document_path"], "kind":"caller"})
+    callers = {caller["method_id"] for caller in context["callers"]}
+    for similar_method in context["similar"]:
+        if similar_method["method_id"] in callers or similar_method["score"] < SIMILAR_MIN_SCORE:
+            continue
+        used_methods.append({"method":format_method(similar_method), "path":similar_method["document_path"], "kind":"similar"})
+    return format_method(context["method"]), used_methods
 
-def get_methods_for_prompts(signature, file_name):
-    method, method_id = get_method_from_signature(signature, file_name)
-    used_methods = get_used_methods(method_id)
-    return method, used_methods
+def get_methods_for_prompts(signature, file_name, workspace=None):
+    context = get_method_context(signature, file_name, max_callers=0, workspace=workspace)
+    used_methods = "\n".join(format_method(callee) for callee in context["callees"])
+    return format_method(context["method"]), used_methods
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=9999, reload=True)
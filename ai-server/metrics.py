@@ -0,0 +1,184 @@
+import asyncio
+import bisect
+import time
+from typing import Iterable
+
+# Bucket upper bounds, the +Inf bucket is implicit
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CHARS_BUCKETS = (256, 1024, 4096, 8192, 16384, 32768, 65536, 131072)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 40, 80, 160, 320)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative histogram in the prometheus text format, one series per label combination"""
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count], sum
+        self.series: dict[tuple[tuple[str, str], ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0])
+            self.series[key] = series
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.series.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+lookup_seconds = Histogram("gim_lookup_seconds", "Time spent fetching method context from the index.", SECONDS_BUCKETS)
+prompt_chars = Histogram("gim_prompt_chars", "Size of the system and user prompt in characters.", CHARS_BUCKETS)
+queue_wait_seconds = Histogram("gim_queue_wait_seconds", "Time a generation waited for a scheduler slot.", SECONDS_BUCKETS)
+model_load_seconds = Histogram("gim_model_load_seconds", "Time spent making sure the model is available and loaded.", SECONDS_BUCKETS)
+prefill_seconds = Histogram("gim_prefill_seconds", "Prompt evaluation time reported by Ollama.", SECONDS_BUCKETS)
+decode_seconds = Histogram("gim_decode_seconds", "Token generation time reported by Ollama.", SECONDS_BUCKETS)
+ttft_seconds = Histogram("gim_time_to_first_token_seconds", "Time from receiving the request to sending the first token.", SECONDS_BUCKETS)
+tokens_per_second = Histogram("gim_tokens_per_second", "Decode throughput of a generation.", RATE_BUCKETS)
+request_seconds = Histogram("gim_request_seconds", "Total duration of a request, from receiving it to the end of the stream.", SECONDS_BUCKETS)
+event_loop_lag_seconds = Histogram("gim_event_loop_lag_seconds", "How late the event loop ran a timer that was due.", SECONDS_BUCKETS)
+generations = Counter("gim_generations_total", "Generations served, by whether an in-flight generation was joined.")
+
+REGISTRY = [
+    lookup_seconds,
+    prompt_chars,
+    queue_wait_seconds,
+    model_load_seconds,
+    prefill_seconds,
+    decode_seconds,
+    ttft_seconds,
+    tokens_per_second,
+    request_seconds,
+    event_loop_lag_seconds,
+    generations,
+]
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_event_loop_lag(interval: float = 0.1):
+    """Sample how late the event loop wakes up a sleeping task, a busy loop delays every stream it serves"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - expected))
+
+
+class RequestStats:
+    """Timings of a single request, recorded into the histograms once the stream is over"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.lookup_seconds: float | None = None
+        self.prompt_chars: int | None = None
+        self.cache: str | None = None
+        self.ttft_seconds: float | None = None
+        self.tokens = 0
+        self.total_seconds: float | None = None
+        # Filled in from the generation, shared by every request that joined it
+        self.generation: dict = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def tokens_per_second(self) -> float | None:
+        # Prefer Ollama's own decode timings, they exclude queueing, model load and prefill
+        eval_count = self.generation.get("eval_count")
+        decode = self.generation.get("decode_seconds")
+        if eval_count and decode:
+            return eval_count / decode
+        if self.tokens and self.ttft_seconds is not None and self.total_seconds:
+            decode = self.total_seconds - self.ttft_seconds
+            return self.tokens / decode if decode > 0 else None
+        return None
+
+    def as_dict(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "lookup_seconds": self.lookup_seconds,
+            "prompt_chars": self.prompt_chars,
+            "cache": self.cache,
+            "queue_wait_seconds": self.generation.get("queue_wait_seconds"),
+            "model_load_seconds": self.generation.get("model_load_seconds"),
+            "prefill_seconds": self.generation.get("prefill_seconds"),
+            "decode_seconds": self.generation.get("decode_seconds"),
+            "ttft_seconds": self.ttft_seconds,
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens_per_second(),
+            "total_seconds": self.total_seconds,
+        }
+
+    def record(self):
+        labels = {"endpoint": self.endpoint}
+        if self.lookup_seconds is not None:
+            lookup_seconds.observe(self.lookup_seconds, **labels)
+        if self.prompt_chars is not None:
+            prompt_chars.observe(self.prompt_chars, **labels)
+        if self.cache is not None:
+            generations.inc(endpoint=self.endpoint, cache=self.cache)
+        # Generation level timings are only recorded by the request that started the generation
+        if self.cache == "miss":
+            for histogram, key in (
+                (queue_wait_seconds, "queue_wait_seconds"),
+                (model_load_seconds, "model_load_seconds"),
+                (prefill_seconds, "prefill_seconds"),
+                (decode_seconds, "decode_seconds"),
+            ):
+                if self.generation.get(key) is not None:
+                    histogram.observe(self.generation[key], **labels)
+        if self.ttft_seconds is not None:
+            ttft_seconds.observe(self.ttft_seconds, **labels)
+        rate = self.tokens_per_second()
+        if rate is not None:
+            tokens_per_second.observe(rate, **labels)
+        if self.total_seconds is not None:
+            request_seconds.observe(self.total_seconds, **labels)
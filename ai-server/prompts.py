@@ -24,12 +24,16 @@ def get_related_code_prompts(method, related_methods):
     {method}
     
     In your response you must explain the use of this method in each of the given code snippets, that are separated by "-". Your response must be plain text readable.
+    {"Some snippets do not use the method but contain similar logic. For those, explain how they relate to the method, and whether they look like duplicates of it." if any(rm.get("kind") == "similar" for rm in related_methods) else ""}
     {"-"*50}
     
 '''
     user_prompt = ''''''
     for rm in related_methods:
-        user_prompt+= f"Used in the file {rm["path"]}\n"
+        if rm.get("kind") == "similar":
+            user_prompt+= f"Similar code in the file {rm["path"]}\n"
+        else:
+            user_prompt+= f"Used in the file {rm["path"]}\n"
         user_prompt+= rm["method"]+"\n"
         user_prompt+= f"{"-"*50}\n"
     return sys_prompt, user_prompt
@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    """Lower values are scheduled first"""
+    INTERACTIVE = 0
+    BULK = 10
+
+
+class Scheduler:
+    """
+    Admission control in front of the inference backend.
+    At most max_concurrency jobs run at once, the rest wait in a priority queue
+    and are admitted by priority, then in arrival order.
+    A job cancelled while waiting simply gives up its place in the queue.
+    Jobs queued under a key can be moved up to a higher priority while they wait, see promote.
+    """
+
+    def __init__(self, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        self.queue: list[tuple[int, int, asyncio.Future]] = []
+        # Priority and future of the waiting jobs that were given a key
+        self.keyed: dict[str, tuple[int, asyncio.Future]] = {}
+        self._order = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        # A promoted job is in the queue more than once
+        return len({id(future) for _, _, future in self.queue if not future.done()})
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.INTERACTIVE, key: str | None = None):
+        await self.acquire(priority, key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE, key: str | None = None):
+        if self.running < self.max_concurrency and self.waiting == 0:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (int(priority), next(self._order), future))
+        if key is not None:
+            self.keyed[key] = (int(priority), future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over right before we were cancelled, pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if key is not None and self.keyed.get(key, (None, None))[1] is future:
+                del self.keyed[key]
+
+    def promote(self, key: str, priority: Priority) -> bool:
+        """
+        Move the job waiting under key up to priority, behind the jobs already waiting at that priority.
+        Returns False if no job is waiting under key, or it already waits at that priority or a higher one.
+        """
+        queued = self.keyed.get(key)
+        if queued is None or queued[0] <= int(priority) or queued[1].done():
+            return False
+        future = queued[1]
+        # The old entry stays in the heap, release skips it once the future is done
+        heapq.heappush(self.queue, (int(priority), next(self._order), future))
+        self.keyed[key] = (int(priority), future)
+        return True
+
+    def release(self):
+        # Hand the slot directly to the next live waiter, cancelled ones are skipped lazily
+        while self.queue:
+            _, _, future = heapq.heappop(self.queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
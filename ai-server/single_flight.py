@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+from typing import AsyncIterator, Callable
+
+
+def generation_key(model: str, sys_prompt: str, user_prompt: str) -> str:
+    """Hash identifying a generation, two requests with the same key produce the same answer"""
+    digest = hashlib.sha256()
+    for part in (model, sys_prompt, user_prompt):
+        encoded = part.encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") do not collide
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class Generation:
+    """
+    A single upstream generation that any number of subscribers can read from.
+    Every token produced so far is kept, so late joiners are replayed the
+    beginning of the answer before following the live stream.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.tokens: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        # Priority of the most urgent subscriber, lower values are more urgent
+        self.priority = 0
+        # Timings of the upstream generation, filled in by whoever produces the tokens
+        self.stats: dict = {}
+        self.task: asyncio.Task | None = None
+        # Only created while someone waits for the next token, so publishing to readers that are not waiting is free
+        self._changed: asyncio.Event | None = None
+        self._finished = asyncio.Event()
+
+    def publish(self, token: str):
+        self.tokens.append(token)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None):
+        self.done = True
+        self.error = error
+        self._finished.set()
+        self._notify()
+
+    def _notify(self):
+        # Wake everyone waiting on the current event, the next waiter creates a fresh one
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def wait(self, cursor: int, timeout: float | None = None) -> bool:
+        """Wait until there are tokens past cursor or the generation is done. Returns False on timeout"""
+        if cursor < len(self.tokens) or self.done:
+            return True
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        changed = self._changed
+        if timeout is None:
+            await changed.wait()
+            return True
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_done(self, timeout: float) -> bool:
+        """Wait until the generation is done, whatever it publishes meanwhile. Returns False on timeout"""
+        if self.done:
+            return True
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight generations, so that a burst of requests for
+    the same model and prompt results in one upstream stream fanned out to all of them.
+    Finished generations are forgotten, this is not a cache.
+    """
+
+    def __init__(self):
+        self.inflight: dict[str, Generation] = {}
+
+    def join(
+        self,
+        model: str,
+        sys_prompt: str,
+        user_prompt: str,
+        start: Callable[[Generation], AsyncIterator[str]],
+        priority: int = 0,
+    ) -> tuple[Generation, bool]:
+        """
+        Subscribe to the generation for the given prompts, starting it with start(generation) if none is in flight.
+        A more urgent priority than the generation's own raises it, start should schedule at generation.priority.
+        Returns the generation and whether an existing one was joined.
+        Every join must be matched by a leave.
+        """
+        key = generation_key(model, sys_prompt, user_prompt)
+        generation = self.inflight.get(key)
+        joined = generation is not None
+        if generation is None:
+            generation = Generation(key)
+            generation.priority = priority
+            self.inflight[key] = generation
+            generation.task = asyncio.create_task(self._pump(generation, start))
+        else:
+            generation.priority = min(generation.priority, priority)
+        generation.subscribers += 1
+        return generation, joined
+
+    def leave(self, generation: Generation):
+        """Unsubscribe, cancelling the upstream stream once nobody is listening anymore"""
+        generation.subscribers -= 1
+        if generation.subscribers <= 0 and not generation.done:
+            self._forget(generation)
+            if generation.task is not None:
+                generation.task.cancel()
+
+    async def _pump(self, generation: Generation, start: Callable[[Generation], AsyncIterator[str]]):
+        try:
+            async for token in start(generation):
+                generation.publish(token)
+            generation.finish()
+        except asyncio.CancelledError:
+            generation.finish(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            generation.finish(e)
+        finally:
+            self._forget(generation)
+
+    def _forget(self, generation: Generation):
+        if self.inflight.get(generation.key) is generation:
+            del self.inflight[generation.key]
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+from typing import AsyncGenerator
+
+from single_flight import Generation
+
+# Coalesced frames are flushed once they are this old, and split so none holds much more than this many characters
+FLUSH_INTERVAL = float(os.environ.get("GIM_STREAM_FLUSH_INTERVAL", "0.03"))
+FLUSH_CHARS = int(os.environ.get("GIM_STREAM_FLUSH_CHARS", "512"))
+# How often a waiting stream checks whether its client is still connected, in seconds
+DISCONNECT_POLL_INTERVAL = 0.5
+
+_encode = json.JSONEncoder().encode
+
+
+def sse_event(payload: dict, event: str | None = None) -> str:
+    if event is not None:
+        return f"event: {event}\ndata: {_encode(payload)}\n\n"
+    return f"data: {_encode(payload)}\n\n"
+
+
+async def read_frames(
+    generation: Generation, coalesce: bool = True, request=None
+) -> AsyncGenerator[str, None]:
+    """
+    Read the tokens of a generation as frames of text.
+    Without coalescing every token is its own frame, otherwise the tokens of FLUSH_INTERVAL are batched
+    into frames of about FLUSH_CHARS at most. While a frame fills up the reader sleeps until its deadline
+    or the end of the generation, so a busy stream costs one wakeup per frame instead of one per token.
+    When the starlette request is given, reading stops as soon as the client disconnects.
+    """
+    cursor = 0
+    while True:
+        if not await generation.wait(cursor, DISCONNECT_POLL_INTERVAL):
+            # Nothing produced yet, either queued or the model is still loading
+            if request is not None and await request.is_disconnected():
+                print(f"Client disconnected, leaving generation {generation.key[:12]}")
+                return
+            continue
+
+        tokens = generation.tokens
+        if not coalesce:
+            while cursor < len(tokens):
+                yield tokens[cursor]
+                cursor += 1
+        elif cursor < len(tokens):
+            # Not woken by the tokens published meanwhile, only by the deadline or the end
+            await generation.wait_done(FLUSH_INTERVAL)
+            end = len(tokens)
+            start = cursor
+            size = 0
+            # Measured once the frame is complete, a frame may overshoot FLUSH_CHARS by its last token
+            while cursor < end:
+                size += len(tokens[cursor])
+                cursor += 1
+                if size >= FLUSH_CHARS and cursor < end:
+                    yield "".join(tokens[start:cursor])
+                    start = cursor
+                    size = 0
+            yield "".join(tokens[start:end])
+
+        if generation.done and cursor >= len(tokens):
+            if generation.error is not None:
+                raise generation.error
+            return
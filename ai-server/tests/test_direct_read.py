@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+import pytest
+
+import helpers
+from main import get_methods_for_prompts, get_methods_for_related_code
+
+# The tables the reader uses, in the layout of the sqlite-server's database
+SCHEMA = """
+    CREATE TABLE documents (id INTEGER PRIMARY KEY, path TEXT);
+    CREATE TABLE classes (id INTEGER PRIMARY KEY, name TEXT, document_id INTEGER);
+    CREATE TABLE methods (
+        id INTEGER PRIMARY KEY, signature TEXT, body TEXT, class_id INTEGER, document_id INTEGER,
+        start_line INTEGER, end_line INTEGER
+    );
+    CREATE TABLE method_calls (id INTEGER PRIMARY KEY, caller_id INTEGER, callee_id INTEGER);
+"""
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, "SQLITE_SERVER_DIR", str(tmp_path))
+    monkeypatch.setattr(helpers, "API_BASE", "http://localhost:1/")
+    monkeypatch.setattr(helpers, "_index_readers", {})
+    conn = sqlite3.connect(str(tmp_path / "database.db"))
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT INTO documents (id, path) VALUES (1, '/src/Orders.cs')")
+    conn.execute("INSERT INTO classes (id, name, document_id) VALUES (1, 'App.Orders', 1)")
+    conn.executemany(
+        "INSERT INTO methods (id, signature, body, class_id, document_id, start_line, end_line) VALUES (?, ?, ?, 1, 1, 1, 2)",
+        [(1, "App.Orders.Total()", "{ return Sum(lines); }"), (2, "App.Orders.Sum(int)", "{ return 0; }")],
+    )
+    conn.execute("INSERT INTO method_calls (caller_id, callee_id) VALUES (1, 2)")
+    conn.commit()
+    yield conn
+    for reader in helpers._index_readers.values():
+        reader.close()
+    conn.close()
+
+
+def test_prompts_are_built_from_the_database(index):
+    method, used_methods = get_methods_for_prompts("App.Orders.Total()", "/src/Orders.cs")
+    assert method == "App.Orders.Total()\n\t\t{ return Sum(lines); }"
+    assert used_methods == "App.Orders.Sum(int)\n\t\t{ return 0; }"
+    with pytest.raises(LookupError):
+        helpers.get_method_context("App.Orders.Missing()", "/src/Orders.cs")
+
+
+def test_remote_or_missing_databases_are_not_read(index, monkeypatch):
+    assert helpers.get_index_reader("/not/indexed") is None
+    monkeypatch.setattr(helpers, "API_BASE", "http://index.example.com:8000/")
+    assert helpers.get_index_reader() is None
+
+
+def test_similar_methods_are_asked_from_the_sqlite_server(index, monkeypatch):
+    asked = []
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {
+                "method": {"method_id": 1, "method_signature": "App.Orders.Total()", "method_body": "{ }"},
+                "callees": [], "callers": [], "similar": [],
+            }
+
+    def get(url, params):
+        asked.append((url, params["similar"]))
+        return Response()
+
+    monkeypatch.setattr(helpers.requests, "get", get)
+    get_methods_for_related_code("App.Orders.Total()", "/src/Orders.cs")
+    assert asked == [("http://localhost:1/method-context", helpers.SIMILAR_METHODS)]
+    assert helpers._index_readers == {}
+
+
+def test_concurrent_requests_share_one_reader(index):
+    barrier = threading.Barrier(8)
+    readers = []
+
+    def open_reader():
+        barrier.wait()
+        readers.append(helpers.get_index_reader())
+
+    threads = [threading.Thread(target=open_reader) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(reader) for reader in readers}) == 1
+    assert len(helpers._index_readers) == 1
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+from scheduler import Priority, Scheduler
+from single_flight import SingleFlight, generation_key
+from streaming import read_frames
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_generation_key_separates_parts():
+    assert generation_key("m", "ab", "c") != generation_key("m", "a", "bc")
+    assert generation_key("m", "s", "u") == generation_key("m", "s", "u")
+
+
+def test_identical_requests_share_one_stream():
+    async def scenario():
+        inflight = SingleFlight()
+        started = 0
+
+        async def start(generation):
+            nonlocal started
+            started += 1
+            for token in ("a", "b", "c"):
+                await asyncio.sleep(0)
+                yield token
+
+        first, first_joined = inflight.join("m", "s", "u", start)
+        second, second_joined = inflight.join("m", "s", "u", start)
+        tokens = await asyncio.gather(
+            *(collect(generation) for generation in (first, second))
+        )
+        inflight.leave(first)
+        inflight.leave(second)
+        return first is second, first_joined, second_joined, started, tokens, inflight.inflight
+
+    same, first_joined, second_joined, started, tokens, remaining = run(scenario())
+    assert same and not first_joined and second_joined
+    assert started == 1
+    assert tokens == [["a", "b", "c"], ["a", "b", "c"]]
+    assert remaining == {}
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def scenario():
+        inflight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def start(generation):
+            try:
+                await asyncio.sleep(60)
+                yield "never"
+            finally:
+                cancelled.set()
+
+        generation, _ = inflight.join("m", "s", "u", start)
+        await asyncio.sleep(0)
+        inflight.leave(generation)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return inflight.inflight
+
+    assert run(scenario()) == {}
+
+
+def test_joining_keeps_most_urgent_priority():
+    async def scenario():
+        inflight = SingleFlight()
+
+        async def start(generation):
+            await asyncio.sleep(60)
+            yield "never"
+
+        generation, _ = inflight.join("m", "s", "u", start, Priority.BULK)
+        inflight.join("m", "s", "u", start, Priority.INTERACTIVE)
+        inflight.join("m", "s", "u", start, Priority.BULK)
+        priority = generation.priority
+        for _ in range(3):
+            inflight.leave(generation)
+        return priority
+
+    assert run(scenario()) == Priority.INTERACTIVE
+
+
+def test_scheduler_admits_by_priority_then_arrival():
+    async def scenario():
+        scheduler = Scheduler(1)
+        order = []
+        await scheduler.acquire()
+
+        async def job(name, priority):
+            async with scheduler.slot(priority):
+                order.append(name)
+
+        jobs = [
+            asyncio.create_task(job("bulk-1", Priority.BULK)),
+            asyncio.create_task(job("bulk-2", Priority.BULK)),
+            asyncio.create_task(job("interactive", Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*jobs)
+        return order
+
+    assert run(scenario()) == ["interactive", "bulk-1", "bulk-2"]
+
+
+def test_promoted_job_is_admitted_before_other_bulk_jobs():
+    async def scenario():
+        scheduler = Scheduler(1)
+        order = []
+        await scheduler.acquire()
+
+        async def job(name, key=None):
+            async with scheduler.slot(Priority.BULK, key):
+                order.append(name)
+
+        jobs = [asyncio.create_task(job(name, name)) for name in ("bulk-1", "bulk-2", "joined")]
+        await asyncio.sleep(0)
+        waiting = scheduler.waiting
+        assert scheduler.promote("joined", Priority.INTERACTIVE)
+        # Already at that priority, and no job under the key
+        assert not scheduler.promote("joined", Priority.INTERACTIVE)
+        assert not scheduler.promote("unknown", Priority.INTERACTIVE)
+        promoted_waiting = scheduler.waiting
+        scheduler.release()
+        await asyncio.gather(*jobs)
+        return order, waiting, promoted_waiting, scheduler.keyed, scheduler.running
+
+    order, waiting, promoted_waiting, keyed, running = run(scenario())
+    assert order == ["joined", "bulk-1", "bulk-2"]
+    assert waiting == promoted_waiting == 3
+    assert keyed == {}
+    assert running == 0
+
+
+def test_interactive_join_promotes_queued_bulk_generation():
+    async def scenario():
+        scheduler = Scheduler(1)
+        inflight = SingleFlight()
+        order = []
+        await scheduler.acquire()
+
+        def start(name):
+            async def tokens(generation):
+                async with scheduler.slot(Priority(generation.priority), generation.key):
+                    order.append(name)
+                    yield name
+            return tokens
+
+        other = asyncio.create_task(bulk_job(scheduler, order))
+        bulk, _ = inflight.join("m", "s", "shared", start("shared"), Priority.BULK)
+        await asyncio.sleep(0)
+        joined, was_joined = inflight.join("m", "s", "shared", start("shared"), Priority.INTERACTIVE)
+        assert was_joined
+        scheduler.promote(joined.key, Priority(joined.priority))
+        scheduler.release()
+        await asyncio.gather(other, collect(bulk))
+        inflight.leave(bulk)
+        inflight.leave(joined)
+        return order
+
+    assert run(scenario()) == ["shared", "other"]
+
+
+async def bulk_job(scheduler, order):
+    async with scheduler.slot(Priority.BULK):
+        order.append("other")
+
+
+async def collect(generation):
+    return [token async for token in read_frames(generation, coalesce=False)]
+
+
+@pytest.mark.parametrize("max_concurrency", [0, -1])
+def test_scheduler_needs_a_slot(max_concurrency):
+    with pytest.raises(ValueError):
+        Scheduler(max_concurrency)
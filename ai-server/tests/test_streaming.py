@@ -0,0 +1,78 @@
+import asyncio
+
+import streaming
+from single_flight import Generation
+from streaming import read_frames
+
+
+class CountingGeneration(Generation):
+    """Counts how often a reader is woken up"""
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        self.wakeups = 0
+
+    async def wait(self, cursor, timeout=None):
+        result = await super().wait(cursor, timeout)
+        self.wakeups += 1
+        return result
+
+    async def wait_done(self, timeout):
+        result = await super().wait_done(timeout)
+        self.wakeups += 1
+        return result
+
+
+async def produce(generation, tokens, pause):
+    for token in tokens:
+        generation.publish(token)
+        await asyncio.sleep(pause)
+    generation.finish()
+
+
+def read(generation, tokens, pause=0.0005, coalesce=True):
+    async def scenario():
+        producer = asyncio.create_task(produce(generation, tokens, pause))
+        frames = [frame async for frame in read_frames(generation, coalesce)]
+        await producer
+        return frames
+
+    return asyncio.run(scenario())
+
+
+def test_coalesced_reader_wakes_per_frame_not_per_token():
+    generation = CountingGeneration("key")
+    tokens = [f"t{i} " for i in range(300)]
+    frames = read(generation, tokens)
+    assert "".join(frames) == "".join(tokens)
+    assert len(frames) < len(tokens) / 5
+    # One wakeup for the first token of a frame and one for its deadline, plus the end
+    assert generation.wakeups <= 2 * len(frames) + 2
+
+
+def test_frames_are_split_at_the_size_limit(monkeypatch):
+    monkeypatch.setattr(streaming, "FLUSH_CHARS", 10)
+    monkeypatch.setattr(streaming, "FLUSH_INTERVAL", 60)
+    generation = CountingGeneration("key")
+    frames = read(generation, ["abcd"] * 7, pause=0)
+    assert frames == ["abcdabcdabcd", "abcdabcdabcd", "abcd"]
+
+
+def test_uncoalesced_reader_gets_every_token():
+    generation = CountingGeneration("key")
+    assert read(generation, ["a", "b", "c"], coalesce=False) == ["a", "b", "c"]
+
+
+def test_error_is_raised_after_the_last_frame():
+    async def scenario():
+        generation = Generation("key")
+        generation.publish("partial")
+        generation.finish(RuntimeError("upstream failed"))
+        frames = []
+        try:
+            async for frame in read_frames(generation):
+                frames.append(frame)
+        except RuntimeError as e:
+            return frames, str(e)
+
+    assert asyncio.run(scenario()) == (["partial"], "upstream failed")
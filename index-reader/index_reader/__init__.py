@@ -0,0 +1,156 @@
+"""
+Read side of the index, shared by the sqlite-server and the ai-server, which both depend on this package.
+
+The sqlite-server runs read_method_context on its own connections for /method-context.
+The ai-server, when it runs on the same machine, opens the database itself through IndexReader
+instead of asking the sqlite-server over HTTP. IndexReader connections are read only, and the
+database is in WAL mode, so they never block the sqlite-server and always see its last commit.
+
+Nothing in this package writes, and only the standard library is needed. The vectors for similar methods
+stay in the sqlite-server, so they are kept in memory once.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from index_reader import queries
+
+# Bytes of the database file mapped into memory by read only connections, reads then skip a copy
+MMAP_SIZE = int(os.environ.get("GIM_READER_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Prepared statements each read only connection keeps
+CACHED_STATEMENTS = 256
+
+
+@contextmanager
+def read_transaction(conn: sqlite3.Connection):
+    """
+    Everything read inside sees the database as of one moment. Joins the transaction conn is already in,
+    otherwise starts one and rolls it back afterwards.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+
+def walk_calls(cursor, method_id: int, direction: str, depth: int, limit: int) -> dict[int, int]:
+    """
+    Breadth first walk of the call graph from method_id, following callees or callers.
+    Returns the id of every method reached, up to limit of them, with the depth it was first reached at.
+    """
+    query = queries.CALLEES_OF if direction == "callees" else queries.CALLERS_OF
+    found: dict[int, int] = {}
+    seen = {method_id}
+    frontier = [method_id]
+    for level in range(1, depth + 1):
+        if not frontier or len(found) >= limit:
+            break
+        cursor.execute(query, (json.dumps(frontier),))
+        frontier = []
+        for (reached,) in cursor.fetchall():
+            if reached in seen:
+                continue
+            seen.add(reached)
+            found[reached] = level
+            frontier.append(reached)
+            if len(found) >= limit:
+                break
+    return found
+
+
+def context_rows(cursor, depths: dict[int, int]) -> list[dict]:
+    if not depths:
+        return []
+    cursor.execute(queries.CONTEXT_METHODS_BY_IDS, (json.dumps(list(depths)),))
+    rows = [{**dict(row), "depth": depths[row["method_id"]]} for row in cursor.fetchall()]
+    rows.sort(key=lambda row: (row["depth"], row["method_id"]))
+    return rows
+
+
+def read_method_context(
+    conn: sqlite3.Connection,
+    signature: str,
+    file_name: str,
+    depth: int = 1,
+    max_callees: int = 20,
+    max_callers: int = 20,
+    similar: int = 0,
+    embedding_index=None,
+) -> dict | None:
+    """
+    The method with its callees and callers up to depth calls away, and its similar methods when given
+    an embedding index, in the format of /method-context. None if there is no such method.
+    All of it is read in one transaction, so it is consistent even while the indexes are being updated.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    with read_transaction(conn):
+        cursor.execute(queries.CONTEXT_METHOD_BY_SIGNATURE, (signature, file_name))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        method = dict(row)
+        method_id = method["method_id"]
+
+        callees = context_rows(cursor, walk_calls(cursor, method_id, "callees", depth, max_callees))
+        callers = context_rows(cursor, walk_calls(cursor, method_id, "callers", depth, max_callers))
+
+        similar_methods = []
+        if similar > 0 and embedding_index is not None:
+            vector = embedding_index.vector_of(method_id)
+            if vector is not None:
+                matches = embedding_index.search(vector, similar, exclude=method_id)
+                scores = dict(matches)
+                rows = context_rows(cursor, {match_id: 0 for match_id, _ in matches})
+                similar_methods = sorted(
+                    ({**row, "score": scores[row["method_id"]]} for row in rows),
+                    key=lambda row: -row["score"],
+                )
+        return {"method": method, "callees": callees, "callers": callers, "similar": similar_methods}
+
+
+def open_read_only(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        f"file:{quote(os.path.abspath(path))}?mode=ro",
+        uri=True,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+class IndexReader:
+    """
+    Read only access to one index database, for processes other than the sqlite-server.
+    Every thread keeps its own connection open, so the statements it prepared stay cached.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = open_read_only(self.path)
+        return conn
+
+    def method_context(self, signature: str, file_name: str, **params) -> dict | None:
+        """The method with its callees and callers, see read_method_context. Similar methods are not read here"""
+        return read_method_context(self.connection(), signature, file_name, **params)
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
@@ -0,0 +1,23 @@
+import hashlib
+import os
+import re
+
+DB_NAME = "database.db"
+# Every workspace gets a database file of its own in this directory, see shard_path
+SHARDS_DIR = os.environ.get("GIM_SHARDS_DIR", "shards")
+
+
+def shard_path(workspace: str | None) -> str:
+    """
+    Database file of a workspace, given as the path of its solution or folder.
+    Readable name first, then a hash of the full path, so two folders with the same name do not collide.
+    Without a workspace it is the shared DB_NAME. Relative to the directory the sqlite-server runs in.
+    """
+    if not workspace:
+        return DB_NAME
+    # The extension may run on Windows while the server does not, so both separators are handled
+    normalized = os.path.normcase(os.path.normpath(workspace.strip())).rstrip("\\/")
+    base = re.split(r"[\\/]", normalized)[-1]
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "-", base).strip("-.") or "workspace"
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(SHARDS_DIR, f"{name[:48]}-{digest}.db")
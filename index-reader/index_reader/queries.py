@@ -0,0 +1,269 @@
+# Registry of every read query the sqlite-server runs: the endpoints, the change log, maintenance and the embedding index,
+# and of the ones IndexReader runs in the ai-server.
+# The sqlite-server's ingest in update_indexes.py keeps its lookups inline next to the writes they belong to, and its
+# snapshots.py counts rows on temporary copies of the database, their SQL is fixed text all the same.
+# The SQL is written once here, at import, and always executed with parameters, so the text of a query never changes.
+# Together with the long lived connections of the sqlite-server's database.py and of IndexReader this lets sqlite3's statement cache
+# prepare each query once per connection instead of once per request.
+# Variable length id lists are passed as one JSON array parameter and unpacked with json_each,
+# so they do not produce a new statement for every list length.
+
+QUERIES: dict[str, str] = {}
+
+
+def register(name: str, sql: str) -> str:
+    # Collapse whitespace so the cached statement is the same whatever the indentation here
+    QUERIES[name] = " ".join(sql.split())
+    return QUERIES[name]
+
+
+SELECT_PROJECTS = register("select_projects", "SELECT * FROM projects")
+SELECT_DOCUMENTS = register("select_documents", "SELECT * FROM documents")
+SELECT_CLASSES = register("select_classes", "SELECT * FROM classes")
+SELECT_METHODS = register("select_methods", "SELECT * FROM methods")
+SELECT_METHOD_CALLS = register("select_method_calls", "SELECT * FROM method_calls")
+
+# Understanding this query:
+# Firstly, it selects from the methods table as the primary table.
+# it joins the classes, documents, and projects tables to get the context of each method.
+# The context being the: class it belongs to, the document it is in, and the project it is part of.
+# The document is the method's own, a partial class has methods in several documents.
+# Furthermore it left joins the method_calls table twice to get both the methods that are called
+# by the current method (callees)
+# and the methods that call the current method (callers).
+# Finally, it groups the results by method.id to ensure each method is represented once in the final output,
+# with aggregated lists of its callees and callers.
+# See @type FetchAllResponse for the expected output format.
+FETCH_ALL = register("fetch_all", """
+    SELECT
+        prj.id AS project_id,
+        prj.name AS project_name,
+        doc.id AS document_id,
+        doc.path AS document_path,
+        class.id AS class_id,
+        class.name AS class_name,
+        method.id AS method_id,
+        method.name AS method_name,
+        method.signature AS method_signature,
+        method.start_line AS method_start_line,
+        method.end_line AS method_end_line,
+        method.body AS method_body,
+        JSON_GROUP_ARRAY(DISTINCT JSON_OBJECT('id', callee_method.id, 'signature', callee_method.signature))
+            FILTER (WHERE callee_method.id IS NOT NULL) AS callees,
+        JSON_GROUP_ARRAY(DISTINCT JSON_OBJECT('id', caller_method.id, 'signature', caller_method.signature))
+            FILTER (WHERE caller_method.id IS NOT NULL) AS callers
+    FROM methods method
+    JOIN classes class ON method.class_id = class.id
+    JOIN documents doc ON method.document_id = doc.id
+    JOIN projects prj ON doc.project_id = prj.id
+    LEFT JOIN method_calls callee_join ON method.id = callee_join.caller_id
+    LEFT JOIN methods callee_method ON callee_join.callee_id = callee_method.id
+    LEFT JOIN method_calls caller_join ON method.id = caller_join.callee_id
+    LEFT JOIN methods caller_method ON caller_join.caller_id = caller_method.id
+    GROUP BY method.id
+""")
+
+METHOD_FROM_SIGNATURE = register("method_from_signature", """
+    SELECT methods.id AS method_id, methods.signature AS method_signature, methods.body AS method_body
+    FROM methods
+    JOIN classes ON methods.class_id = classes.id
+    JOIN documents ON methods.document_id = documents.id
+    WHERE methods.signature = ? AND documents.path = ?
+""")
+
+METHOD_BY_ID = register("method_by_id", """
+    SELECT id AS method_id, signature AS method_signature, body AS method_body
+    FROM methods
+    WHERE id = ?
+""")
+
+USED_METHODS = register("used_methods", """
+    SELECT methods.id AS method_id, methods.signature AS method_signature, documents.path AS document_path
+    FROM method_calls
+    JOIN methods ON method_calls.callee_id = methods.id
+    JOIN classes ON methods.class_id = classes.id
+    JOIN documents ON methods.document_id = documents.id
+    WHERE method_calls.caller_id = ?
+    GROUP BY methods.id
+""")
+
+RELATED_METHODS = register("related_methods", """
+    SELECT methods.id AS method_id, methods.signature AS method_signature, documents.path AS document_path
+    FROM method_calls
+    JOIN methods ON method_calls.caller_id = methods.id
+    JOIN classes ON methods.class_id = classes.id
+    JOIN documents ON methods.document_id = documents.id
+    WHERE method_calls.callee_id = ?
+    GROUP BY methods.id
+""")
+
+# Methods with their body, document path and line range, see /method-context
+_CONTEXT_METHODS = """
+    SELECT
+        methods.id AS method_id,
+        methods.signature AS method_signature,
+        methods.body AS method_body,
+        documents.path AS document_path,
+        methods.start_line AS start_line,
+        methods.end_line AS end_line
+    FROM methods
+    JOIN classes ON methods.class_id = classes.id
+    JOIN documents ON methods.document_id = documents.id
+"""
+CONTEXT_METHOD_BY_SIGNATURE = register(
+    "context_method_by_signature",
+    _CONTEXT_METHODS + " WHERE methods.signature = ? AND documents.path = ?",
+)
+# Takes a JSON array of method ids
+CONTEXT_METHODS_BY_IDS = register(
+    "context_methods_by_ids",
+    _CONTEXT_METHODS + " WHERE methods.id IN (SELECT value FROM json_each(?))",
+)
+
+# Both take a JSON array of method ids, the frontier of a breadth first walk of the call graph
+CALLEES_OF = register("callees_of", """
+    SELECT DISTINCT callee_id FROM method_calls
+    WHERE caller_id IN (SELECT value FROM json_each(?))
+    ORDER BY callee_id
+""")
+CALLERS_OF = register("callers_of", """
+    SELECT DISTINCT caller_id FROM method_calls
+    WHERE callee_id IN (SELECT value FROM json_each(?))
+    ORDER BY caller_id
+""")
+
+# Methods with their class and location but without bodies, see the Method Lookup endpoints
+_METHOD_LOCATIONS = """
+    SELECT
+        methods.id AS method_id,
+        methods.signature AS method_signature,
+        classes.id AS class_id,
+        classes.name AS class_name,
+        documents.path AS document_path,
+        methods.start_line AS start_line,
+        methods.end_line AS end_line
+    FROM methods
+    JOIN classes ON methods.class_id = classes.id
+    JOIN documents ON methods.document_id = documents.id
+"""
+METHODS_IN_RANGE = register(
+    "methods_in_range",
+    _METHOD_LOCATIONS + """
+    WHERE documents.path = ? AND methods.start_line <= ? AND methods.end_line >= ?
+    ORDER BY methods.start_line, methods.id
+""")
+CLASS_METHODS = register(
+    "class_methods",
+    _METHOD_LOCATIONS + " WHERE classes.id = ? ORDER BY methods.start_line, methods.id",
+)
+# Range scan instead of LIKE, so % and _ in signatures are not wildcards. Takes the prefix, the prefix
+# followed by the highest code point, and a limit
+METHODS_BY_PREFIX = register(
+    "methods_by_prefix",
+    _METHOD_LOCATIONS + """
+    WHERE methods.signature >= ? AND methods.signature < ?
+    ORDER BY methods.signature
+    LIMIT ?
+""")
+
+# Both take a JSON array of ids, the rows of the documents and methods in a delta of the change log, see /changes
+METHOD_LOCATIONS_BY_IDS = register(
+    "method_locations_by_ids",
+    _METHOD_LOCATIONS + " WHERE methods.id IN (SELECT value FROM json_each(?))",
+)
+DOCUMENTS_BY_IDS = register("documents_by_ids", """
+    SELECT documents.id AS document_id, documents.path AS document_path, projects.name AS project_name
+    FROM documents
+    JOIN projects ON documents.project_id = projects.id
+    WHERE documents.id IN (SELECT value FROM json_each(?))
+""")
+
+# Change log, see change_log.py
+LATEST_GENERATION = register("latest_generation", "SELECT COALESCE(MAX(id), 0) FROM generations")
+OLDEST_GENERATION = register("oldest_generation", "SELECT MIN(id) FROM generations")
+RESET_AFTER = register("reset_after", "SELECT 1 FROM generations WHERE id > ? AND reset = 1")
+CHANGES_AFTER = register("changes_after", """
+    SELECT kind, entity_id, change FROM changes
+    WHERE generation > ?
+    ORDER BY generation
+""")
+# Takes a JSON array of method ids
+DOCUMENTS_OF_METHODS = register("documents_of_methods", """
+    SELECT DISTINCT document_id FROM methods
+    WHERE id IN (SELECT value FROM json_each(?)) AND document_id IS NOT NULL
+""")
+
+# Embedding index, see embeddings.py. Stored vectors only count when made by the embedder in use,
+# so these take its name and dimension
+STORED_VECTORS = register("stored_vectors", """
+    SELECT method_id, vector FROM method_embeddings
+    WHERE model = ? AND dim = ?
+""")
+# Takes a JSON array of method ids first
+STORED_VECTORS_BY_IDS = register("stored_vectors_by_ids", """
+    SELECT method_id, vector FROM method_embeddings
+    WHERE method_id IN (SELECT value FROM json_each(?)) AND model = ? AND dim = ?
+""")
+UNEMBEDDED_METHODS = register("unembedded_methods", """
+    SELECT m.id FROM methods m LEFT JOIN method_embeddings e ON e.method_id = m.id
+    WHERE e.method_id IS NULL OR e.model != ? OR e.dim != ?
+""")
+# Takes a JSON array of method ids, the text of each method and what its stored vector was made from
+EMBEDDING_STATE_BY_IDS = register("embedding_state_by_ids", """
+    SELECT m.id, m.signature, m.body, e.text_hash, e.model, e.dim
+    FROM methods m LEFT JOIN method_embeddings e ON e.method_id = m.id
+    WHERE m.id IN (SELECT value FROM json_each(?))
+""")
+
+# Garbage collection, see maintenance.ORPHANS. Keys of the rows nothing refers to any more
+ORPHANED_CLASSES = register("orphaned_classes", """
+    SELECT id FROM classes
+    WHERE document_id IS NULL OR NOT EXISTS (SELECT 1 FROM documents WHERE documents.id = classes.document_id)
+""")
+ORPHANED_METHODS = register("orphaned_methods", """
+    SELECT id FROM methods WHERE NOT EXISTS (SELECT 1 FROM classes WHERE classes.id = methods.class_id)
+""")
+DANGLING_CALLS = register("dangling_calls", """
+    SELECT id FROM method_calls
+    WHERE NOT EXISTS (SELECT 1 FROM methods WHERE methods.id = method_calls.caller_id)
+        OR NOT EXISTS (SELECT 1 FROM methods WHERE methods.id = method_calls.callee_id)
+""")
+DANGLING_EMBEDDINGS = register("dangling_embeddings", """
+    SELECT method_id FROM method_embeddings
+    WHERE NOT EXISTS (SELECT 1 FROM methods WHERE methods.id = method_embeddings.method_id)
+""")
+EMPTY_DOCUMENTS = register("empty_documents", """
+    SELECT id FROM documents
+    WHERE NOT EXISTS (SELECT 1 FROM classes WHERE classes.document_id = documents.id)
+        AND NOT EXISTS (SELECT 1 FROM methods WHERE methods.document_id = documents.id)
+""")
+EMPTY_PROJECTS = register("empty_projects", """
+    SELECT id FROM projects WHERE NOT EXISTS (SELECT 1 FROM documents WHERE documents.project_id = projects.id)
+""")
+# Takes a JSON array of method_calls ids, the callers that still exist
+CALLERS_OF_CALLS = register("callers_of_calls", """
+    SELECT DISTINCT caller_id FROM method_calls
+    WHERE id IN (SELECT value FROM json_each(?)) AND caller_id IN (SELECT id FROM methods)
+""")
+
+
+def workspace_method_locations(schema: str, shard: int) -> str:
+    """
+    METHODS_BY_PREFIX over the tables of an attached workspace database, as one part of a UNION ALL across several.
+    Tagged with the shard's position, takes the prefix and the prefix followed by the highest code point.
+    """
+    return " ".join(f"""
+        SELECT
+            {shard} AS shard,
+            methods.id AS method_id,
+            methods.signature AS method_signature,
+            classes.id AS class_id,
+            classes.name AS class_name,
+            documents.path AS document_path,
+            methods.start_line AS start_line,
+            methods.end_line AS end_line
+        FROM {schema}.methods AS methods
+        JOIN {schema}.classes AS classes ON methods.class_id = classes.id
+        JOIN {schema}.documents AS documents ON methods.document_id = documents.id
+        WHERE methods.signature >= ? AND methods.signature < ?
+    """.split())
@@ -133,7 +133,13 @@ static async Task ProcessRequestAsync(HttpListenerContext context)
             var sqlServerContent = new StringContent(JsonSerializer.Serialize(analysisResults, options), Encoding.UTF8, "application/json");
             try
             {
-                var sqlServerRequest = new HttpRequestMessage(HttpMethod.Post, "http://127.0.0.1:8000/update-indexes")
+                // The SQL server keeps a database per workspace, the path goes in the query since headers must be ASCII
+                var sqlServerUrl = "http://127.0.0.1:8000/update-indexes";
+                if (payload.TryGetValue("workspace", out var workspacePath) && !string.IsNullOrEmpty(workspacePath))
+                {
+                    sqlServerUrl += $"?workspace={Uri.EscapeDataString(workspacePath)}";
+                }
+                var sqlServerRequest = new HttpRequestMessage(HttpMethod.Post, sqlServerUrl)
                 {
                     Content = sqlServerContent
                 };
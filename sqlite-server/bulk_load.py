@@ -0,0 +1,177 @@
+"""
+Loads analyzer output (analysis-<timestamp>.json, a JSON array of projects as posted to /update-indexes)
+straight into the database, without going through the server.
+The file is parsed incrementally, one project at a time, so its size does not matter.
+
+    python bulk_load.py analysis-20250101120000.json [more files...] [--db database.db | --workspace PATH] [--batch 500]
+
+The server may keep running meanwhile. Every batch is a generation in the change log, and the server catches up
+with generations committed by other processes the next time it reads its in memory indexes, the columnar snapshot
+within GIM_EXTERNAL_WRITES_INTERVAL seconds.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import Iterator
+
+import change_log
+from database import DB_NAME, connect, ensure_schema, shard_path
+from models import ProjectBody
+from update_indexes import UpdateIndexes
+
+READ_CHUNK = 1 << 20
+_WHITESPACE = " \t\r\n"
+
+
+def iter_json_array(f, chunk_size: int = READ_CHUNK) -> Iterator[dict]:
+    """Yield the items of the top level JSON array in the text file f, reading it chunk by chunk"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    started = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        # Drop what has been parsed already, so the buffer stays around one chunk in size
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position == len(buffer):
+            if eof or not fill():
+                break
+            continue
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise ValueError("Expected a JSON array of projects")
+            started = True
+            position += 1
+            continue
+        if char == ",":
+            position += 1
+            continue
+        if char == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The item continues past the end of the buffer
+            if eof or not fill():
+                raise
+            continue
+        position = end
+        yield item
+    if started:
+        raise ValueError("Unexpected end of file inside the JSON array")
+
+
+def bulk_load(conn: sqlite3.Connection, paths: list[str], batch: int = 500, verbose: bool = False) -> dict:
+    """
+    Load every project in the analyzer files at paths, committing once per batch of projects.
+    Every batch is a generation of its own in the change log, committed together with the vectors of its methods.
+    Returns counts and timings.
+    """
+    from embeddings import EmbeddingIndex, load_embedder
+
+    started = time.perf_counter()
+    ensure_schema(conn)
+    # Only the commits at the end of each batch need to be durable
+    conn.execute("PRAGMA synchronous = NORMAL")
+    embedding_index = EmbeddingIndex(load_embedder())
+    projects = 0
+    errors = 0
+    methods_changed = 0
+    embedded = 0
+    embed_seconds = 0.0
+    generations = []
+    generation = change_log.PendingGeneration(conn, "bulk-load")
+    changed_method_ids = []
+
+    def commit_batch():
+        nonlocal generation, changed_method_ids, embedded, embed_seconds
+        embedding_started = time.perf_counter()
+        embedded += embedding_index.refresh(conn, changed_method_ids, commit=False)
+        embed_seconds += time.perf_counter() - embedding_started
+        conn.commit()
+        if generation.id is not None:
+            generations.append(generation.id)
+        generation = change_log.PendingGeneration(conn, "bulk-load")
+        changed_method_ids = []
+
+    for path in paths:
+        with open(path, encoding="utf-8-sig") as f:
+            for item in iter_json_array(f):
+                # A project that fails is rolled back on its own, the rest of the batch is kept
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                conn.execute("SAVEPOINT project")
+                generation_id = generation.id
+                try:
+                    updater = UpdateIndexes(
+                        ProjectBody.model_validate(item),
+                        conn=conn,
+                        autocommit=False,
+                        generation=generation,
+                        verbose=verbose,
+                    )
+                    result = updater.process()
+                    if "error" in result:
+                        raise ValueError(result["error"])
+                except Exception as e:
+                    conn.execute("ROLLBACK TO project")
+                    conn.execute("RELEASE project")
+                    # The generation is rolled back too if this project started it
+                    generation.id = generation_id
+                    errors += 1
+                    document = item.get("Document") if isinstance(item, dict) else None
+                    print(f"[BULK LOAD] {document}: {e}")
+                    continue
+                conn.execute("RELEASE project")
+                changed_method_ids.extend(updater.changed_method_ids)
+                methods_changed += len(updater.changed_method_ids)
+                projects += 1
+                if projects % batch == 0:
+                    commit_batch()
+                    print(f"[BULK LOAD] {projects} project(s) loaded...")
+    commit_batch()
+    return {
+        "files": len(paths),
+        "generations": len(generations),
+        "generation": generations[-1] if generations else None,
+        "projects": projects,
+        "errors": errors,
+        "methods_changed": methods_changed,
+        "methods_embedded": embedded,
+        "embed_seconds": embed_seconds,
+        "total_seconds": time.perf_counter() - started,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load analyzer output files straight into the database")
+    parser.add_argument("files", nargs="+", help="analysis-<timestamp>.json files written by the analyzer")
+    parser.add_argument("--db", default=DB_NAME, help="database to load into")
+    parser.add_argument("--batch", type=int, default=500, help="projects per transaction")
+    parser.add_argument("--verbose", action="store_true", help="report every call inserted")
+    parser.add_argument("--workspace", help="use the database of this workspace instead of --db")
+    args = parser.parse_args()
+    db = shard_path(args.workspace) if args.workspace else args.db
+
+    if os.path.dirname(db):
+        os.makedirs(os.path.dirname(db), exist_ok=True)
+    conn = connect(db)
+    try:
+        print(json.dumps(bulk_load(conn, args.files, args.batch, args.verbose), indent=2))
+    finally:
+        conn.close()
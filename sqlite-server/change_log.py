@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+from index_reader import queries
+from database import read_transaction
+
+# Generations kept in the change log, clients further behind than this get a reset and refetch everything
+KEEP_GENERATIONS = int(os.environ.get("GIM_CHANGE_LOG_GENERATIONS", "1000"))
+
+ADDED = "added"
+UPDATED = "updated"
+REMOVED = "removed"
+DOCUMENT = "document"
+METHOD = "method"
+
+_RECORD = """
+    INSERT INTO changes (generation, kind, entity_id, change) VALUES (?, ?, ?, ?)
+    ON CONFLICT(generation, kind, entity_id) DO UPDATE SET
+        change = CASE WHEN changes.change = 'added' AND excluded.change = 'updated' THEN 'added' ELSE excluded.change END
+"""
+
+
+def begin_generation(conn: sqlite3.Connection, source: str, reset: bool = False, after: int = 0) -> int:
+    """
+    Start a new generation in the current transaction, the changes recorded with it become visible when it commits.
+    A reset generation tells clients to throw away what they have and fetch everything again.
+    Its id is above after as well, for when the database replaced one that had handed out higher ids.
+    """
+    generation_id = after + 1 if after > latest_generation(conn) else None
+    cursor = conn.execute(
+        "INSERT INTO generations (id, created_at, source, reset) VALUES (?, ?, ?, ?)",
+        (generation_id, time.time(), source, int(reset)),
+    )
+    return cursor.lastrowid
+
+
+class PendingGeneration:
+    """
+    Generation that is only started once something is recorded in it, so a write that changed nothing
+    leaves no empty generation behind for clients to fetch. id is None until then.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, source: str):
+        self.conn = conn
+        self.source = source
+        self.id: int | None = None
+
+    def record(self, kind: str, changes: dict[int, str]):
+        if not changes:
+            return
+        if self.id is None:
+            self.id = begin_generation(self.conn, self.source)
+        record(self.conn, self.id, kind, changes)
+
+
+def record(conn: sqlite3.Connection, generation: int, kind: str, changes: dict[int, str]):
+    """Record what happened to documents or methods, by id, an id added and then updated stays added"""
+    if changes:
+        conn.executemany(_RECORD, [(generation, kind, entity_id, change) for entity_id, change in changes.items()])
+
+
+def documents_of(conn: sqlite3.Connection, method_ids: list[int]) -> list[int]:
+    """Ids of the documents the given methods are in"""
+    if not method_ids:
+        return []
+    rows = conn.execute(queries.DOCUMENTS_OF_METHODS, (json.dumps(method_ids),)).fetchall()
+    return [row[0] for row in rows]
+
+
+def latest_generation(conn: sqlite3.Connection) -> int:
+    return conn.execute(queries.LATEST_GENERATION).fetchone()[0]
+
+
+def prune(conn: sqlite3.Connection, keep: int = KEEP_GENERATIONS) -> int:
+    """Forget all but the last keep generations, returns the number of generations removed"""
+    oldest = latest_generation(conn) - keep
+    if oldest <= 0:
+        return 0
+    conn.execute("DELETE FROM changes WHERE generation <= ?", (oldest,))
+    return conn.execute("DELETE FROM generations WHERE id <= ?", (oldest,)).rowcount
+
+
+def _net_change(first: str, last: str) -> str | None:
+    # Net effect of everything that happened to one entity since the client's generation
+    if first == ADDED:
+        return None if last == REMOVED else ADDED
+    return REMOVED if last == REMOVED else UPDATED
+
+
+def _net_changes(conn: sqlite3.Connection, since: int) -> tuple[int, bool, dict | None]:
+    """Latest generation, whether the client has to start over, and else the ids per kind and net change since"""
+    latest = latest_generation(conn)
+    oldest = conn.execute(queries.OLDEST_GENERATION).fetchone()[0]
+    # Ahead of the log after a snapshot import, or behind what was pruned from it
+    reset = since > latest or (oldest is not None and since < oldest - 1) or bool(
+        conn.execute(queries.RESET_AFTER, (since,)).fetchone()
+    )
+    if reset:
+        return latest, True, None
+
+    history: dict[tuple[str, int], list[str]] = {}
+    rows = conn.execute(queries.CHANGES_AFTER, (since,)).fetchall()
+    for kind, entity_id, change in rows:
+        history.setdefault((kind, entity_id), []).append(change)
+
+    grouped = {DOCUMENT: {ADDED: [], UPDATED: [], REMOVED: []}, METHOD: {ADDED: [], UPDATED: [], REMOVED: []}}
+    for (kind, entity_id), changes in history.items():
+        change = _net_change(changes[0], changes[-1])
+        if change is not None:
+            grouped[kind][change].append(entity_id)
+    return latest, False, grouped
+
+
+def changes_since(conn: sqlite3.Connection, since: int) -> dict:
+    """
+    Everything that changed after generation since, collapsed to one change per document and method,
+    with the current rows of those that were added or updated. Read in one transaction, so the rows
+    match the generation that is returned.
+    """
+    with read_transaction(conn):
+        latest, reset, grouped = _net_changes(conn, since)
+        result = {"generation": latest, "since": since, "reset": reset}
+        if reset:
+            return result
+
+        for kind, query in ((DOCUMENT, queries.DOCUMENTS_BY_IDS), (METHOD, queries.METHOD_LOCATIONS_BY_IDS)):
+            ids = grouped[kind][ADDED] + grouped[kind][UPDATED]
+            cursor = conn.execute(query, (json.dumps(ids),))
+            columns = [column[0] for column in cursor.description]
+            current = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+            result[f"{kind}s"] = {
+                ADDED: [current[entity_id] for entity_id in sorted(grouped[kind][ADDED]) if entity_id in current],
+                UPDATED: [current[entity_id] for entity_id in sorted(grouped[kind][UPDATED]) if entity_id in current],
+                REMOVED: sorted(grouped[kind][REMOVED]),
+            }
+        return result
+
+
+def method_delta(conn: sqlite3.Connection, since: int) -> dict:
+    """
+    Ids of the methods added or updated after generation since, and of those removed, without their rows.
+    For keeping copies in memory up to date, read in the transaction conn is in. With reset set, start over.
+    """
+    latest, reset, grouped = _net_changes(conn, since)
+    if reset:
+        return {"generation": latest, "reset": True, "changed": [], "removed": []}
+    methods = grouped[METHOD]
+    return {
+        "generation": latest,
+        "reset": False,
+        "changed": methods[ADDED] + methods[UPDATED],
+        "removed": methods[REMOVED],
+    }
+
+
+class ChangeNotifier:
+    """
+    Wakes the change streams of a database when a new generation was committed to it, and remembers the latest
+    generation of every database, so what is kept in memory can tell it is stale without asking SQLite.
+    Notified from worker threads, the streams wait on the event loop.
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.events: dict[str, asyncio.Event] = {}
+        # Latest generation committed to each database that this process knows of
+        self.generations: dict[str, int] = {}
+
+    def listen(self, path: str) -> asyncio.Event:
+        """
+        Event set by the next notification for path. Get it before reading the changes,
+        so a generation committed in between is not missed.
+        """
+        self.loop = asyncio.get_running_loop()
+        return self.events.setdefault(path, asyncio.Event())
+
+    def notify(self, path: str, generation: int):
+        self.generations[path] = max(self.generations.get(path, 0), generation)
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake, path)
+
+    def _wake(self, path: str):
+        event = self.events.pop(path, None)
+        if event is not None:
+            event.set()
@@ -0,0 +1,190 @@
+import bisect
+import sys
+import time
+
+import numpy as np
+
+# Stands in for a missing start or end line
+NO_LINE = -1
+
+
+class StringPool:
+    """Interns strings, so every distinct value is stored once and referenced by an int32 id"""
+
+    def __init__(self):
+        self.strings: list[str] = []
+        self.ids: dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[value] = string_id
+            self.strings.append(sys.intern(value))
+        return string_id
+
+    def nbytes(self) -> int:
+        return sum(sys.getsizeof(value) for value in self.strings)
+
+
+class ColumnarIndex:
+    """
+    Read-only, array backed copy of the metadata in the index (projects, documents, classes and methods, without bodies).
+    Methods are sorted by document, start line and id, so the methods of a document are one contiguous slice,
+    found by bisecting, and line range filters are vectorized scans over that slice.
+    Signatures are additionally kept sorted for prefix lookups.
+    A snapshot is never modified, a new one is built and swapped in after every new generation.
+    """
+
+    def __init__(self):
+        self.pool = StringPool()
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        # Generation of the change log the snapshot was built at
+        self.generation = 0
+        # Projects
+        self.project_ids = np.zeros(0, dtype=np.int32)
+        self.project_names = np.zeros(0, dtype=np.int32)
+        # Documents, sorted by id
+        self.document_ids = np.zeros(0, dtype=np.int32)
+        self.document_projects = np.zeros(0, dtype=np.int32)
+        self.document_paths = np.zeros(0, dtype=np.int32)
+        self.document_rows: dict[str, int] = {}  # path -> row
+        # Classes, sorted by id
+        self.class_ids = np.zeros(0, dtype=np.int32)
+        self.class_documents = np.zeros(0, dtype=np.int32)
+        self.class_names = np.zeros(0, dtype=np.int32)
+        # Methods, sorted by document row then start line
+        self.method_ids = np.zeros(0, dtype=np.int32)
+        self.method_classes = np.zeros(0, dtype=np.int32)  # class row
+        self.method_documents = np.zeros(0, dtype=np.int32)  # document row
+        self.method_starts = np.zeros(0, dtype=np.int32)
+        self.method_ends = np.zeros(0, dtype=np.int32)
+        self.method_signatures = np.zeros(0, dtype=np.int32)
+        # Method rows ordered by signature, and the signatures in that order for bisecting
+        self.signature_order = np.zeros(0, dtype=np.int32)
+        self.sorted_signatures: list[str] = []
+
+    @classmethod
+    def build(cls, conn) -> "ColumnarIndex":
+        started = time.perf_counter()
+        index = cls()
+        pool = index.pool
+
+        projects = conn.execute("SELECT id, name FROM projects ORDER BY id").fetchall()
+        index.project_ids = np.array([row[0] for row in projects], dtype=np.int32)
+        index.project_names = np.array([pool.intern(row[1]) for row in projects], dtype=np.int32)
+
+        documents = conn.execute("SELECT id, project_id, path FROM documents ORDER BY id").fetchall()
+        index.document_ids = np.array([row[0] for row in documents], dtype=np.int32)
+        index.document_projects = np.array([row[1] for row in documents], dtype=np.int32)
+        index.document_paths = np.array([pool.intern(row[2]) for row in documents], dtype=np.int32)
+        index.document_rows = {row[2]: i for i, row in enumerate(documents)}
+
+        classes = conn.execute("SELECT id, document_id, name FROM classes ORDER BY id").fetchall()
+        index.class_ids = np.array([row[0] for row in classes], dtype=np.int32)
+        document_row_of = {row[0]: i for i, row in enumerate(documents)}
+        index.class_documents = np.array([document_row_of.get(row[1], -1) for row in classes], dtype=np.int32)
+        index.class_names = np.array([pool.intern(row[2]) for row in classes], dtype=np.int32)
+
+        class_row_of = {row[0]: i for i, row in enumerate(classes)}
+        methods = conn.execute(
+            "SELECT id, class_id, signature, start_line, end_line, document_id FROM methods"
+        ).fetchall()
+        method_classes = np.array([class_row_of.get(row[1], -1) for row in methods], dtype=np.int32)
+        # A method is in its own document, which for partial classes is not necessarily the one of its class.
+        # Methods of classes or documents that no longer exist are dropped, they cannot be located
+        method_documents = np.array([document_row_of.get(row[5], -1) for row in methods], dtype=np.int32)
+        method_documents[method_classes < 0] = -1
+        starts = np.array([NO_LINE if row[3] is None else row[3] for row in methods], dtype=np.int32)
+        keep = np.flatnonzero(method_documents >= 0)
+        ids = np.array([row[0] for row in methods], dtype=np.int32)
+        order = keep[np.lexsort((ids[keep], starts[keep], method_documents[keep]))]
+
+        index.method_ids = ids[order]
+        index.method_classes = method_classes[order]
+        index.method_documents = method_documents[order]
+        index.method_starts = starts[order]
+        index.method_ends = np.array([NO_LINE if row[4] is None else row[4] for row in methods], dtype=np.int32)[order]
+        signatures = [methods[i][2] for i in order]
+        index.method_signatures = np.array([pool.intern(signature) for signature in signatures], dtype=np.int32)
+        index.signature_order = np.array(sorted(range(len(signatures)), key=signatures.__getitem__), dtype=np.int32)
+        index.sorted_signatures = [signatures[i] for i in index.signature_order]
+
+        index.built_at = time.time()
+        index.build_seconds = time.perf_counter() - started
+        return index
+
+    def _method_rows(self, rows: np.ndarray) -> list[dict]:
+        strings = self.pool.strings
+        return [
+            {
+                "method_id": int(self.method_ids[row]),
+                "method_signature": strings[self.method_signatures[row]],
+                "class_id": int(self.class_ids[self.method_classes[row]]),
+                "class_name": strings[self.class_names[self.method_classes[row]]],
+                "document_path": strings[self.document_paths[self.method_documents[row]]],
+                "start_line": None if self.method_starts[row] == NO_LINE else int(self.method_starts[row]),
+                "end_line": None if self.method_ends[row] == NO_LINE else int(self.method_ends[row]),
+            }
+            for row in rows
+        ]
+
+    def methods_in_range(self, path: str, start_line: int, end_line: int) -> list[dict]:
+        """Methods in the document at path whose line range overlaps start_line..end_line"""
+        document_row = self.document_rows.get(path)
+        if document_row is None:
+            return []
+        first = np.searchsorted(self.method_documents, document_row, side="left")
+        last = np.searchsorted(self.method_documents, document_row, side="right")
+        starts = self.method_starts[first:last]
+        ends = self.method_ends[first:last]
+        overlaps = (starts <= end_line) & (ends >= start_line)
+        return self._method_rows(first + np.flatnonzero(overlaps))
+
+    def class_methods(self, class_id: int) -> list[dict]:
+        class_row = np.searchsorted(self.class_ids, class_id)
+        if class_row >= len(self.class_ids) or self.class_ids[class_row] != class_id:
+            return []
+        rows = np.flatnonzero(self.method_classes == class_row)
+        # A partial class has methods in several documents, ordered by line like the methods of one document
+        rows = rows[np.lexsort((self.method_ids[rows], self.method_starts[rows]))]
+        return self._method_rows(rows)
+
+    def methods_by_prefix(self, prefix: str, limit: int = 50) -> list[dict]:
+        first = bisect.bisect_left(self.sorted_signatures, prefix)
+        rows = []
+        for i in range(first, min(first + limit, len(self.sorted_signatures))):
+            if not self.sorted_signatures[i].startswith(prefix):
+                break
+            rows.append(self.signature_order[i])
+        return self._method_rows(np.array(rows, dtype=np.int32))
+
+    def memory_report(self) -> dict:
+        arrays = [
+            self.project_ids, self.project_names,
+            self.document_ids, self.document_projects, self.document_paths,
+            self.class_ids, self.class_documents, self.class_names,
+            self.method_ids, self.method_classes, self.method_documents,
+            self.method_starts, self.method_ends, self.method_signatures, self.signature_order,
+        ]
+        array_bytes = sum(array.nbytes for array in arrays)
+        string_bytes = self.pool.nbytes()
+        # The lookup structures hold references to the pooled strings, only their own size counts
+        lookup_bytes = sys.getsizeof(self.document_rows) + sys.getsizeof(self.sorted_signatures) \
+            + sys.getsizeof(self.pool.ids) + sys.getsizeof(self.pool.strings)
+        total = array_bytes + string_bytes + lookup_bytes
+        methods = len(self.method_ids)
+        return {
+            "projects": len(self.project_ids),
+            "documents": len(self.document_ids),
+            "classes": len(self.class_ids),
+            "methods": methods,
+            "array_bytes": array_bytes,
+            "string_bytes": string_bytes,
+            "lookup_bytes": lookup_bytes,
+            "total_bytes": total,
+            "bytes_per_method": total / methods if methods else 0,
+            "built_at": self.built_at,
+            "build_seconds": self.build_seconds,
+        }
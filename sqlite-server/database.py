@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+from urllib.parse import quote
+
+# Shared with the ai-server, which reads the same databases, see the index-reader package
+from index_reader import read_transaction
+from index_reader.paths import DB_NAME, SHARDS_DIR, shard_path
+from tables import Tables
+
+# Databases kept open at once, the least recently used one is closed when another is opened
+MAX_OPEN_SHARDS = int(os.environ.get("GIM_MAX_OPEN_SHARDS", "8"))
+# Prepared statements each connection keeps, comfortably more than the queries in index_reader.queries
+CACHED_STATEMENTS = 256
+# Databases one connection can attach, SQLite's default limit
+MAX_ATTACHED = 10
+
+# Database of the workspace the current request is for, set by the server for every request
+current_shard: ContextVar[str] = ContextVar("current_shard", default=DB_NAME)
+
+_local = threading.local()
+
+
+def connect(path: str = DB_NAME) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+    # Lets maintenance.py return free pages to the file system in small steps. Only takes effect on a new database,
+    # so it has to come before anything else writes to the file
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Readers never wait for a writer, and a writer only waits for other writers of the same database
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class Shard:
+    """One database file, with its connections that are not in use"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.idle: list[sqlite3.Connection] = []
+        self.in_use = 0
+        self.evicted = False
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+
+class ShardPool:
+    """
+    Connections to the open databases, at most max_open of them, evicting the least recently used.
+    Connections are checked out for the duration of a request and returned afterwards, so the statements
+    they prepared stay cached. An evicted shard closes its connections as they are returned.
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN_SHARDS):
+        self.max_open = max_open
+        self.shards: OrderedDict[str, Shard] = OrderedDict()
+        self.lock = threading.Lock()
+        # Called with the path of every evicted shard, to drop what is cached for it in memory
+        self.on_evict: list[Callable[[str], None]] = []
+
+    def acquire(self, path: str) -> tuple[Shard, sqlite3.Connection]:
+        evicted = []
+        with self.lock:
+            shard = self.shards.get(path)
+            if shard is None:
+                shard = self.shards[path] = Shard(path)
+                while len(self.shards) > self.max_open:
+                    _, oldest = self.shards.popitem(last=False)
+                    oldest.evicted = True
+                    evicted.append(oldest)
+            self.shards.move_to_end(path)
+            shard.in_use += 1
+            conn = shard.idle.pop() if shard.idle else None
+        for oldest in evicted:
+            self._close(oldest)
+        try:
+            if conn is None:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                conn = connect(path)
+            if not shard.schema_ready:
+                with shard.schema_lock:
+                    if not shard.schema_ready:
+                        ensure_schema(conn)
+                        shard.schema_ready = True
+        except Exception:
+            with self.lock:
+                shard.in_use -= 1
+            if conn is not None:
+                conn.close()
+            raise
+        return shard, conn
+
+    def release(self, shard: Shard, conn: sqlite3.Connection):
+        with self.lock:
+            shard.in_use -= 1
+            if not shard.evicted:
+                shard.idle.append(conn)
+                return
+        conn.close()
+
+    def _close(self, shard: Shard):
+        with self.lock:
+            idle, shard.idle = shard.idle, []
+        for conn in idle:
+            conn.close()
+        for callback in self.on_evict:
+            callback(shard.path)
+
+    def open_paths(self) -> list[str]:
+        with self.lock:
+            return list(self.shards)
+
+    def report(self) -> list[dict]:
+        with self.lock:
+            return [
+                {"path": shard.path, "in_use": shard.in_use, "idle_connections": len(shard.idle)}
+                for shard in reversed(self.shards.values())
+            ]
+
+    def close_all(self):
+        with self.lock:
+            shards = list(self.shards.values())
+            self.shards.clear()
+        for shard in shards:
+            shard.evicted = True
+            self._close(shard)
+
+
+pool = ShardPool()
+
+
+@contextmanager
+def get_db_connection(path: str | None = None):
+    """
+    Context manager for database connections.
+    Ensures connection to database, and will create
+    the database file if it doesn't exist.
+    Connects to the database of the current request's workspace, unless given the path of another.
+    Nested uses on one thread share the connection.
+    """
+    path = path or current_shard.get()
+    held = _local.__dict__.setdefault("held", {})
+    entry = held.get(path)
+    if entry is None:
+        shard, conn = pool.acquire(path)
+        entry = held[path] = [shard, conn, 0]
+    entry[2] += 1
+    try:
+        yield entry[1]
+    finally:
+        entry[2] -= 1
+        if entry[2] == 0:
+            del held[path]
+            shard, conn = entry[0], entry[1]
+            # The connection is reused, so nothing a request left behind may leak into the next one
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            pool.release(shard, conn)
+
+
+@contextmanager
+def attached_shards(paths: list[str]):
+    """
+    Connection to an empty in memory database with each of the given databases attached read only,
+    as s0, s1, and so on, for queries across workspaces. At most MAX_ATTACHED of them.
+    """
+    if len(paths) > MAX_ATTACHED:
+        raise ValueError(f"At most {MAX_ATTACHED} databases can be attached at once")
+    conn = sqlite3.connect("file::memory:", uri=True)
+    try:
+        for i, path in enumerate(paths):
+            conn.execute(f"ATTACH DATABASE ? AS s{i}", (f"file:{quote(os.path.abspath(path))}?mode=ro",))
+        yield conn
+    finally:
+        conn.close()
+
+
+def close_db_connections():
+    pool.close_all()
+    _local.__dict__.clear()
+
+
+def ensure_schema(conn: sqlite3.Connection) -> bool:
+    """
+    Create the tables, or upgrade them, unless the schema version stored in the database already matches.
+    Returns whether the schema had to be created or upgraded.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= Tables.SCHEMA_VERSION:
+        return False
+    if conn.in_transaction:
+        conn.commit()
+    # Holds the write lock until the schema is done, so connections opening the same new database at once
+    # wait for the first one instead of taking its half created tables for an old version
+    conn.execute("BEGIN IMMEDIATE")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= Tables.SCHEMA_VERSION:
+        conn.rollback()
+        return False
+    cursor = conn.cursor()
+    if version == 0 and cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'methods'").fetchone():
+        # Created before the schema was versioned
+        version = 1
+    if version == 0:
+        print("Creating tables...")
+    else:
+        print(f"Upgrading tables from version {version} to {Tables.SCHEMA_VERSION}...")
+        migrations = Tables.migrations()
+        for target in range(version + 1, Tables.SCHEMA_VERSION + 1):
+            for statement in migrations.get(target, []):
+                cursor.execute(statement)
+    for table in Tables.define_tables():
+        cursor.execute(table)
+    cursor.execute(f"PRAGMA user_version = {Tables.SCHEMA_VERSION}")
+    conn.commit()
+    return True
+
+
+def init_db():
+    # Opening a database creates or upgrades its tables, the other workspaces' databases are opened on first use
+    with get_db_connection(DB_NAME):
+        pass
@@ -0,0 +1,267 @@
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+import change_log
+from index_reader import queries
+from database import read_transaction
+
+# "module:Class" of the embedder to use, defaults to the built in hashing embedder
+EMBEDDER_ENV = "GIM_EMBEDDER"
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+class Embedder(ABC):
+    """
+    Turns method text into fixed size vectors. Subclasses set name and dim, and implement embed.
+    The name is stored with every vector, so switching embedder recomputes all of them.
+    """
+    name = "base"
+    dim = 0
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """One normalized float32 row per text"""
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local embedder without a model: identifiers are split into their camelCase parts,
+    and the parts and pairs of neighbouring tokens are hashed into a signed bag of words vector.
+    Finds duplicated and copy-pasted logic well, without any download.
+    """
+    name = "hashing-v1"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def tokens(self, text: str) -> list[str]:
+        tokens = []
+        for match in _IDENTIFIER.findall(text):
+            if match[0].isalpha() or match[0] == "_":
+                tokens.extend(part.lower() for part in _CAMEL.findall(match))
+            else:
+                tokens.append(match)
+        return tokens
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = self.tokens(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter(
+                (zlib.crc32(feature.encode("utf-8")) for feature in features),
+                dtype=np.uint32,
+                count=len(features),
+            )
+            # Lowest bit picks the sign, so collisions cancel out instead of piling up
+            signs = np.where(hashes & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], (hashes >> 1) % self.dim, signs)
+        return normalize(vectors)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+def load_embedder() -> Embedder:
+    spec = os.environ.get(EMBEDDER_ENV)
+    if not spec:
+        return HashingEmbedder()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def method_text(signature: str, body: str | None) -> str:
+    return f"{signature}\n{body or ''}"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingIndex:
+    """
+    In memory matrix of the normalized method vectors, backed by float32 blobs in the method_embeddings table.
+    Rows are appended into spare capacity, so incremental updates do not copy the whole matrix.
+    Follows the change log, so vectors stored by other processes, like the bulk loader, are picked up, see sync.
+    """
+
+    def __init__(self, embedder: Embedder):
+        self.embedder = embedder
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.loaded = False
+        # Generation of the change log the vectors in memory are up to date with
+        self.generation = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, embedder.dim), dtype=np.float32)
+        self.count = 0
+        self.rows: dict[int, int] = {}
+
+    def load(self, conn):
+        """Read every stored vector made by the current embedder into memory. Only reads"""
+        with read_transaction(conn):
+            generation = change_log.latest_generation(conn)
+            rows = conn.execute(queries.STORED_VECTORS, (self.embedder.name, self.embedder.dim)).fetchall()
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        matrix = np.empty((len(rows), self.embedder.dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            matrix[i] = np.frombuffer(row[1], dtype=np.float32)
+        with self.lock:
+            self.ids = ids
+            self.matrix = matrix
+            self.count = len(rows)
+            self.rows = {int(method_id): i for i, method_id in enumerate(ids)}
+            self.generation = generation
+            self.loaded = True
+
+    def sync(self, conn) -> bool:
+        """
+        Catch up with the generations committed since the vectors were read, by this process or another one:
+        drops the removed methods, and reads the stored vectors of the added and updated ones. Only reads.
+        Returns whether there was anything to catch up with.
+        """
+        with self.sync_lock, read_transaction(conn):
+            if change_log.latest_generation(conn) == self.generation:
+                return False
+            delta = change_log.method_delta(conn, self.generation)
+            if delta["reset"]:
+                self.load(conn)
+                return True
+            vectors = self.stored_vectors(conn, delta["changed"])
+            # Methods without a vector of the current embedder yet are embedded by the next refresh
+            self.remove(delta["removed"] + [method_id for method_id in delta["changed"] if method_id not in vectors])
+            if vectors:
+                self._upsert(list(vectors), np.stack(list(vectors.values())))
+            self.generation = delta["generation"]
+        return True
+
+    def stored_vectors(self, conn, method_ids: list[int]) -> dict[int, np.ndarray]:
+        if not method_ids:
+            return {}
+        rows = conn.execute(
+            queries.STORED_VECTORS_BY_IDS, (json.dumps(method_ids), self.embedder.name, self.embedder.dim)
+        ).fetchall()
+        return {method_id: np.frombuffer(vector, dtype=np.float32) for method_id, vector in rows}
+
+    def ensure_loaded(self, conn, commit: bool = True) -> int:
+        """
+        Load the stored vectors on first use, and embed every method that has none yet.
+        Without commit the new vectors are left in the transaction of conn, for the caller to commit.
+        """
+        if self.loaded:
+            self.sync(conn)
+            return 0
+        self.load(conn)
+        missing = conn.execute(queries.UNEMBEDDED_METHODS, (self.embedder.name, self.embedder.dim)).fetchall()
+        return self.refresh(conn, [row[0] for row in missing], commit)
+
+    def refresh(self, conn, method_ids, commit: bool = True) -> int:
+        """
+        Embed the given methods where their signature or body changed since they were last embedded.
+        Returns the number of vectors that were computed. Without commit, see ensure_loaded.
+        """
+        embedded = self.ensure_loaded(conn, commit)
+        method_ids = list(method_ids)
+        if not method_ids:
+            return embedded
+        stale = []
+        rows = conn.execute(queries.EMBEDDING_STATE_BY_IDS, (json.dumps(method_ids),)).fetchall()
+        for method_id, signature, body, stored_hash, model, dim in rows:
+            text = method_text(signature, body)
+            digest = text_hash(text)
+            if stored_hash == digest and model == self.embedder.name and dim == self.embedder.dim:
+                continue
+            stale.append((method_id, text, digest))
+        if not stale:
+            return embedded
+
+        vectors = normalize(np.asarray(self.embedder.embed([text for _, text, _ in stale]), dtype=np.float32))
+        conn.executemany(
+            """
+            INSERT INTO method_embeddings (method_id, model, dim, text_hash, vector) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(method_id) DO UPDATE SET
+                model = excluded.model, dim = excluded.dim, text_hash = excluded.text_hash, vector = excluded.vector
+            """,
+            [
+                (method_id, self.embedder.name, self.embedder.dim, digest, vector.tobytes())
+                for (method_id, _, digest), vector in zip(stale, vectors)
+            ],
+        )
+        if commit:
+            conn.commit()
+        self._upsert([method_id for method_id, _, _ in stale], vectors)
+        return embedded + len(stale)
+
+    def _upsert(self, method_ids: list[int], vectors: np.ndarray):
+        with self.lock:
+            new = [(method_id, vector) for method_id, vector in zip(method_ids, vectors) if method_id not in self.rows]
+            for method_id, vector in zip(method_ids, vectors):
+                row = self.rows.get(method_id)
+                if row is not None:
+                    self.matrix[row] = vector
+            if not new:
+                return
+            needed = self.count + len(new)
+            if needed > len(self.matrix):
+                capacity = max(needed, 2 * len(self.matrix), 64)
+                matrix = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+                matrix[:self.count] = self.matrix[:self.count]
+                ids = np.zeros(capacity, dtype=np.int64)
+                ids[:self.count] = self.ids[:self.count]
+                self.matrix, self.ids = matrix, ids
+            for method_id, vector in new:
+                self.matrix[self.count] = vector
+                self.ids[self.count] = method_id
+                self.rows[method_id] = self.count
+                self.count += 1
+
+    def remove(self, method_ids):
+        """Drop methods from the in memory index, their rows are deleted with the methods themselves"""
+        with self.lock:
+            for method_id in method_ids:
+                row = self.rows.pop(method_id, None)
+                if row is None:
+                    continue
+                # Move the last row into the hole
+                last = self.count - 1
+                if row != last:
+                    moved_id = int(self.ids[last])
+                    self.matrix[row] = self.matrix[last]
+                    self.ids[row] = moved_id
+                    self.rows[moved_id] = row
+                self.count = last
+
+    def vector_of(self, method_id: int) -> np.ndarray | None:
+        with self.lock:
+            row = self.rows.get(method_id)
+            return None if row is None else self.matrix[row].copy()
+
+    def search(self, query: np.ndarray, k: int = 10, exclude: int | None = None) -> list[tuple[int, float]]:
+        """Top k methods by cosine similarity to the query vector, best first"""
+        with self.lock:
+            matrix = self.matrix[:self.count]
+            ids = self.ids[:self.count].copy()
+            scores = matrix @ query.astype(np.float32, copy=False)
+        if exclude is not None:
+            scores[ids == exclude] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
@@ -1,21 +1,39 @@
+import time
+
+# Measured from here, the start of the imports, see STARTUP_BUDGET_MS
+STARTED = time.perf_counter()
+
+import os
 import sqlite3
 import json
-from contextlib import contextmanager
-from typing import List
-from tables import Tables
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from update_indexes import UpdateIndexes
-from pypika import Query, Table, terms
-from models import ClassesResponse, DocumentsResponse, MethodCallsResponse, MethodsResponse, ProjectBody, FetchAllResponse, ProjectsResponse
+from models import ClassesResponse, DocumentsResponse, MethodCallsResponse, MethodsResponse, ProjectBody, FetchAllResponse, ProjectsResponse, SimilarMethodResponse, MethodContextResponse, MethodLocationResponse, SnapshotBody, WorkspaceMethodLocationResponse, ChangesResponse
+from database import DB_NAME, MAX_ATTACHED, SHARDS_DIR, attached_shards, close_db_connections, current_shard, get_db_connection, init_db, pool, read_transaction, shard_path
+from index_reader import queries, read_method_context
+import change_log
+from maintenance import MAINTENANCE_ENABLED, VACUUM_SLICE_MS, Maintenance
 from contextlib import asynccontextmanager
-import uvicorn
-
-DB_NAME = "database.db"
+import asyncio
+
+# Serve metadata lookups from an in memory columnar snapshot instead of SQLite
+COLUMNAR_SNAPSHOT = os.environ.get("GIM_COLUMNAR_SNAPSHOT", "") not in ("", "0", "false")
+# The extension starts this server on activation, startups slower than this are reported
+STARTUP_BUDGET_MS = float(os.environ.get("GIM_STARTUP_BUDGET_MS", "750"))
+# Seconds between checks for generations committed by other processes, like the bulk loader, before the columnar
+# snapshot is used. Generations committed by this server are known right away
+EXTERNAL_WRITES_INTERVAL = float(os.environ.get("GIM_EXTERNAL_WRITES_INTERVAL", "5"))
+# Seconds between keepalive comments on an idle change stream, it also checks for changes made by other processes then
+CHANGE_STREAM_HEARTBEAT = float(os.environ.get("GIM_CHANGE_STREAM_HEARTBEAT", "15"))
 
 description = """
 This API provides endpoints to interact with a SQLite database for managing projects, documents, classes, methods, and method calls.
 It allows fetching and updating indexed data, retrieving methods by signature or ID, and exploring relationships between methods such as callers and callees. 
 The server ensures the database schema is initialized on startup and supports bulk updates of project indexes.
+Every workspace is indexed in a database of its own: pass its path as the X-GIM-Workspace header or the workspace query parameter.
+Requests without one use the shared database.
 """
 
 tags_metadata = [
@@ -58,6 +76,34 @@ tags_metadata = [
     {
         "name": "Related Methods",
         "description": "Retrieve methods that call a specific method.",
+    },
+    {
+        "name": "Method Context",
+        "description": "Retrieve a method together with its callees, callers and similar methods in one request.",
+    },
+    {
+        "name": "Method Lookup",
+        "description": "Locate methods by file and line range, by class, or by signature prefix.",
+    },
+    {
+        "name": "Similar Methods",
+        "description": "Find methods with similar signatures and bodies, using embeddings of the indexed methods.",
+    },
+    {
+        "name": "Index Snapshots",
+        "description": "Export the whole index to a compressed snapshot file, or replace it with one.",
+    },
+    {
+        "name": "Maintenance",
+        "description": "Remove orphaned rows from the index and give the space they used back to the file system.",
+    },
+    {
+        "name": "Workspaces",
+        "description": "List the workspace databases, and search across several of them at once.",
+    },
+    {
+        "name": "Changes",
+        "description": "What changed in the index since a generation, as one response or as a stream of server-sent events.",
     }
 ]
 
@@ -65,45 +111,137 @@ tags_metadata = [
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    if COLUMNAR_SNAPSHOT:
+        rebuild_columnar_snapshot()
+    startup_ms = (time.perf_counter() - STARTED) * 1000
+    print(f"[SQLITE SERVER] Ready in {startup_ms:.0f} ms")
+    if startup_ms > STARTUP_BUDGET_MS:
+        print(f"[SQLITE SERVER] Warning: startup took longer than the {STARTUP_BUDGET_MS:.0f} ms budget")
+    maintenance_task = asyncio.create_task(maintenance.run_when_idle(run_idle_maintenance)) if MAINTENANCE_ENABLED else None
     yield
     print("Shutting down...")
-    with get_db_connection() as conn:
-        conn.close()
+    if maintenance_task:
+        maintenance_task.cancel()
+    close_db_connections()
+
+# Everything below is kept per workspace database, keyed by its path, and dropped when the database is closed.
+# Vectors of every method's signature and body, used for similarity search. Created on first use,
+# numpy is only imported then
+_embedding_indexes = {}
+# Columnar copy of the index metadata, only built when COLUMNAR_SNAPSHOT is set
+columnar_snapshots = {}
+# When each database was last checked for generations committed by other processes, see EXTERNAL_WRITES_INTERVAL
+_external_checks = {}
+maintenance = Maintenance()
+notifier = change_log.ChangeNotifier()
+
+def forget_shard(path):
+    _embedding_indexes.pop(path, None)
+    columnar_snapshots.pop(path, None)
+    _external_checks.pop(path, None)
+    notifier.generations.pop(path, None)
+
+pool.on_evict.append(forget_shard)
+
 app = FastAPI(title="SQLite Server", openapi_tags=tags_metadata, description=description,lifespan=lifespan)
 
-@contextmanager
-def get_db_connection():
-    """
-    Context manager for database connections.
-    Ensures connection to database, and will create
-    the database file if it doesn't exist.
-    """
-    conn = sqlite3.connect(DB_NAME)
+@app.middleware("http")
+async def track_activity(request, call_next):
+    # Maintenance only runs once no request came in for a while
+    maintenance.touch()
+    workspace = request.headers.get("x-gim-workspace") or request.query_params.get("workspace")
+    # Read by get_db_connection, the endpoint runs in a copy of this context
+    token = current_shard.set(shard_path(workspace))
     try:
-        yield conn
+        return await call_next(request)
     finally:
-        conn.close()
-
-
-# Database setup
-
-def init_db():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        tables = Tables.define_tables()
-        print("Creating tables...") 
-        for table in tables:
-            cursor.execute(table)
-
-        conn.commit()
-
-def fetch_from_table(table_name, query=None):
+        current_shard.reset(token)
+
+def get_embedding_index(path=None):
+    path = path or current_shard.get()
+    embedding_index = _embedding_indexes.get(path)
+    if embedding_index is None:
+        from embeddings import EmbeddingIndex, load_embedder
+        embedding_index = _embedding_indexes.setdefault(path, EmbeddingIndex(load_embedder()))
+    return embedding_index
+
+def get_columnar_snapshot():
+    """The snapshot of the current workspace, built on first use, or None unless COLUMNAR_SNAPSHOT is set"""
+    if not COLUMNAR_SNAPSHOT:
+        return None
+    path = current_shard.get()
+    snapshot = columnar_snapshots.get(path)
+    if snapshot is not None and time.monotonic() - _external_checks.get(path, 0) >= EXTERNAL_WRITES_INTERVAL:
+        _external_checks[path] = time.monotonic()
+        with get_db_connection(path) as conn:
+            latest = change_log.latest_generation(conn)
+        if latest > notifier.generations.get(path, 0):
+            notifier.notify(path, latest)
+    # Every other request is served without going to SQLite
+    if snapshot is not None and snapshot.generation < notifier.generations.get(path, 0):
+        snapshot = None
+    if snapshot is None:
+        rebuild_columnar_snapshot(path)
+        snapshot = columnar_snapshots.get(path)
+    return snapshot
+
+def rebuild_columnar_snapshot(path=None):
+    """Build a fresh snapshot and swap it in, requests in flight keep using the one they started with"""
+    from columnar import ColumnarIndex
+    path = path or current_shard.get()
+    with get_db_connection(path) as conn, read_transaction(conn):
+        generation = change_log.latest_generation(conn)
+        snapshot = ColumnarIndex.build(conn)
+    snapshot.generation = generation
+    columnar_snapshots[path] = snapshot
+    _external_checks[path] = time.monotonic()
+    if generation > notifier.generations.get(path, 0):
+        notifier.notify(path, generation)
+    report = snapshot.memory_report()
+    print(
+        f"[SQLITE SERVER] Columnar snapshot built in {report['build_seconds']:.3f}s, "
+        f"{report['methods']} methods, {report['bytes_per_method']:.0f} bytes per method"
+    )
+
+def forget_methods(method_ids, path=None):
+    """Drop deleted methods from everything kept in memory"""
+    if not method_ids:
+        return
+    embedding_index = _embedding_indexes.get(path or current_shard.get())
+    if embedding_index is not None:
+        embedding_index.remove(method_ids)
+
+def run_idle_maintenance():
+    """
+    One round of background maintenance over the open databases, collects garbage in those whose indexes changed,
+    and vacuums one slice of each
+    """
+    for path in pool.open_paths():
+        if not maintenance.idle():
+            # A request came in, the rest waits for the next idle period
+            return
+        with get_db_connection(path) as conn:
+            if path in maintenance.dirty:
+                result = maintenance.collect(conn, path)
+                forget_methods(result["removed_method_ids"], path)
+                if result["generation"]:
+                    notifier.notify(path, result["generation"])
+                if result["removed_rows"]:
+                    print(f"[SQLITE SERVER] Removed {result['removed_rows']} orphaned row(s) from {path}")
+                    if path in columnar_snapshots:
+                        rebuild_columnar_snapshot(path)
+            result = maintenance.vacuum(conn, path)
+            if result["reclaimed_bytes"]:
+                print(
+                    f"[SQLITE SERVER] Reclaimed {result['reclaimed_bytes']} bytes from {path}, "
+                    f"{result['free_bytes']} free bytes left"
+                )
+
+def fetch_from_table(query):
     try:
         with get_db_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            if query is None:
-                query = f"SELECT * FROM {table_name}"
             cursor.execute(query)
             rows = cursor.fetchall()
             result = [dict(row) for row in rows]
@@ -118,7 +256,7 @@ def fetch_projects() -> dict[str, list[ProjectsResponse]]:
     """
     Fetch projects from the database.
     """
-    return {"data": fetch_from_table("projects")}
+    return {"data": fetch_from_table(queries.SELECT_PROJECTS)}
 
 
 @app.get("/fetch-documents", tags=["Documents"])
@@ -126,7 +264,7 @@ def fetch_documents() -> dict[str, list[DocumentsResponse]]:
     """
     Fetch documents from the database.
     """
-    return {"data": fetch_from_table("documents")}
+    return {"data": fetch_from_table(queries.SELECT_DOCUMENTS)}
 
 
 @app.get("/fetch-classes", tags=["Classes"])
@@ -134,7 +272,7 @@ def fetch_classes() -> dict[str, list[ClassesResponse]]:
     """
     Fetch classes from the database.
     """
-    return {"data": fetch_from_table("classes")}
+    return {"data": fetch_from_table(queries.SELECT_CLASSES)}
 
 
 @app.get("/fetch-methods", tags=["Methods"])
@@ -142,14 +280,14 @@ def fetch_methods() -> dict[str, list[MethodsResponse]]:
     """
     Fetch methods from the database.
     """
-    return {"data": fetch_from_table("methods")}
+    return {"data": fetch_from_table(queries.SELECT_METHODS)}
 
 @app.get("/fetch-method-calls", tags=["Method Calls"])
 def fetch_method_calls() -> dict[str, list[MethodCallsResponse]]:
     """
     Fetch method calls from the database.
     """
-    return {"data": fetch_from_table("method_calls")}
+    return {"data": fetch_from_table(queries.SELECT_METHOD_CALLS)}
 
 @app.get("/fetch-all", tags=["Fetch All"])
 def fetch_all() -> dict[str, list[FetchAllResponse]]:
@@ -161,72 +299,7 @@ def fetch_all() -> dict[str, list[FetchAllResponse]]:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
-            # Define tables
-            methods_table = Table('methods')
-            classes_table = Table('classes')
-            documents_table = Table('documents')
-            projects_table = Table('projects')
-            method_calls_table = Table('method_calls')
-
-            # Aliases
-            method = methods_table.as_('method')
-            class_ = classes_table.as_('class')
-            doc = documents_table.as_('doc')
-            prj = projects_table.as_('prj')
-            callee_join = method_calls_table.as_('callee_join')
-            callee_method = methods_table.as_('callee_method')
-            caller_join = method_calls_table.as_('caller_join')
-            caller_method = methods_table.as_('caller_method')
-
-            # Finds the distinct callees and callers for each method
-            # using literal value of the sql instead of pypika, since pypika does not support JSON_GROUP_ARRAY
-            callees_clause = terms.LiteralValue(
-                "JSON_GROUP_ARRAY(DISTINCT JSON_OBJECT('id', callee_method.id, 'signature', callee_method.signature)) FILTER (WHERE callee_method.id IS NOT NULL)"
-            ).as_('callees')
-
-            callers_clause = terms.LiteralValue(
-                "JSON_GROUP_ARRAY(DISTINCT JSON_OBJECT('id', caller_method.id, 'signature', caller_method.signature)) FILTER (WHERE caller_method.id IS NOT NULL)"
-            ).as_('callers')
-
-            # Understanding this query:
-            # Firstly, it selects from the methods table as the primary table.
-            # it joins the classes, documents, and projects tables to get the context of each method.
-            # The context being the: class it belongs to, the document it is in, and the project it is part of.
-            # Furthermore it left joins the method_calls table twice to get both the methods that are called
-            # by the current method (callees)
-            # and the methods that call the current method (callers).
-            # Finally, it groups the results by method.id to ensure each method is represented once in the final output,
-            # with aggregated lists of its callees and callers.
-            # See @type FetchAllResponse for the expected output format.
-
-            q = Query.from_(method) \
-                .join(class_).on(method.class_id == class_.id) \
-                .join(doc).on(class_.document_id == doc.id) \
-                .join(prj).on(doc.project_id == prj.id) \
-                .left_join(callee_join).on(method.id == callee_join.caller_id) \
-                .left_join(callee_method).on(callee_join.callee_id == callee_method.id) \
-                .left_join(caller_join).on(method.id == caller_join.callee_id) \
-                .left_join(caller_method).on(caller_join.caller_id == caller_method.id) \
-                .select(
-                    prj.id.as_('project_id'),
-                    prj.name.as_('project_name'),
-                    doc.id.as_('document_id'),
-                    doc.path.as_('document_path'),
-                    class_.id.as_('class_id'),
-                    class_.name.as_('class_name'),
-                    method.id.as_('method_id'),
-                    method.name.as_('method_name'),
-                    method.signature.as_('method_signature'),
-                    method.start_line.as_('method_start_line'),
-                    method.end_line.as_('method_end_line'),
-                    method.body.as_('method_body'),
-                    callees_clause,
-                    callers_clause
-                ) \
-                .groupby(method.id)
-
-
-            cursor.execute(str(q))
+            cursor.execute(queries.FETCH_ALL)
             rows = cursor.fetchall()
 
             def process_row(row):
@@ -241,9 +314,10 @@ def fetch_all() -> dict[str, list[FetchAllResponse]]:
 
 
 @app.post("/update-indexes", tags=["Update Indexes"])
-async def update_indexes(projects: List[ProjectBody]):
+def update_indexes(projects: List[ProjectBody]):
     """
     Update indexes for the given projects, uploading a list of projects to update indexes for.
+    Runs in a worker thread, so requests for other workspaces are served while it writes.
     """
     # Upload data to database
     try:
@@ -252,13 +326,30 @@ async def update_indexes(projects: List[ProjectBody]):
         try:
             print(f"[SQLITE SERVER] Updating indexes for {len(projects)} project(s)...")
             with get_db_connection() as conn:
+                changed_method_ids = []
+                removed_method_ids = []
+                # One transaction for every project, clients of /changes see all of them in one generation or none
+                generation = change_log.PendingGeneration(conn, "update-indexes")
                 for project in projects:
-                    updater = UpdateIndexes(project, conn=conn)
+                    updater = UpdateIndexes(project, conn=conn, autocommit=False, generation=generation)
                     result = updater.process()
                     if "error" in result:
-                        return result # Return early on first error
+                        return result # Return early on first error, rolling back the projects before it
                     results.append(result)
-            print("[SQLITE SERVER] Indexes updated successfully.")
+                    changed_method_ids.extend(updater.changed_method_ids)
+                    removed_method_ids.extend(updater.removed_method_ids)
+                # Stored with the generation, so whoever sees it also finds the vectors of its methods
+                embedded = get_embedding_index().refresh(conn, changed_method_ids, commit=False)
+                conn.commit()
+            forget_methods(removed_method_ids)
+            if generation.id is None:
+                print("[SQLITE SERVER] Indexes are up to date, nothing changed.")
+                return results
+            maintenance.mark_dirty(current_shard.get())
+            notifier.notify(current_shard.get(), generation.id)
+            print(f"[SQLITE SERVER] Indexes updated successfully in generation {generation.id}, {embedded} method(s) embedded.")
+            if current_shard.get() in columnar_snapshots:
+                rebuild_columnar_snapshot()
             return results
         except Exception as e:
             return {"error": str(e)}
@@ -276,29 +367,7 @@ def method_from_signature(signature: str, file_name: str):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.row_factory = sqlite3.Row
-
-
-        # Define tables
-        methods_table = Table('methods')
-        classes_table = Table('classes')
-        documents_table = Table('documents')
-
-        query = Query.from_(methods_table) \
-            .join(classes_table).on(methods_table.class_id == classes_table.id) \
-            .join(documents_table).on(classes_table.document_id == documents_table.id) \
-            .select(
-                methods_table.id.as_('method_id'),
-                methods_table.signature.as_('method_signature'),
-                methods_table.body.as_('method_body'),
-            ) \
-            .where(
-                (methods_table.signature == signature) &
-                (documents_table.path == file_name)
-            )
- 
-
-
-        cursor.execute(str(query))
+        cursor.execute(queries.METHOD_FROM_SIGNATURE, (signature, file_name))
         row = cursor.fetchone()
         print(row)
         if row:
@@ -316,15 +385,7 @@ def get_method(method_id: int):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.row_factory = sqlite3.Row
-        methods_table = Table("methods")
-        query = Query.from_(methods_table) \
-            .select(
-                methods_table.id.as_("method_id"),
-                methods_table.signature.as_("method_signature"),
-                methods_table.body.as_("method_body")
-            ) \
-            .where(methods_table.id == method_id)
-        cursor.execute(str(query))
+        cursor.execute(queries.METHOD_BY_ID, (method_id,))
         row = cursor.fetchone()
         if row: 
             dict_row = dict(row)
@@ -351,26 +412,7 @@ def used_methods(method_id: int):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.row_factory = sqlite3.Row
-        # First, get the method signature and document path for the given method_id
-        method_calls_table = Table("method_calls")
-        methods_table = Table("methods")
-        documents_table = Table("documents")
-        classes_table = Table("classes")
-
-        print("Fetching used methods for method_id:", method_id)
-        query = Query.from_(method_calls_table) \
-            .join(methods_table).on(method_calls_table.callee_id == methods_table.id) \
-            .join(classes_table).on(methods_table.class_id == classes_table.id) \
-            .join(documents_table).on(classes_table.document_id == documents_table.id) \
-            .select(
-                methods_table.id.as_("method_id"),
-                methods_table.signature.as_("method_signature"),
-                documents_table.path.as_("document_path")
-            ) \
-            .where(method_calls_table.caller_id == method_id) \
-            .groupby(methods_table.id)
-
-        cursor.execute(str(query))
+        cursor.execute(queries.USED_METHODS, (method_id,))
         rows = cursor.fetchall()
         print(f"Found {len(rows)} used methods for method_id {method_id}")
         used_methods = [dict(row) for row in rows]
@@ -385,30 +427,285 @@ def related_methods(method_id: int):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.row_factory = sqlite3.Row
-        # First, get the method signature and document path for the given method_id
-        method_calls_table = Table("method_calls")
-        methods_table = Table("methods")
-        classes_table = Table("classes")
-        documents_table = Table("documents")
-
-        print("Fetching related methods for method_id:", method_id)
-        query = Query.from_(method_calls_table) \
-            .join(methods_table).on(method_calls_table.caller_id == methods_table.id) \
-            .join(classes_table).on(methods_table.class_id == classes_table.id) \
-            .join(documents_table).on(classes_table.document_id == documents_table.id) \
-            .select(
-                methods_table.id.as_("method_id"),
-                methods_table.signature.as_("method_signature"),
-                documents_table.path.as_("document_path")
-            ) \
-            .where(method_calls_table.callee_id == method_id) \
-            .groupby(methods_table.id)
-
-        cursor.execute(str(query))
+        cursor.execute(queries.RELATED_METHODS, (method_id,))
         rows = cursor.fetchall()
         print(f"Found {len(rows)} related methods for method_id {method_id}")
         related_methods = [dict(row) for row in rows]
         return {"related_methods": related_methods}
 
+@app.get("/method-context", tags=["Method Context"])
+def method_context(
+    signature: str,
+    file_name: str,
+    depth: int = 1,
+    max_callees: int = 20,
+    max_callers: int = 20,
+    similar: int = 0,
+) -> MethodContextResponse:
+    """
+        Get a method with its callees and callers up to depth calls away, and optionally its most similar methods,
+        everything needed to build a prompt for it. All of it is read in one transaction, so it is consistent
+        even while the indexes are being updated.
+    """
+    with get_db_connection() as conn:
+        embedding_index = None
+        if similar > 0:
+            embedding_index = get_embedding_index()
+            # May have to embed methods first, which writes, so it happens before the read transaction
+            embedding_index.ensure_loaded(conn)
+        context = read_method_context(
+            conn, signature, file_name, depth, max_callees, max_callers, similar, embedding_index
+        )
+        if context is None:
+            raise HTTPException(status_code=404, detail="Method not found")
+        return context
+
+def fetch_method_locations(query, params) -> list[dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+@app.get("/methods-in-range", tags=["Method Lookup"])
+def methods_in_range(file_name: str, start_line: int, end_line: int) -> dict[str, list[MethodLocationResponse]]:
+    """
+        Get the methods in a file whose lines overlap start_line..end_line
+    """
+    snapshot = get_columnar_snapshot()
+    if snapshot is not None:
+        return {"methods": snapshot.methods_in_range(file_name, start_line, end_line)}
+    return {"methods": fetch_method_locations(queries.METHODS_IN_RANGE, (file_name, end_line, start_line))}
+
+@app.get("/class-methods/{class_id}", tags=["Method Lookup"])
+def class_methods(class_id: int) -> dict[str, list[MethodLocationResponse]]:
+    """
+        Get the methods of the class with given id
+    """
+    snapshot = get_columnar_snapshot()
+    if snapshot is not None:
+        return {"methods": snapshot.class_methods(class_id)}
+    return {"methods": fetch_method_locations(queries.CLASS_METHODS, (class_id,))}
+
+@app.get("/methods-by-prefix", tags=["Method Lookup"])
+def methods_by_prefix(prefix: str, limit: int = 50) -> dict[str, list[MethodLocationResponse]]:
+    """
+        Get the methods whose signature starts with prefix, in signature order
+    """
+    snapshot = get_columnar_snapshot()
+    if snapshot is not None:
+        return {"methods": snapshot.methods_by_prefix(prefix, limit)}
+    return {"methods": fetch_method_locations(queries.METHODS_BY_PREFIX, (prefix, prefix + "\U0010ffff", limit))}
+
+@app.get("/snapshot-stats", tags=["Method Lookup"])
+def snapshot_stats():
+    """
+        Size of the columnar snapshot, including its memory per method
+    """
+    snapshot = get_columnar_snapshot()
+    if snapshot is None:
+        return {"enabled": False}
+    return {"enabled": True, **snapshot.memory_report()}
+
+def similar_rows(conn, matches):
+    if not matches:
+        return []
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(queries.CONTEXT_METHODS_BY_IDS, (json.dumps([method_id for method_id, _ in matches]),))
+    by_id = {row["method_id"]: dict(row) for row in cursor.fetchall()}
+    # Keep the order of the matches, best first
+    return [{**by_id[method_id], "score": score} for method_id, score in matches if method_id in by_id]
+
+@app.get("/similar-methods/{method_id}", tags=["Similar Methods"])
+def similar_methods(method_id: int, k: int = 5) -> dict[str, list[SimilarMethodResponse]]:
+    """
+        Get the k methods most similar to the method with given id
+    """
+    embedding_index = get_embedding_index()
+    with get_db_connection() as conn:
+        embedding_index.ensure_loaded(conn)
+        vector = embedding_index.vector_of(method_id)
+        if vector is None:
+            raise HTTPException(status_code=404, detail="Method not found")
+        matches = embedding_index.search(vector, k, exclude=method_id)
+        return {"similar_methods": similar_rows(conn, matches)}
+
+@app.get("/similar-code", tags=["Similar Methods"])
+def similar_code(query: str, k: int = 5) -> dict[str, list[SimilarMethodResponse]]:
+    """
+        Get the k methods most similar to a piece of code
+    """
+    embedding_index = get_embedding_index()
+    with get_db_connection() as conn:
+        embedding_index.ensure_loaded(conn)
+        vector = embedding_index.embedder.embed([query])[0]
+        matches = embedding_index.search(vector, k)
+        return {"similar_methods": similar_rows(conn, matches)}
+
+@app.post("/index-snapshot/export", tags=["Index Snapshots"])
+def export_index_snapshot(body: SnapshotBody):
+    """
+        Write a compressed snapshot of the index to the given path in the snapshots directory, returns its manifest
+    """
+    from snapshots import SnapshotError, export_snapshot, resolve_snapshot_path
+    try:
+        path = resolve_snapshot_path(body.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with get_db_connection() as conn:
+            manifest = export_snapshot(conn, path)
+    except (SnapshotError, OSError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"[SQLITE SERVER] Exported a snapshot to {body.path} in {manifest['seconds']:.2f}s")
+    return manifest
+
+@app.post("/index-snapshot/import", tags=["Index Snapshots"])
+def import_index_snapshot(body: SnapshotBody):
+    """
+        Replace the index with the snapshot at the given path in the snapshots directory, returns its manifest
+    """
+    from snapshots import SnapshotError, import_snapshot, resolve_snapshot_path
+    try:
+        path = resolve_snapshot_path(body.path)
+        with get_db_connection() as conn:
+            manifest = import_snapshot(conn, path)
+    except (SnapshotError, OSError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Everything kept in memory describes the old index
+    forget_shard(current_shard.get())
+    maintenance.mark_dirty(current_shard.get())
+    notifier.notify(current_shard.get(), manifest["generation"])
+    print(f"[SQLITE SERVER] Imported the snapshot {body.path} in {manifest['seconds']:.2f}s")
+    return manifest
+
+@app.get("/maintenance/stats", tags=["Maintenance"])
+def maintenance_stats():
+    """
+        Size of the database file, its free space, and what maintenance removed and reclaimed so far
+    """
+    from maintenance import space_report
+    with get_db_connection() as conn:
+        return {"space": space_report(conn), **maintenance.report()}
+
+@app.post("/maintenance/gc", tags=["Maintenance"])
+def maintenance_gc(dry_run: bool = False):
+    """
+        Remove orphaned rows now: methods without a class, calls and embeddings of deleted methods,
+        classes without a document, and empty documents and projects. A dry run only counts them.
+    """
+    with get_db_connection() as conn:
+        result = maintenance.collect(conn, current_shard.get(), dry_run)
+    if not dry_run:
+        forget_methods(result["removed_method_ids"])
+        if result["generation"]:
+            notifier.notify(current_shard.get(), result["generation"])
+        if result["removed_rows"] and current_shard.get() in columnar_snapshots:
+            rebuild_columnar_snapshot()
+    return {**result, "removed_method_ids": len(result["removed_method_ids"])}
+
+@app.post("/maintenance/compact", tags=["Maintenance"])
+def maintenance_compact(budget_ms: float = VACUUM_SLICE_MS, full: bool = False):
+    """
+        Give free pages back to the file system for up to budget_ms. A full compaction rebuilds the whole file,
+        blocking every other request, and is needed once for databases created before incremental vacuum was enabled.
+    """
+    with get_db_connection() as conn:
+        return maintenance.vacuum(conn, current_shard.get(), budget_ms, full)
+
+def read_changes(path, since):
+    with get_db_connection(path) as conn:
+        return change_log.changes_since(conn, since)
+
+@app.get("/changes", tags=["Changes"])
+def changes(since: int = 0) -> ChangesResponse:
+    """
+        Documents and methods added, updated or removed after generation since, with the current rows of the added
+        and updated ones. Pass the returned generation as since next time. With reset set the client is too far behind,
+        or the index was replaced, and has to fetch everything again.
+    """
+    return read_changes(current_shard.get(), since)
+
+async def change_events(request: Request, path: str, since: int):
+    while True:
+        # Listening before reading, so a generation committed while reading still wakes the stream
+        committed = notifier.listen(path)
+        delta = await asyncio.to_thread(read_changes, path, since)
+        if delta["generation"] != since or delta["reset"]:
+            since = delta["generation"]
+            if delta["reset"] or any(delta[kind][change] for kind in ("documents", "methods") for change in delta[kind]):
+                yield f"event: changes\nid: {since}\ndata: {json.dumps(delta)}\n\n"
+        try:
+            await asyncio.wait_for(committed.wait(), CHANGE_STREAM_HEARTBEAT)
+        except asyncio.TimeoutError:
+            if await request.is_disconnected():
+                return
+            yield ": keepalive\n\n"
+
+@app.get("/changes/stream", tags=["Changes"])
+def changes_stream(request: Request, since: Optional[int] = None):
+    """
+        Server-sent events, one "changes" event per new generation, in the format of /changes.
+        Starts after since, or after the Last-Event-ID header when reconnecting, or at the current generation.
+    """
+    path = current_shard.get()
+    if since is None:
+        last_event_id = request.headers.get("last-event-id")
+        if last_event_id and last_event_id.isdigit():
+            since = int(last_event_id)
+        else:
+            with get_db_connection(path) as conn:
+                since = change_log.latest_generation(conn)
+    return StreamingResponse(
+        change_events(request, path, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+@app.get("/workspaces", tags=["Workspaces"])
+def workspaces():
+    """
+        The shared database and every workspace database, with their sizes, and the ones currently open
+    """
+    paths = [DB_NAME] if os.path.exists(DB_NAME) else []
+    if os.path.isdir(SHARDS_DIR):
+        paths += sorted(os.path.join(SHARDS_DIR, name) for name in os.listdir(SHARDS_DIR) if name.endswith(".db"))
+    return {
+        "databases": [{"path": path, "bytes": os.path.getsize(path)} for path in paths],
+        "open": pool.report(),
+    }
+
+@app.get("/workspaces/methods-by-prefix", tags=["Workspaces"])
+def workspaces_methods_by_prefix(
+    prefix: str, workspaces: List[str] = Query(), limit: int = 50
+) -> dict[str, list[WorkspaceMethodLocationResponse]]:
+    """
+        Get the methods whose signature starts with prefix in any of the given workspaces, in signature order.
+        The workspace databases are attached to one connection, MAX_ATTACHED at a time, and queried together.
+    """
+    paths = {shard_path(workspace): workspace for workspace in workspaces}
+    missing = [workspace for path, workspace in paths.items() if not os.path.exists(path)]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Workspace not indexed: {', '.join(missing)}")
+    shards = list(paths)
+    rows = []
+    for start in range(0, len(shards), MAX_ATTACHED):
+        group = shards[start:start + MAX_ATTACHED]
+        with attached_shards(group) as conn:
+            conn.row_factory = sqlite3.Row
+            sql = " UNION ALL ".join(
+                queries.workspace_method_locations(f"s{i}", i) for i in range(len(group))
+            ) + " ORDER BY method_signature LIMIT ?"
+            params = [value for _ in group for value in (prefix, prefix + "\U0010ffff")]
+            for row in conn.execute(sql, (*params, limit)).fetchall():
+                row = dict(row)
+                row["workspace"] = paths[group[row.pop("shard")]]
+                rows.append(row)
+    rows.sort(key=lambda row: row["method_signature"])
+    return {"methods": rows[:limit]}
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    # Imported here so importing the app, as uvicorn's workers do, does not pay for it
+    import uvicorn
+    # Reloading runs the server in a second process watching the files, only worth it while developing
+    reload = os.environ.get("GIM_RELOAD", "") not in ("", "0", "false")
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=reload)
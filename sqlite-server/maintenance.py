@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+import change_log
+from index_reader import queries
+
+# Set to 0 to only run maintenance through the /maintenance endpoints
+MAINTENANCE_ENABLED = os.environ.get("GIM_MAINTENANCE", "1") not in ("", "0", "false")
+# The server counts as idle once it served no request for this long
+IDLE_SECONDS = float(os.environ.get("GIM_MAINTENANCE_IDLE_SECONDS", "30"))
+# How often the background task checks whether the server is idle
+CHECK_INTERVAL = float(os.environ.get("GIM_MAINTENANCE_INTERVAL", "10"))
+# Longest one slice of incremental vacuum may run, and so hold the write lock, while idle
+VACUUM_SLICE_MS = float(os.environ.get("GIM_VACUUM_SLICE_MS", "50"))
+# Pages freed per step of a slice, the deadline is checked between steps
+VACUUM_PAGES_PER_STEP = 128
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# Rows that nothing refers to any more, in the order they are removed, as (name, table, key, query for their keys).
+# Removing one kind can orphan the next, classes of a deleted document leave their methods behind.
+ORPHANS = [
+    ("classes_without_document", "classes", "id", queries.ORPHANED_CLASSES),
+    ("methods_without_class", "methods", "id", queries.ORPHANED_METHODS),
+    ("dangling_calls", "method_calls", "id", queries.DANGLING_CALLS),
+    ("dangling_embeddings", "method_embeddings", "method_id", queries.DANGLING_EMBEDDINGS),
+    ("empty_documents", "documents", "id", queries.EMPTY_DOCUMENTS),
+    ("empty_projects", "projects", "id", queries.EMPTY_PROJECTS),
+]
+
+
+def space_report(conn: sqlite3.Connection) -> dict:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    return {
+        "page_size": page_size,
+        "pages": pages,
+        "free_pages": free_pages,
+        "file_bytes": page_size * pages,
+        "free_bytes": page_size * free_pages,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+    }
+
+
+def collect_garbage(conn: sqlite3.Connection, dry_run: bool = False) -> dict:
+    """
+    Delete every orphaned row, in one transaction, recording the deleted documents and methods in the change log,
+    along with the methods that lost calls to deleted ones, and forget the oldest generations of the change log.
+    A dry run deletes them too and rolls back, so its counts include rows only orphaned by earlier deletions.
+    Returns the number of rows per kind of orphan, and the ids of the deleted methods.
+    """
+    started = time.perf_counter()
+    removed = {}
+    removed_method_ids = []
+    removed_document_ids = []
+    # Methods that are kept, but lost their calls to removed ones
+    caller_ids = []
+    generation = change_log.PendingGeneration(conn, "gc")
+    try:
+        for name, table, key, query in ORPHANS:
+            ids = [row[0] for row in conn.execute(query).fetchall()]
+            removed[name] = len(ids)
+            if not ids:
+                continue
+            if table == "methods":
+                removed_method_ids = ids
+            elif table == "documents":
+                removed_document_ids = ids
+            elif table == "method_calls":
+                caller_ids = [row[0] for row in conn.execute(queries.CALLERS_OF_CALLS, (json.dumps(ids),)).fetchall()]
+            conn.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+        if dry_run:
+            conn.rollback()
+        else:
+            generation.record(change_log.METHOD, {
+                **dict.fromkeys(caller_ids, change_log.UPDATED), **dict.fromkeys(removed_method_ids, change_log.REMOVED)
+            })
+            generation.record(change_log.DOCUMENT, {
+                **dict.fromkeys(change_log.documents_of(conn, caller_ids), change_log.UPDATED),
+                **dict.fromkeys(removed_document_ids, change_log.REMOVED),
+            })
+            change_log.prune(conn)
+            conn.commit()
+            # Refreshes the statistics the query planner uses, only where they went stale
+            conn.execute("PRAGMA optimize")
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+    return {
+        "dry_run": dry_run,
+        "removed": removed,
+        "removed_rows": sum(removed.values()),
+        "removed_method_ids": removed_method_ids,
+        "generation": generation.id,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def incremental_vacuum(conn: sqlite3.Connection, budget_ms: float = VACUUM_SLICE_MS) -> dict:
+    """
+    Return free pages to the file system, in small steps until none are left or budget_ms is used up.
+    Every step is its own short transaction, so readers and writers only wait for one step at a time.
+    Only has an effect on databases with auto_vacuum set to incremental, see full_vacuum.
+    """
+    started = time.perf_counter()
+    before = space_report(conn)
+    free_pages = before["free_pages"]
+    if before["auto_vacuum"] == "incremental":
+        deadline = started + budget_ms / 1000
+        while free_pages and time.perf_counter() < deadline:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    reclaimed_pages = before["free_pages"] - free_pages
+    return {
+        "mode": "incremental",
+        "reclaimed_bytes": reclaimed_pages * before["page_size"],
+        "free_bytes": free_pages * before["page_size"],
+        "file_bytes": (before["pages"] - reclaimed_pages) * before["page_size"],
+        "auto_vacuum": before["auto_vacuum"],
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def full_vacuum(conn: sqlite3.Connection) -> dict:
+    """
+    Rebuild the whole database file, blocking everything else while it runs.
+    Also switches databases created before auto_vacuum was set over to incremental vacuuming.
+    """
+    started = time.perf_counter()
+    before = space_report(conn)
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    after = space_report(conn)
+    return {
+        "mode": "full",
+        "reclaimed_bytes": before["file_bytes"] - after["file_bytes"],
+        "free_bytes": after["free_bytes"],
+        "file_bytes": after["file_bytes"],
+        "auto_vacuum": after["auto_vacuum"],
+        "seconds": time.perf_counter() - started,
+    }
+
+
+class Maintenance:
+    """
+    Keeps the index from growing without bound: collects garbage after the indexes were updated,
+    and compacts the file a slice at a time, but only while the server is idle.
+    """
+
+    def __init__(self):
+        self.last_activity = time.monotonic()
+        # Databases whose indexes were updated since their last collection
+        self.dirty: set[str] = set()
+        self.lock = threading.Lock()
+        self.last_gc: dict | None = None
+        self.last_vacuum: dict | None = None
+        self.reclaimed_bytes = 0
+        self.removed_rows = 0
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def idle(self) -> bool:
+        return time.monotonic() - self.last_activity >= IDLE_SECONDS
+
+    def mark_dirty(self, path: str):
+        self.dirty.add(path)
+
+    def collect(self, conn: sqlite3.Connection, path: str, dry_run: bool = False) -> dict:
+        with self.lock:
+            result = collect_garbage(conn, dry_run)
+            if not dry_run:
+                self.dirty.discard(path)
+                self.removed_rows += result["removed_rows"]
+                self.last_gc = {
+                    **result, "removed_method_ids": len(result["removed_method_ids"]), "path": path, "at": time.time()
+                }
+            return result
+
+    def vacuum(self, conn: sqlite3.Connection, path: str, budget_ms: float = VACUUM_SLICE_MS, full: bool = False) -> dict:
+        with self.lock:
+            result = full_vacuum(conn) if full else incremental_vacuum(conn, budget_ms)
+            self.reclaimed_bytes += max(result["reclaimed_bytes"], 0)
+            self.last_vacuum = {**result, "path": path, "at": time.time()}
+            return result
+
+    def report(self) -> dict:
+        return {
+            "enabled": MAINTENANCE_ENABLED,
+            "idle": self.idle(),
+            "dirty": sorted(self.dirty),
+            "removed_rows": self.removed_rows,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "last_gc": self.last_gc,
+            "last_vacuum": self.last_vacuum,
+        }
+
+    async def run_when_idle(self, step: Callable[[], None]):
+        """Call step in a worker thread every CHECK_INTERVAL seconds in which the server was idle"""
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            if not self.idle():
+                continue
+            try:
+                await asyncio.to_thread(step)
+            except sqlite3.Error as e:
+                # Most likely a request holding a lock, the next idle period tries again
+                print(f"[SQLITE SERVER] Maintenance failed: {e}")
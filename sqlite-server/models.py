@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class MethodsBody(BaseModel):
@@ -39,7 +39,7 @@ class FetchAllResponse(BaseModel):
     method_signature: str
     method_start_line: int
     method_end_line: int
-    method_body: str
+    method_body: Optional[str] = None
     callees: List[CallsResponseBody] = []  # Methods that this method calls
     callers: List[CallsResponseBody] = []  # Methods that call this method
 
@@ -68,7 +68,7 @@ class MethodsResponse(BaseModel):
     signature: str
     start_line: int
     end_line: int
-    body: str
+    body: Optional[str] = None
 
 
 class MethodCallsResponse(BaseModel):
@@ -80,3 +80,73 @@ class MethodCallsResponse(BaseModel):
 class UpdateIndexesResponse(BaseModel):
     id: int
     status: str
+
+
+class SimilarMethodResponse(BaseModel):
+    method_id: int
+    method_signature: str
+    method_body: Optional[str] = None
+    document_path: str
+    score: float  # Cosine similarity, 1 is identical
+
+
+class ContextMethod(BaseModel):
+    method_id: int
+    method_signature: str
+    method_body: Optional[str] = None
+    document_path: str
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    depth: int = 0  # Number of calls away from the requested method
+    score: Optional[float] = None  # Cosine similarity, only set for similar methods
+
+
+class MethodContextResponse(BaseModel):
+    method: ContextMethod
+    callees: List[ContextMethod] = []  # Methods called by the method, directly or through other callees
+    callers: List[ContextMethod] = []  # Methods calling the method, directly or through other callers
+    similar: List[ContextMethod] = []  # Nearest neighbours by embedding
+
+
+class MethodLocationResponse(BaseModel):
+    method_id: int
+    method_signature: str
+    class_id: int
+    class_name: str
+    document_path: str
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+
+
+class SnapshotBody(BaseModel):
+    path: str  # Snapshot file, relative to the snapshots directory of the server
+
+
+class WorkspaceMethodLocationResponse(MethodLocationResponse):
+    workspace: str  # Path of the workspace the method was found in
+
+
+class ChangedDocument(BaseModel):
+    document_id: int
+    document_path: str
+    project_name: str
+
+
+class DocumentChanges(BaseModel):
+    added: List[ChangedDocument] = []
+    updated: List[ChangedDocument] = []  # Something in the document was added, updated or removed
+    removed: List[int] = []  # Document ids
+
+
+class MethodChanges(BaseModel):
+    added: List[MethodLocationResponse] = []
+    updated: List[MethodLocationResponse] = []  # Body, location or calls changed
+    removed: List[int] = []  # Method ids
+
+
+class ChangesResponse(BaseModel):
+    generation: int  # Latest generation, pass it as since next time
+    since: int
+    reset: bool  # Too far behind, or the index was replaced, fetch everything again
+    documents: Optional[DocumentChanges] = None  # Left out on reset
+    methods: Optional[MethodChanges] = None
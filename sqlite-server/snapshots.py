@@ -0,0 +1,207 @@
+"""
+Export and import of the whole index as a single snapshot file, so a new workspace or CI checkout
+can start from a copy instead of re-ingesting from scratch.
+
+A snapshot is an uncompressed tar holding manifest.json and database.db.gz. The manifest can be read
+without decompressing the database.
+
+The server only reads and writes snapshots inside SNAPSHOTS_DIR, the command line takes any path.
+
+    python snapshots.py export index.gimsnap [--db database.db | --workspace PATH]
+    python snapshots.py import index.gimsnap [--db database.db | --workspace PATH]
+    python snapshots.py manifest index.gimsnap
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import time
+
+import change_log
+from database import DB_NAME, connect, ensure_schema, shard_path
+from tables import Tables
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+DATABASE_NAME = "database.db.gz"
+COUNTED_TABLES = ["projects", "documents", "classes", "methods", "method_calls", "method_embeddings"]
+# Copy this many pages per step of the backup, so a live server is only locked in short bursts
+BACKUP_PAGES = 1024
+# Directory the server exports snapshots to and imports them from, see resolve_snapshot_path
+SNAPSHOTS_DIR = os.environ.get("GIM_SNAPSHOTS_DIR", "snapshots")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def resolve_snapshot_path(name: str) -> str:
+    """
+    Path of the snapshot file called name inside SNAPSHOTS_DIR, for names sent by clients of the server.
+    Raises SnapshotError for absolute paths, and for paths that lead out of the directory.
+    """
+    parts = [part for part in re.split(r"[\\/]", name) if part]
+    if not parts or os.path.isabs(name) or re.match(r"^[A-Za-z]:|[\\/]", name) or ".." in parts:
+        raise SnapshotError(f"Snapshot path must be relative to the snapshots directory: {name!r}")
+    root = os.path.realpath(SNAPSHOTS_DIR)
+    path = os.path.realpath(os.path.join(root, *parts))
+    # Symbolic links inside the directory may still point out of it
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise SnapshotError(f"Snapshot path must be relative to the snapshots directory: {name!r}")
+    return path
+
+
+def _sha256_of(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _table_counts(conn: sqlite3.Connection) -> dict[str, int]:
+    counts = {}
+    for table in COUNTED_TABLES:
+        try:
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        except sqlite3.OperationalError:
+            counts[table] = 0
+    return counts
+
+
+def export_snapshot(conn: sqlite3.Connection, path: str, compress_level: int = 6) -> dict:
+    """
+    Write a consistent copy of the database behind conn to path, taken with SQLite's backup API,
+    so the server can keep serving and ingesting while it runs. Returns the manifest.
+    """
+    started = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        copy_path = os.path.join(work, "database.db")
+        copy = sqlite3.connect(copy_path)
+        try:
+            conn.backup(copy, pages=BACKUP_PAGES)
+            schema_version = copy.execute("PRAGMA user_version").fetchone()[0]
+            counts = _table_counts(copy)
+        finally:
+            copy.close()
+
+        compressed_path = os.path.join(work, DATABASE_NAME)
+        with open(copy_path, "rb") as source, gzip.open(compressed_path, "wb", compresslevel=compress_level) as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "schema_version": schema_version,
+            "counts": counts,
+            "database_bytes": os.path.getsize(copy_path),
+            "compressed_bytes": os.path.getsize(compressed_path),
+            "sha256": _sha256_of(copy_path),
+        }
+        manifest_bytes = json.dumps(manifest, indent=2).encode("utf-8")
+
+        # Written next to the target and renamed, so a failed export never leaves a truncated snapshot behind
+        partial_path = os.path.join(work, "snapshot.partial")
+        with tarfile.open(partial_path, "w") as archive:
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(manifest_bytes)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(manifest_bytes))
+            archive.add(compressed_path, arcname=DATABASE_NAME)
+        os.replace(partial_path, path)
+
+    manifest["seconds"] = time.perf_counter() - started
+    return manifest
+
+
+def read_manifest(path: str) -> dict:
+    try:
+        with tarfile.open(path, "r") as archive:
+            member = archive.extractfile(MANIFEST_NAME)
+            if member is None:
+                raise SnapshotError(f"{path} has no {MANIFEST_NAME}")
+            return json.load(member)
+    except (tarfile.TarError, KeyError, json.JSONDecodeError) as e:
+        raise SnapshotError(f"{path} is not a valid snapshot: {e}") from e
+
+
+def import_snapshot(conn: sqlite3.Connection, path: str) -> dict:
+    """
+    Replace the contents of the database behind conn with the snapshot at path.
+    The snapshot is checked against its manifest before anything is touched, and copied in
+    with the backup API, so other open connections see either the old or the new index.
+    Returns the manifest.
+    """
+    started = time.perf_counter()
+    manifest = read_manifest(path)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format {manifest.get('format')}")
+    if manifest.get("schema_version", 0) > Tables.SCHEMA_VERSION:
+        raise SnapshotError(
+            f"Snapshot schema version {manifest['schema_version']} is newer than this server's {Tables.SCHEMA_VERSION}"
+        )
+
+    replaced_generation = change_log.latest_generation(conn)
+    with tempfile.TemporaryDirectory() as work:
+        copy_path = os.path.join(work, "database.db")
+        with tarfile.open(path, "r") as archive:
+            member = archive.extractfile(DATABASE_NAME)
+            if member is None:
+                raise SnapshotError(f"{path} has no {DATABASE_NAME}")
+            with gzip.open(member, "rb") as source, open(copy_path, "wb") as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+        if _sha256_of(copy_path) != manifest["sha256"]:
+            raise SnapshotError("Snapshot database does not match the checksum in its manifest")
+
+        copy = sqlite3.connect(copy_path)
+        try:
+            if copy.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise SnapshotError("Snapshot database is corrupt")
+            # Older snapshots are brought up to the current schema before they are copied in
+            ensure_schema(copy)
+            copy.backup(conn, pages=BACKUP_PAGES)
+        finally:
+            copy.close()
+    # Ids in the snapshot have nothing to do with the ones clients know, they have to fetch everything again.
+    # The snapshot's own generations may be numbered lower than the ones clients saw, so counting continues from those
+    manifest["generation"] = change_log.begin_generation(
+        conn, "snapshot-import", reset=True, after=replaced_generation
+    )
+    conn.commit()
+
+    manifest["seconds"] = time.perf_counter() - started
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the index")
+    parser.add_argument("command", choices=["export", "import", "manifest"])
+    parser.add_argument("snapshot", help="path of the snapshot file")
+    parser.add_argument("--db", default=DB_NAME, help="database to export from or import into")
+    parser.add_argument("--level", type=int, default=6, help="gzip compression level for export")
+    parser.add_argument("--workspace", help="use the database of this workspace instead of --db")
+    args = parser.parse_args()
+    db = shard_path(args.workspace) if args.workspace else args.db
+
+    if args.command == "manifest":
+        print(json.dumps(read_manifest(args.snapshot), indent=2))
+    else:
+        if os.path.dirname(db):
+            os.makedirs(os.path.dirname(db), exist_ok=True)
+        conn = connect(db)
+        try:
+            if args.command == "export":
+                result = export_snapshot(conn, args.snapshot, args.level)
+            else:
+                result = import_snapshot(conn, args.snapshot)
+        finally:
+            conn.close()
+        print(json.dumps(result, indent=2))
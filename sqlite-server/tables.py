@@ -1,4 +1,8 @@
 class Tables:
+    # Stored in PRAGMA user_version, startup skips the DDL when the database already has it.
+    # Bump it whenever the statements below change.
+    SCHEMA_VERSION = 4
+
     @staticmethod
     def define_tables():
         return [
@@ -7,6 +11,10 @@ class Tables:
             Tables.classes(),
             Tables.methods(),
             Tables.method_calls(),
+            Tables.method_embeddings(),
+            Tables.generations(),
+            Tables.changes(),
+            *Tables.indexes(),
         ]
 
     @staticmethod
@@ -50,6 +58,8 @@ class Tables:
         #   "Signature": "<projectname>.<classname>.<methodname(opt params)>",
         #   "Body": "<string of method body>", -- Includes /n and {} if newlines are present, else is directly a string,
         # }
+        # document_id is the document the method was last analyzed in, which for partial classes
+        # is not necessarily the document of its class
         return """
         CREATE TABLE IF NOT EXISTS methods (
             id INTEGER PRIMARY KEY,
@@ -59,7 +69,9 @@ class Tables:
             start_line INTEGER,
             end_line INTEGER,
             body TEXT,
-            FOREIGN KEY(class_id) REFERENCES classes(id)
+            document_id INTEGER,
+            FOREIGN KEY(class_id) REFERENCES classes(id),
+            FOREIGN KEY(document_id) REFERENCES documents(id)
         )
         """
 
@@ -79,3 +91,69 @@ class Tables:
             FOREIGN KEY(callee_id) REFERENCES methods(id)
         )
         """
+
+    @staticmethod
+    def method_embeddings():
+        # One vector per method, computed from its signature and body.
+        # vector is a float32 blob of dim values, text_hash tells whether the method changed since it was embedded,
+        # and model is the name of the embedder that produced it.
+        return """
+        CREATE TABLE IF NOT EXISTS method_embeddings (
+            method_id INTEGER PRIMARY KEY,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            FOREIGN KEY(method_id) REFERENCES methods(id)
+        )
+        """
+
+    @staticmethod
+    def generations():
+        # One row per write to the indexes: an ingest, a garbage collection, or a snapshot import (with reset set).
+        # AUTOINCREMENT so ids are never reused, clients keep the last one they saw as their cursor
+        return """
+        CREATE TABLE IF NOT EXISTS generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            source TEXT NOT NULL,
+            reset INTEGER NOT NULL DEFAULT 0
+        )
+        """
+
+    @staticmethod
+    def changes():
+        # What happened in a generation, kind is "document" or "method", change is "added", "updated" or "removed"
+        return """
+        CREATE TABLE IF NOT EXISTS changes (
+            generation INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            change TEXT NOT NULL,
+            PRIMARY KEY (generation, kind, entity_id),
+            FOREIGN KEY(generation) REFERENCES generations(id)
+        ) WITHOUT ROWID
+        """
+
+    @staticmethod
+    def indexes():
+        # Lookups done for every method and call while ingesting, and by the call graph queries
+        return [
+            "CREATE INDEX IF NOT EXISTS idx_methods_signature ON methods(signature)",
+            "CREATE INDEX IF NOT EXISTS idx_methods_class_name ON methods(class_id, name)",
+            "CREATE INDEX IF NOT EXISTS idx_classes_document ON classes(document_id)",
+            "CREATE INDEX IF NOT EXISTS idx_method_calls_caller ON method_calls(caller_id, callee_id)",
+            "CREATE INDEX IF NOT EXISTS idx_method_calls_callee ON method_calls(callee_id)",
+            "CREATE INDEX IF NOT EXISTS idx_methods_document ON methods(document_id)",
+        ]
+
+    @staticmethod
+    def migrations():
+        # Statements that bring a database of the previous version up to the given version,
+        # run before define_tables, which then creates any new tables and indexes
+        return {
+            3: [
+                "ALTER TABLE methods ADD COLUMN document_id INTEGER REFERENCES documents(id)",
+                "UPDATE methods SET document_id = (SELECT document_id FROM classes WHERE classes.id = methods.class_id)",
+            ],
+        }
@@ -0,0 +1,44 @@
+import pytest
+
+from database import close_db_connections, connect, ensure_schema
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Every test gets an empty directory for database.db and the shards, and closes them afterwards"""
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    close_db_connections()
+
+
+@pytest.fixture
+def conn(data_dir):
+    conn = connect(str(data_dir / "test.db"))
+    ensure_schema(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+    return TestClient(app)
+
+
+def project(document: str, methods: dict[str, str], calls: list[tuple[str, str]] = (), name: str = "App") -> dict:
+    """
+    Body of one project for /update-indexes, in the format the analyzer posts.
+    methods maps signatures like "App.Orders.Total()" to their bodies, the classes are taken from them.
+    """
+    classes = sorted({".".join(signature.split("(")[0].split(".")[:2]) for signature in methods})
+    return {
+        "Project": name,
+        "Document": document,
+        "Classes": classes,
+        "Methods": [
+            {"Signature": signature, "Body": body, "StartLine": line * 10, "EndLine": line * 10 + 5}
+            for line, (signature, body) in enumerate(methods.items(), 1)
+        ],
+        "Calls": [{"Caller": caller, "Callee": callee} for caller, callee in calls],
+    }
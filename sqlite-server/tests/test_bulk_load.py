@@ -0,0 +1,93 @@
+import io
+import json
+
+import pytest
+
+import main
+from bulk_load import bulk_load, iter_json_array
+from conftest import project
+from database import DB_NAME, connect
+
+
+def write_analysis(path, items):
+    path.write_text(json.dumps(items))
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_iter_json_array_across_chunks(chunk_size):
+    items = [{"Document": f"/src/{i}.cs", "Body": "{ \"[,]\" }"} for i in range(5)]
+    text = json.dumps(items, indent=2)
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == items
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text[:-10]), chunk_size))
+
+
+def test_failing_projects_are_skipped(conn, data_dir):
+    path = write_analysis(data_dir / "analysis.json", [
+        project("/src/One.cs", {"App.One.Run()": "{ }"}),
+        {"Document": "/src/Invalid.cs"},
+        # The callee has no class, the updater fails after it wrote the project and document
+        project("/src/Broken.cs", {"App.Broken.Run()": "{ }"}, [("App.Broken.Run()", "nowhere")]),
+        project("/src/Two.cs", {"App.Two.Run()": "{ }"}),
+    ])
+    result = bulk_load(conn, [path], batch=2)
+    assert result["errors"] == 2
+    assert result["projects"] == 2
+    documents = [row[0] for row in conn.execute("SELECT path FROM documents ORDER BY path")]
+    assert documents == ["/src/One.cs", "/src/Two.cs"]
+    assert conn.execute("SELECT COUNT(*) FROM changes WHERE entity_id NOT IN (SELECT id FROM documents) AND kind = 'document'").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("verbose", [False, True])
+def test_calls_are_only_reported_when_verbose(conn, data_dir, capsys, verbose):
+    path = write_analysis(data_dir / "analysis.json", [
+        project("/src/Orders.cs", {"App.Orders.Total()": "{ }", "App.Orders.Sum()": "{ }"}, [("App.Orders.Total()", "App.Orders.Sum")]),
+    ])
+    assert bulk_load(conn, [path], verbose=verbose)["projects"] == 1
+    assert conn.execute("SELECT COUNT(*) FROM method_calls").fetchone()[0] == 1
+    assert ("Inserting method call" in capsys.readouterr().out) == verbose
+
+
+def test_server_picks_up_bulk_loaded_rows(client, data_dir, monkeypatch):
+    monkeypatch.setattr(main, "COLUMNAR_SNAPSHOT", True)
+    # Checks for writes of other processes on every lookup
+    monkeypatch.setattr(main, "EXTERNAL_WRITES_INTERVAL", 0)
+    client.post("/update-indexes", json=[project("/src/Orders.cs", {"App.Orders.Total()": "{ return lines.Sum(); }"})])
+    # Loads the vectors and the snapshot into memory
+    assert len(client.get("/similar-code", params={"query": "Sum"}).json()["similar_methods"]) == 1
+    assert len(client.get("/methods-by-prefix", params={"prefix": "App."}).json()["methods"]) == 1
+
+    loader = connect(str(data_dir / DB_NAME))
+    path = write_analysis(data_dir / "analysis.json", [
+        project("/src/Invoice.cs", {"App.Invoice.Total()": "{ return lines.Sum(); }"}),
+    ])
+    bulk_load(loader, [path])
+    loader.close()
+
+    similar = client.get("/similar-code", params={"query": "return lines.Sum();"}).json()["similar_methods"]
+    assert sorted(method["method_signature"] for method in similar) == ["App.Invoice.Total()", "App.Orders.Total()"]
+    methods = client.get("/methods-by-prefix", params={"prefix": "App."}).json()["methods"]
+    assert [method["method_signature"] for method in methods] == ["App.Invoice.Total()", "App.Orders.Total()"]
+
+
+@pytest.mark.parametrize("path", ["/etc/passwd", "../database.db", "nested/../../database.db", "C:\\index.gimsnap", ""])
+def test_snapshot_paths_stay_in_the_snapshots_directory(client, path):
+    assert client.post("/index-snapshot/export", json={"path": path}).status_code == 400
+    assert client.post("/index-snapshot/import", json={"path": path}).status_code == 400
+
+
+def test_snapshot_round_trip(client, data_dir):
+    client.post("/update-indexes", json=[project("/src/Orders.cs", {"App.Orders.Total()": "{ }"})])
+    manifest = client.post("/index-snapshot/export", json={"path": "nightly/index.gimsnap"}).json()
+    assert manifest["counts"]["methods"] == 1
+    assert (data_dir / "snapshots" / "nightly" / "index.gimsnap").exists()
+
+    client.post("/update-indexes", json=[project("/src/Report.cs", {"App.Report.Print()": "{ }"})])
+    assert len(client.get("/fetch-methods").json()["data"]) == 2
+    response = client.post("/index-snapshot/import", json={"path": "nightly/index.gimsnap"})
+    assert response.status_code == 200
+    assert [method["signature"] for method in client.get("/fetch-methods").json()["data"]] == ["App.Orders.Total()"]
+    # Clients that saw the generation of Report.cs are told to start over, even though the snapshot only had one
+    assert response.json()["generation"] == 3
+    assert client.get("/changes", params={"since": 2}).json()["reset"]
@@ -0,0 +1,137 @@
+import json
+import sqlite3
+
+import change_log
+from bulk_load import bulk_load
+from conftest import project
+from database import DB_NAME
+from update_indexes import UpdateIndexes
+
+
+def generation_with(conn, changes: dict[int, str], source="test", reset=False) -> int:
+    generation = change_log.begin_generation(conn, source, reset)
+    change_log.record(conn, generation, change_log.METHOD, changes)
+    conn.commit()
+    return generation
+
+
+def test_changes_collapse_to_their_net_effect(conn):
+    process(conn, project("/src/Orders.cs", {"App.Orders.Total()": "{ return 1; }", "App.Orders.Count()": "{ }"}))
+    process(conn, project("/src/Orders.cs", {"App.Orders.Total()": "{ return 2; }"}))
+
+    # Added and then removed is nothing, added and then updated stays added
+    delta = change_log.changes_since(conn, 0)
+    assert [row["method_signature"] for row in delta["methods"]["added"]] == ["App.Orders.Total()"]
+    assert delta["methods"]["updated"] == delta["methods"]["removed"] == []
+
+    delta = change_log.changes_since(conn, 1)
+    assert [row["method_signature"] for row in delta["methods"]["updated"]] == ["App.Orders.Total()"]
+    assert len(delta["methods"]["removed"]) == 1
+
+
+def test_added_and_updated_rows_are_current(conn):
+    process(conn, project("/src/Orders.cs", {"App.Orders.Total()": "{ return 1; }"}))
+    since = change_log.latest_generation(conn)
+    process(conn, project("/src/Orders.cs", {"App.Orders.Total()": "{ return 2; }", "App.Orders.Count()": "{ }"}))
+    delta = change_log.changes_since(conn, since)
+    assert [row["method_signature"] for row in delta["methods"]["added"]] == ["App.Orders.Count()"]
+    assert [row["method_signature"] for row in delta["methods"]["updated"]] == ["App.Orders.Total()"]
+    assert [row["document_path"] for row in delta["documents"]["updated"]] == ["/src/Orders.cs"]
+
+
+def test_reset_when_ahead_pruned_or_replaced(conn):
+    for _ in range(5):
+        generation_with(conn, {1: change_log.UPDATED})
+    latest = change_log.latest_generation(conn)
+    assert change_log.changes_since(conn, latest + 1)["reset"]
+
+    assert change_log.prune(conn, keep=2) == 3
+    conn.commit()
+    assert change_log.changes_since(conn, latest - 3)["reset"]
+    assert not change_log.changes_since(conn, latest - 2)["reset"]
+
+    generation_with(conn, {}, source="snapshot-import", reset=True)
+    assert change_log.changes_since(conn, latest)["reset"]
+
+
+def test_pending_generation_is_only_started_by_changes(conn):
+    generation = change_log.PendingGeneration(conn, "test")
+    generation.record(change_log.METHOD, {})
+    assert generation.id is None
+    assert change_log.latest_generation(conn) == 0
+    generation.record(change_log.METHOD, {1: change_log.ADDED})
+    assert generation.id == change_log.latest_generation(conn) == 1
+
+
+def test_update_indexes_commits_all_projects_in_one_generation(client, data_dir, monkeypatch):
+    # What another connection sees after every project of the request
+    seen = []
+    process = UpdateIndexes.process
+
+    def process_and_look(self):
+        result = process(self)
+        with sqlite3.connect(data_dir / DB_NAME) as other:
+            seen.append((
+                other.execute("SELECT COALESCE(MAX(id), 0) FROM generations").fetchone()[0],
+                other.execute("SELECT COUNT(*) FROM changes").fetchone()[0],
+            ))
+        return result
+
+    monkeypatch.setattr(UpdateIndexes, "process", process_and_look)
+    response = client.post("/update-indexes", json=[
+        project(f"/src/File{i}.cs", {f"App.File{i}.Run()": "{ }"}) for i in range(3)
+    ])
+    assert response.status_code == 200
+    assert seen == [(0, 0)] * 3
+
+    delta = client.get("/changes", params={"since": 0}).json()
+    assert delta["generation"] == 1
+    assert [document["document_path"] for document in delta["documents"]["added"]] == [
+        "/src/File0.cs", "/src/File1.cs", "/src/File2.cs"
+    ]
+    assert len(delta["methods"]["added"]) == 3
+
+
+def test_update_indexes_without_changes_starts_no_generation(client):
+    body = [project("/src/Orders.cs", {"App.Orders.Total()": "{ return 1; }"})]
+    client.post("/update-indexes", json=body)
+    client.post("/update-indexes", json=body)
+    delta = client.get("/changes", params={"since": 1}).json()
+    assert delta["generation"] == 1
+    assert delta["methods"] == {"added": [], "updated": [], "removed": []}
+
+
+def test_bulk_load_commits_a_generation_per_batch(conn, data_dir):
+    path = data_dir / "analysis.json"
+    path.write_text(json.dumps([project(f"/src/File{i}.cs", {f"App.File{i}.Run()": "{ }"}) for i in range(3)]))
+    result = bulk_load(conn, [str(path)], batch=2)
+    assert result["generations"] == 2
+    assert result["projects"] == 3
+    assert result["methods_embedded"] == 3
+
+    delta = change_log.changes_since(conn, 1)
+    assert [document["document_path"] for document in delta["documents"]["added"]] == ["/src/File2.cs"]
+    # Committed with their generation
+    assert conn.execute("SELECT COUNT(*) FROM method_embeddings").fetchone()[0] == 3
+
+    # Loading the same file again changes nothing
+    assert bulk_load(conn, [str(path)], batch=2)["generations"] == 0
+
+
+def process(conn, body: dict):
+    from models import ProjectBody
+    generation = change_log.PendingGeneration(conn, "test")
+    UpdateIndexes(ProjectBody.model_validate(body), conn=conn, generation=generation).process()
+    return generation.id
+
+
+def test_changes_locate_methods_like_the_lookups_do(client):
+    client.post("/update-indexes", json=[project("/src/Form1.cs", {"App.Form1.Load()": "{ }"})])
+    client.post("/update-indexes", json=[project("/src/Form1.Designer.cs", {"App.Form1.InitializeComponent()": "{ }"})])
+    delta = client.get("/changes", params={"since": 0}).json()
+    assert len(delta["methods"]["added"]) == 2
+    for method in delta["methods"]["added"]:
+        found = client.get(
+            "/methods-in-range", params={"file_name": method["document_path"], "start_line": 0, "end_line": 100}
+        ).json()["methods"]
+        assert method in found
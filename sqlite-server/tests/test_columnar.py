@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+import main
+
+
+def random_index(client, seed: int):
+    """Methods of a few classes spread over a few documents, partial classes included, with random line ranges"""
+    rng = random.Random(seed)
+    documents = {f"/src/File{d}.cs": [] for d in range(5)}
+    for i in range(120):
+        start = rng.randrange(0, 400)
+        end = start + rng.randrange(0, 40)
+        signature = f"App.C{rng.randrange(6)}.M{i}_{rng.choice(['Get', 'Set', 'Run'])}()"
+        documents[rng.choice(list(documents))].append(
+            {"Signature": signature, "Body": "{ }", "StartLine": start, "EndLine": end}
+        )
+    client.post("/update-indexes", json=[
+        {
+            "Project": "App",
+            "Document": path,
+            "Classes": sorted({".".join(method["Signature"].split(".")[:2]) for method in methods}),
+            "Methods": methods,
+            "Calls": [],
+        }
+        for path, methods in documents.items()
+    ])
+    return rng, list(documents)
+
+
+def lookups(client, rng, paths) -> list[tuple[str, dict]]:
+    requests = [("/methods-by-prefix", {"prefix": prefix, "limit": limit})
+                for prefix in ("", "App.", "App.C1", "App.C2.M1", "App.C9", "B") for limit in (5, 500)]
+    requests += [(f"/class-methods/{class_id}", {}) for class_id in range(0, 9)]
+    for _ in range(40):
+        start = rng.randrange(-10, 450)
+        requests.append(("/methods-in-range", {
+            "file_name": rng.choice(paths + ["/src/Missing.cs"]), "start_line": start, "end_line": start + rng.randrange(0, 80),
+        }))
+    return requests
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_snapshot_answers_like_sqlite(client, monkeypatch, seed):
+    rng, paths = random_index(client, seed)
+    requests = lookups(client, rng, paths)
+    monkeypatch.setattr(main, "COLUMNAR_SNAPSHOT", False)
+    expected = [client.get(url, params=params).json() for url, params in requests]
+    monkeypatch.setattr(main, "COLUMNAR_SNAPSHOT", True)
+    assert [client.get(url, params=params).json() for url, params in requests] == expected
+    assert any(response["methods"] for response in expected)
+
+
+def test_snapshot_lookups_do_not_go_to_sqlite(client, monkeypatch):
+    monkeypatch.setattr(main, "COLUMNAR_SNAPSHOT", True)
+    monkeypatch.setattr(main, "EXTERNAL_WRITES_INTERVAL", 3600)
+    client.post("/update-indexes", json=[{
+        "Project": "App", "Document": "/src/A.cs", "Classes": ["App.A"],
+        "Methods": [{"Signature": "App.A.Run()", "Body": "{ }", "StartLine": 1, "EndLine": 5}], "Calls": [],
+    }])
+    assert client.get("/methods-by-prefix", params={"prefix": "App."}).json()["methods"]
+
+    def no_sqlite(*args, **kwargs):
+        raise AssertionError("went to SQLite")
+
+    monkeypatch.setattr(main, "get_db_connection", no_sqlite)
+    for _ in range(3):
+        assert len(client.get("/methods-by-prefix", params={"prefix": "App."}).json()["methods"]) == 1
+
+
+def test_snapshot_follows_writes_of_this_server_and_of_others(client, monkeypatch):
+    import change_log
+    from database import get_db_connection
+
+    monkeypatch.setattr(main, "COLUMNAR_SNAPSHOT", True)
+    monkeypatch.setattr(main, "EXTERNAL_WRITES_INTERVAL", 3600)
+
+    def body(signature):
+        return [{
+            "Project": "App", "Document": "/src/A.cs", "Classes": ["App.A"],
+            "Methods": [{"Signature": signature, "Body": "{ }", "StartLine": 1, "EndLine": 5}], "Calls": [],
+        }]
+
+    def signatures():
+        return [row["method_signature"] for row in client.get("/methods-by-prefix", params={"prefix": "App."}).json()["methods"]]
+
+    client.post("/update-indexes", json=body("App.A.Run()"))
+    assert signatures() == ["App.A.Run()"]
+    client.post("/update-indexes", json=body("App.A.Stop()"))
+    assert signatures() == ["App.A.Stop()"]
+
+    # Another process writes a generation, noticed at the next check
+    with get_db_connection() as server_conn:
+        server_conn.execute("UPDATE methods SET signature = 'App.A.Halt()'")
+        generation = change_log.PendingGeneration(server_conn, "other")
+        generation.record(change_log.METHOD, {1: change_log.UPDATED})
+        server_conn.commit()
+    assert signatures() == ["App.A.Stop()"]
+    monkeypatch.setattr(main, "EXTERNAL_WRITES_INTERVAL", 0)
+    assert signatures() == ["App.A.Halt()"]
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from embeddings import Embedder, HashingEmbedder
+from conftest import project
+
+
+def test_embedder_must_implement_embed():
+    with pytest.raises(TypeError):
+        Embedder()
+
+    class Incomplete(Embedder):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_hashing_embedder_finds_copied_code():
+    embedder = HashingEmbedder(dim=256)
+    vectors = embedder.embed([
+        "int Total(Order order) { return order.Lines.Sum(line => line.Price); }",
+        "int Total(Order order) { return order.Lines.Sum(line => line.Price); }",
+        "void Log(string message) { Console.WriteLine(message); }",
+    ])
+    assert vectors.shape == (3, 256)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
+    assert vectors[0] @ vectors[1] > 0.99
+    assert vectors[0] @ vectors[2] < 0.5
+
+
+def test_methods_without_a_body_are_served(client):
+    client.post("/update-indexes", json=[
+        project("/src/Orders.cs", {"App.Orders.Total()": "{ return 1; }", "App.Orders.Count()": "{ return 2; }"}),
+    ])
+    from database import get_db_connection, DB_NAME
+    with get_db_connection(DB_NAME) as conn:
+        # Rows loaded by older versions, or by other tools, may have no body
+        conn.execute("UPDATE methods SET body = NULL WHERE signature = 'App.Orders.Count()'")
+        conn.commit()
+        method_id = conn.execute("SELECT id FROM methods WHERE signature = 'App.Orders.Total()'").fetchone()[0]
+
+    response = client.get("/fetch-methods")
+    assert response.status_code == 200
+    assert {method["body"] for method in response.json()["data"]} == {"{ return 1; }", None}
+    assert client.get("/fetch-all").status_code == 200
+
+    response = client.get(f"/similar-methods/{method_id}", params={"k": 1})
+    assert response.status_code == 200
+    assert response.json()["similar_methods"][0]["method_body"] is None
+
+
+def test_refresh_takes_more_ids_than_sqlite_has_parameters(conn):
+    from embeddings import EmbeddingIndex
+
+    conn.execute("INSERT INTO classes (id, name) VALUES (1, 'App.Many')")
+    conn.executemany(
+        "INSERT INTO methods (id, class_id, name, signature, body) VALUES (?, 1, ?, ?, '{ }')",
+        [(i, f"M{i}", f"App.Many.M{i}()") for i in range(1, 33001)],
+    )
+    conn.commit()
+    embedding_index = EmbeddingIndex(HashingEmbedder(dim=16))
+    embedding_index.load(conn)
+    assert embedding_index.refresh(conn, range(1, 33001)) == 33000
+    assert embedding_index.refresh(conn, range(1, 33001)) == 0
@@ -0,0 +1,99 @@
+import change_log
+from conftest import project
+from maintenance import ORPHANS, collect_garbage, incremental_vacuum, space_report
+from models import ProjectBody
+from update_indexes import UpdateIndexes
+
+
+def index(conn, *bodies):
+    for body in bodies:
+        UpdateIndexes(ProjectBody.model_validate(body), conn=conn, generation=change_log.PendingGeneration(conn, "test")).process()
+
+
+def counts(conn) -> dict[str, int]:
+    return {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("projects", "documents", "classes", "methods", "method_calls")
+    }
+
+
+def orphan_everything(conn):
+    """Orders.cs loses its document row, leaving its class, methods, their calls, and the Orders project behind"""
+    index(
+        conn,
+        project("/src/Orders.cs", {"Shop.Orders.Total()": "{ }", "Shop.Orders.Count()": "{ }"}, name="Shop"),
+        project("/src/Report.cs", {"App.Report.Print()": "{ Orders.Total(); }"}, [("App.Report.Print()", "Shop.Orders.Total")]),
+    )
+    conn.execute("INSERT INTO documents (project_id, path) VALUES (1, '/src/Empty.cs')")
+    conn.execute(
+        "INSERT INTO method_embeddings (method_id, model, dim, text_hash, vector) VALUES (999, 'test', 1, '', x'00000000')"
+    )
+    conn.execute("DELETE FROM documents WHERE path = '/src/Orders.cs'")
+    conn.commit()
+
+
+def test_dry_run_counts_without_deleting(conn):
+    orphan_everything(conn)
+    before = counts(conn)
+    result = collect_garbage(conn, dry_run=True)
+    assert result["removed"] == {
+        "classes_without_document": 1,
+        "methods_without_class": 2,
+        "dangling_calls": 1,
+        "dangling_embeddings": 1,
+        "empty_documents": 1,
+        "empty_projects": 1,
+    }
+    assert result["generation"] is None
+    assert counts(conn) == before
+
+
+def test_collect_garbage_removes_orphans_and_records_them(conn):
+    orphan_everything(conn)
+    since = change_log.latest_generation(conn)
+    result = collect_garbage(conn)
+    assert result["removed_rows"] == 7
+    assert len(result["removed_method_ids"]) == 2
+    assert counts(conn) == {"projects": 1, "documents": 1, "classes": 1, "methods": 1, "method_calls": 0}
+    for _, _, _, query in ORPHANS:
+        assert conn.execute(query).fetchall() == []
+
+    delta = change_log.changes_since(conn, since)
+    assert delta["generation"] == result["generation"]
+    assert sorted(delta["methods"]["removed"]) == sorted(result["removed_method_ids"])
+    # Print lost its call to Total, so it and its document changed
+    assert [row["method_signature"] for row in delta["methods"]["updated"]] == ["App.Report.Print()"]
+    assert [row["document_path"] for row in delta["documents"]["updated"]] == ["/src/Report.cs"]
+
+    # Nothing left to collect, so no new generation either
+    again = collect_garbage(conn)
+    assert again["removed_rows"] == 0
+    assert again["generation"] is None
+
+
+def test_removing_a_method_updates_callers_in_other_documents(conn):
+    index(
+        conn,
+        project("/src/Orders.cs", {"App.Orders.Total()": "{ }", "App.Orders.Count()": "{ }"}),
+        project("/src/Report.cs", {"App.Report.Print()": "{ Orders.Total(); }"}, [("App.Report.Print()", "App.Orders.Total")]),
+    )
+    since = change_log.latest_generation(conn)
+    # Total is gone from Orders.cs
+    index(conn, project("/src/Orders.cs", {"App.Orders.Count()": "{ }"}))
+    assert counts(conn)["method_calls"] == 0
+
+    delta = change_log.changes_since(conn, since)
+    assert len(delta["methods"]["removed"]) == 1
+    assert "App.Report.Print()" in [row["method_signature"] for row in delta["methods"]["updated"]]
+    assert sorted(row["document_path"] for row in delta["documents"]["updated"]) == ["/src/Orders.cs", "/src/Report.cs"]
+
+
+def test_incremental_vacuum_returns_free_pages(conn):
+    index(conn, project("/src/Big.cs", {f"App.Big.M{i}()": "x" * 2000 for i in range(200)}))
+    conn.execute("DELETE FROM methods")
+    conn.commit()
+    assert space_report(conn)["free_pages"] > 0
+    result = incremental_vacuum(conn, budget_ms=10_000)
+    assert result["auto_vacuum"] == "incremental"
+    assert result["reclaimed_bytes"] > 0
+    assert space_report(conn)["free_pages"] == 0
@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+from database import connect, ensure_schema
+from tables import Tables
+
+# Tables as created before the schema was versioned
+UNVERSIONED = [
+    "CREATE TABLE projects (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    """
+    CREATE TABLE documents (
+        id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, path TEXT NOT NULL UNIQUE,
+        FOREIGN KEY(project_id) REFERENCES projects(id)
+    )
+    """,
+    """
+    CREATE TABLE classes (
+        id INTEGER PRIMARY KEY, document_id INTEGER, name TEXT NOT NULL UNIQUE,
+        FOREIGN KEY(document_id) REFERENCES documents(id)
+    )
+    """,
+    """
+    CREATE TABLE methods (
+        id INTEGER PRIMARY KEY, class_id INTEGER NOT NULL, name TEXT NOT NULL, signature TEXT NOT NULL,
+        start_line INTEGER, end_line INTEGER, body TEXT, FOREIGN KEY(class_id) REFERENCES classes(id)
+    )
+    """,
+    """
+    CREATE TABLE method_calls (
+        id INTEGER PRIMARY KEY, caller_id INTEGER NOT NULL, callee_id INTEGER NOT NULL,
+        FOREIGN KEY(caller_id) REFERENCES methods(id), FOREIGN KEY(callee_id) REFERENCES methods(id)
+    )
+    """,
+]
+ROWS = [
+    "INSERT INTO projects (id, name) VALUES (1, 'App')",
+    "INSERT INTO documents (id, project_id, path) VALUES (1, 1, '/src/Orders.cs')",
+    "INSERT INTO classes (id, document_id, name) VALUES (1, 1, 'App.Orders')",
+    "INSERT INTO methods (id, class_id, name, signature, body) VALUES (1, 1, 'Total()', 'App.Orders.Total()', NULL)",
+]
+# Version 2 added the vectors, and numbered the schema
+VERSION_2 = [
+    """
+    CREATE TABLE method_embeddings (
+        method_id INTEGER PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, text_hash TEXT NOT NULL,
+        vector BLOB NOT NULL
+    )
+    """,
+    "PRAGMA user_version = 2",
+]
+
+
+def old_database(path, statements) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    for statement in statements + ROWS:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def columns(conn, table) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def test_new_database_gets_the_current_schema(conn):
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == Tables.SCHEMA_VERSION
+    assert "document_id" in columns(conn, "methods")
+    # Already current, nothing to do
+    assert not ensure_schema(conn)
+
+
+@pytest.mark.parametrize("statements", [UNVERSIONED, UNVERSIONED + VERSION_2], ids=["unversioned", "version-2"])
+def test_old_databases_are_upgraded_in_place(data_dir, statements):
+    path = str(data_dir / "old.db")
+    old_database(path, statements).close()
+
+    conn = connect(path)
+    assert ensure_schema(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == Tables.SCHEMA_VERSION
+    # Methods know their document, taken from their class
+    assert conn.execute("SELECT document_id FROM methods WHERE id = 1").fetchone()[0] == 1
+    for table in ("method_embeddings", "generations", "changes"):
+        assert columns(conn, table)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_methods_signature", "idx_methods_document"} <= indexes
+    assert conn.execute("SELECT signature FROM methods").fetchall() == [("App.Orders.Total()",)]
+    conn.close()
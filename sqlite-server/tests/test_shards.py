@@ -0,0 +1,112 @@
+import os
+import threading
+from urllib.parse import quote
+
+from conftest import project
+from database import DB_NAME, ShardPool, current_shard, get_db_connection, shard_path
+
+
+def test_shard_path_is_stable_and_distinct():
+    assert shard_path(None) == shard_path("") == DB_NAME
+    first = shard_path("/home/me/work/App")
+    assert first == shard_path("/home/me/work/App/")
+    assert os.path.basename(first).startswith("App-")
+    # Same folder name elsewhere gets its own database
+    assert shard_path("/home/me/other/App") != first
+    assert os.path.basename(shard_path("C:\\Users\\me\\App")).startswith("App-")
+
+
+def test_connections_are_reused(data_dir):
+    pool = ShardPool(max_open=2)
+    shard, conn = pool.acquire("a.db")
+    pool.release(shard, conn)
+    again_shard, again = pool.acquire("a.db")
+    assert again_shard is shard and again is conn
+    pool.release(again_shard, again)
+    pool.close_all()
+
+
+def test_least_recently_used_shard_is_evicted(data_dir):
+    pool = ShardPool(max_open=2)
+    evicted = []
+    pool.on_evict.append(evicted.append)
+    for path in ("a.db", "b.db"):
+        pool.release(*pool.acquire(path))
+    # a is used again, so b is the least recently used when c is opened
+    pool.release(*pool.acquire("a.db"))
+    pool.release(*pool.acquire("c.db"))
+    assert evicted == ["b.db"]
+    assert pool.open_paths() == ["a.db", "c.db"]
+    pool.close_all()
+    assert sorted(evicted) == ["a.db", "b.db", "c.db"]
+
+
+def test_evicted_shard_in_use_closes_its_connection_on_release(data_dir):
+    pool = ShardPool(max_open=1)
+    shard, conn = pool.acquire("a.db")
+    pool.release(*pool.acquire("b.db"))
+    assert shard.evicted
+    # Still usable by the request that holds it
+    assert conn.execute("SELECT COUNT(*) FROM methods").fetchone()[0] == 0
+    pool.release(shard, conn)
+    assert shard.idle == []
+    assert shard.in_use == 0
+    pool.close_all()
+
+
+def test_pool_is_safe_across_threads(data_dir):
+    pool = ShardPool(max_open=2)
+    errors = []
+
+    def work(i):
+        try:
+            for j in range(20):
+                shard, conn = pool.acquire(f"{(i + j) % 4}.db")
+                conn.execute("SELECT 1").fetchone()
+                pool.release(shard, conn)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(pool.open_paths()) <= 2
+    assert all(shard["in_use"] == 0 for shard in pool.report())
+    pool.close_all()
+
+
+def test_nested_uses_on_one_thread_share_a_connection(data_dir):
+    with get_db_connection("a.db") as outer:
+        with get_db_connection("a.db") as inner:
+            assert inner is outer
+        token = current_shard.set("a.db")
+        try:
+            with get_db_connection() as current:
+                assert current is outer
+        finally:
+            current_shard.reset(token)
+
+
+def test_workspace_in_the_query_of_a_post(client):
+    # How the analyzer posts, the extension then reads with the same path
+    workspace = "C:\\Users\\Zoë\\Repos\\Shop"
+    body = [project("/src/Orders.cs", {"App.Orders.Total()": "{ }"})]
+    client.post(f"/update-indexes?workspace={quote(workspace, safe='')}", json=body)
+    assert len(client.get("/fetch-all", params={"workspace": workspace}).json()["data"]) == 1
+    assert client.get("/fetch-all").json()["data"] == []
+
+
+def test_workspaces_are_isolated(client):
+    body = [project("/src/Orders.cs", {"App.Orders.Total()": "{ }"})]
+    client.post("/update-indexes", json=body, headers={"X-GIM-Workspace": "/work/one"})
+    assert len(client.get("/fetch-methods", params={"workspace": "/work/one"}).json()["data"]) == 1
+    assert client.get("/fetch-methods", params={"workspace": "/work/two"}).json()["data"] == []
+    assert client.get("/fetch-methods").json()["data"] == []
+
+    response = client.get(
+        "/workspaces/methods-by-prefix", params={"prefix": "App.", "workspaces": ["/work/one", "/work/two"]}
+    )
+    assert [row["workspace"] for row in response.json()["methods"]] == ["/work/one"]
@@ -0,0 +1,46 @@
+from columnar import ColumnarIndex
+from conftest import project
+
+
+def partial_form(client):
+    """One class split over two documents, like a WinForms form and its designer file, indexed in that order"""
+    client.post("/update-indexes", json=[project("/src/Form1.cs", {"App.Form1.Load()": "{ }"})])
+    client.post("/update-indexes", json=[project("/src/Form1.Designer.cs", {"App.Form1.InitializeComponent()": "{ }"})])
+
+
+def test_partial_class_methods_are_found_in_their_own_document(client):
+    partial_form(client)
+    for signature, path in (("App.Form1.Load()", "/src/Form1.cs"), ("App.Form1.InitializeComponent()", "/src/Form1.Designer.cs")):
+        response = client.get("/method-from-signature", params={"signature": signature, "file_name": path})
+        assert response.status_code == 200
+        context = client.get("/method-context", params={"signature": signature, "file_name": path})
+        assert context.status_code == 200
+        assert context.json()["method"]["document_path"] == path
+        in_range = client.get("/methods-in-range", params={"file_name": path, "start_line": 0, "end_line": 100}).json()
+        assert [method["method_signature"] for method in in_range["methods"]] == [signature]
+    paths = {row["method_signature"]: row["document_path"] for row in client.get("/fetch-all").json()["data"]}
+    assert paths == {"App.Form1.Load()": "/src/Form1.cs", "App.Form1.InitializeComponent()": "/src/Form1.Designer.cs"}
+
+
+def test_partial_class_keeps_its_first_document(client, data_dir):
+    partial_form(client)
+    classes = client.get("/fetch-classes").json()["data"]
+    documents = {row["id"]: row["path"] for row in client.get("/fetch-documents").json()["data"]}
+    assert [documents[row["document_id"]] for row in classes] == ["/src/Form1.cs"]
+
+    from database import get_db_connection
+    with get_db_connection() as conn:
+        snapshot = ColumnarIndex.build(conn)
+    assert [row["method_signature"] for row in snapshot.methods_in_range("/src/Form1.cs", 0, 100)] == ["App.Form1.Load()"]
+    assert [row["method_signature"] for row in snapshot.methods_in_range("/src/Form1.Designer.cs", 0, 100)] == [
+        "App.Form1.InitializeComponent()"
+    ]
+
+
+def test_class_moves_once_no_methods_are_left_in_its_document(client):
+    client.post("/update-indexes", json=[project("/src/Old.cs", {"App.Orders.Total()": "{ }"})])
+    client.post("/update-indexes", json=[project("/src/Old.cs", {"App.Report.Print()": "{ }"})])
+    client.post("/update-indexes", json=[project("/src/New.cs", {"App.Orders.Total()": "{ }"})])
+    documents = {row["id"]: row["path"] for row in client.get("/fetch-documents").json()["data"]}
+    classes = {row["name"]: documents[row["document_id"]] for row in client.get("/fetch-classes").json()["data"]}
+    assert classes == {"App.Orders": "/src/New.cs", "App.Report": "/src/Old.cs"}
@@ -1,17 +1,35 @@
+import json
+
+import change_log
 from models import ProjectBody
 
 
 # Helper class to process the update of a single project at a time
 class UpdateIndexes:
-    def __init__(self, body: ProjectBody, conn=None):
+    def __init__(self, body: ProjectBody, conn=None, autocommit=True, generation=None, verbose=False):
         self.body = body
         self.conn = conn
+        # Report every call inserted, too slow for large loads
+        self.verbose = verbose
+        # Bulk loads commit many projects at once instead
+        self.autocommit = autocommit
+        # change_log.PendingGeneration to record the changes in, it is only started if something changed
+        self.generation = generation
         self.document = None
         self.projectName = None
         self.classes = None
         self.methods = None
         self.calls = None
         self.new_id = None
+        # Methods inserted or updated by this run, whose embeddings may be stale
+        self.changed_method_ids = []
+        # Methods of the document that are no longer in it, deleted by this run
+        self.removed_method_ids = []
+        # Calls found by this run, as (caller_id, callee_id)
+        self.seen_calls = set()
+        # What actually changed, for the change log: "added", "updated" or "removed" by id
+        self.document_change = None
+        self.method_changes = {}
 
     def process(self):
         self.projectName = self.body.Project
@@ -23,8 +41,12 @@ class UpdateIndexes:
         project_id = self.insert_project(cursor, self.projectName)
         document_id = self.insert_document(cursor, project_id, self.document)
         class_id_map = self.insert_classes(cursor, document_id, self.classes)
-        self.insert_methods(cursor, self.methods, class_id_map, self.projectName)
+        self.insert_methods(cursor, self.methods, class_id_map, self.projectName, document_id)
         self.insert_method_calls(cursor, self.calls, class_id_map)
+        self.prune_document(cursor, document_id)
+        self.move_classes(cursor, document_id, class_id_map)
+        if self.generation is not None:
+            self.record_changes(cursor, document_id)
         return self.commit(cursor)
 
     def insert_project(self, cursor, projectName):
@@ -47,6 +69,7 @@ class UpdateIndexes:
                 "INSERT INTO documents (project_id, path) VALUES (?, ?)",
                 (project_id, document),
             )
+            self.document_change = change_log.ADDED
             document_id = cursor.lastrowid
         return document_id
 
@@ -66,7 +89,7 @@ class UpdateIndexes:
             class_id_map[cls] = class_id
         return class_id_map
 
-    def insert_methods(self, cursor, methods, class_id_map, projectName):
+    def insert_methods(self, cursor, methods, class_id_map, projectName, document_id):
         for method in methods:
             cursor.execute(
                 "SELECT id FROM methods WHERE signature = ?", (method.Signature,)
@@ -79,9 +102,15 @@ class UpdateIndexes:
             if existing_method:
                 method_id = existing_method[0]
                 cursor.execute(
-                    "UPDATE methods SET body = ?, start_line = ?, end_line = ? WHERE id = ?",
-                    (body, start_line, end_line, method_id),
+                    """
+                    UPDATE methods SET body = ?, start_line = ?, end_line = ?, document_id = ?
+                    WHERE id = ? AND (body IS NOT ? OR start_line IS NOT ? OR end_line IS NOT ? OR document_id IS NOT ?)
+                    """,
+                    (body, start_line, end_line, document_id, method_id, body, start_line, end_line, document_id),
                 )
+                if cursor.rowcount:
+                    self.method_changes[method_id] = change_log.UPDATED
+                self.changed_method_ids.append(method_id)
             else:
                 signature = method.Signature
                 class_name = ".".join(signature.split(".")[:-1]).split(" ")[-1]
@@ -93,9 +122,11 @@ class UpdateIndexes:
 
                 if class_id:
                     cursor.execute(
-                        "INSERT INTO methods (class_id, name, signature, start_line, end_line, body) VALUES (?, ?, ?, ?, ?, ?)",
-                        (class_id, method_name, signature, start_line, end_line, body),
+                        "INSERT INTO methods (class_id, name, signature, start_line, end_line, body, document_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (class_id, method_name, signature, start_line, end_line, body, document_id),
                     )
+                    self.changed_method_ids.append(cursor.lastrowid)
+                    self.method_changes[cursor.lastrowid] = change_log.ADDED
 
     def insert_method_calls(self, cursor, method_calls, class_id_map):
         for call in method_calls:
@@ -135,6 +166,7 @@ class UpdateIndexes:
             if caller_row and callee_row:
                 caller_id = caller_row[0]
                 callee_id = callee_row[0]
+                self.seen_calls.add((caller_id, callee_id))
 
                 cursor.execute(
                     "SELECT id FROM method_calls WHERE caller_id = ? AND callee_id = ?",
@@ -142,19 +174,94 @@ class UpdateIndexes:
                 )
 
                 if not cursor.fetchone():
-                    print(
-                        f"Inserting method call from {caller_signature} to {call.Callee}"
-                    )
+                    if self.verbose:
+                        print(
+                            f"Inserting method call from {caller_signature} to {call.Callee}"
+                        )
                     cursor.execute(
                         "INSERT INTO method_calls (caller_id, callee_id) VALUES (?, ?)",
                         (caller_id, callee_id),
                     )
+                    self.method_changes.setdefault(caller_id, change_log.UPDATED)
         return
 
+    def prune_document(self, cursor, document_id):
+        """
+        Delete what an earlier analysis of the document left behind: methods that are no longer in it,
+        for instance because their signature changed, and calls its methods no longer make.
+        """
+        cursor.execute(
+            "SELECT id FROM methods WHERE document_id = ? AND id NOT IN (SELECT value FROM json_each(?))",
+            (document_id, json.dumps(self.changed_method_ids)),
+        )
+        self.removed_method_ids = [row[0] for row in cursor.fetchall()]
+        if self.removed_method_ids:
+            removed = json.dumps(self.removed_method_ids)
+            # Methods elsewhere that called the removed ones lose those calls
+            cursor.execute(
+                "SELECT DISTINCT caller_id FROM method_calls WHERE callee_id IN (SELECT value FROM json_each(?))",
+                (removed,),
+            )
+            for (caller_id,) in cursor.fetchall():
+                self.method_changes.setdefault(caller_id, change_log.UPDATED)
+            for method_id in self.removed_method_ids:
+                self.method_changes[method_id] = change_log.REMOVED
+            cursor.execute(
+                "DELETE FROM method_calls WHERE caller_id IN (SELECT value FROM json_each(?)) OR callee_id IN (SELECT value FROM json_each(?))",
+                (removed, removed),
+            )
+            cursor.execute("DELETE FROM method_embeddings WHERE method_id IN (SELECT value FROM json_each(?))", (removed,))
+            cursor.execute("DELETE FROM methods WHERE id IN (SELECT value FROM json_each(?))", (removed,))
+
+        cursor.execute(
+            """
+            SELECT method_calls.id, caller_id, callee_id FROM method_calls
+            JOIN methods ON method_calls.caller_id = methods.id
+            WHERE methods.document_id = ?
+            """,
+            (document_id,),
+        )
+        stale_calls = []
+        for call_id, caller_id, callee_id in cursor.fetchall():
+            if (caller_id, callee_id) not in self.seen_calls:
+                stale_calls.append(call_id)
+                self.method_changes.setdefault(caller_id, change_log.UPDATED)
+        if stale_calls:
+            cursor.execute("DELETE FROM method_calls WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(stale_calls),))
+
+    def move_classes(self, cursor, document_id, class_id_map):
+        """
+        Move the classes of this document that have no methods left in the document they are recorded in.
+        A partial class spans documents, its methods know which one they are in, so it stays where it is
+        as long as any of its methods are still there.
+        """
+        cursor.execute(
+            """
+            UPDATE classes SET document_id = ?
+            WHERE id IN (SELECT value FROM json_each(?)) AND document_id IS NOT ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM methods WHERE methods.class_id = classes.id AND methods.document_id = classes.document_id
+                )
+            """,
+            (document_id, json.dumps(list(class_id_map.values())), document_id),
+        )
+
+    def record_changes(self, cursor, document_id):
+        if self.method_changes and self.document_change is None:
+            self.document_change = change_log.UPDATED
+        # Callers in other documents that lost their calls to removed methods changed those documents as well
+        updated = [method_id for method_id, change in self.method_changes.items() if change == change_log.UPDATED]
+        document_changes = dict.fromkeys(change_log.documents_of(self.conn, updated), change_log.UPDATED)
+        if self.document_change is not None:
+            document_changes[document_id] = self.document_change
+        self.generation.record(change_log.DOCUMENT, document_changes)
+        self.generation.record(change_log.METHOD, self.method_changes)
+
     def commit(self, cursor=None):
         try:
             if cursor:
-                self.conn.commit()
+                if self.autocommit:
+                    self.conn.commit()
                 self.new_id = cursor.lastrowid
             return {"id": self.new_id, "status": "success"}
         except Exception as e:
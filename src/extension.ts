@@ -15,6 +15,11 @@ let childProcesses: ChildProcess[] = []
 const availableModels = ['gemma:7b', 'gemma:13b', 'qwen2.5-coder:3b', 'qwen2.5-coder:7b', 'gpt-oss:latest']
 let currentModel = availableModels[2]
 
+// Path of the open workspace, the servers keep a database per workspace and are told which one with every request
+function workspacePath(): string | undefined {
+  return vscode.workspace.workspaceFolders?.[0].uri.fsPath
+}
+
 class GimCodeActionProvider implements vscode.CodeActionProvider {
   provideCodeActions(
     document: vscode.TextDocument,
@@ -288,6 +293,7 @@ async function getSelectedMethodsFromDb(params: {
   try {
     const response = await axios.get<{ data: DbMethodResult[] }>(
       'http://127.0.0.1:8000/fetch-all',
+      { params: { workspace: workspacePath() } },
     )
 
     const allMethods = response.data.data
@@ -393,6 +399,7 @@ async function generateDocstringForMethod(editor: vscode.TextEditor, dbMethod: D
     file_name: editor.document.fileName,
     signature: dbMethod.method_signature,
     model_name: currentModel,
+    workspace: workspacePath(),
   }
 
   gimOutputChannel.appendLine(`Requesting docstring for: ${JSON.stringify(requestBody)}`)
@@ -626,6 +633,7 @@ async function generateAnalysisForMethod(editor: vscode.TextEditor, dbMethod: Db
     file_name: editor.document.fileName,
     signature: dbMethod.method_signature,
     model_name: currentModel,
+    workspace: workspacePath(),
   }
 
   gimOutputChannel.appendLine(`Requesting analysis for: ${JSON.stringify(requestBody)}`)
@@ -782,6 +790,7 @@ async function generateExplanationForMethod(editor: vscode.TextEditor, dbMethod:
     file_name: editor.document.fileName,
     signature: dbMethod.method_signature,
     model_name: currentModel,
+    workspace: workspacePath(),
   }
 
   gimOutputChannel.appendLine(`Requesting explanation for: ${JSON.stringify(requestBody)}`)
@@ -950,7 +959,7 @@ async function updateIndexes() {
     vscode.window.showErrorMessage('GIM: No workspace folder open')
     return
   }
-  const projectPath = vscode.workspace.workspaceFolders?.[0].uri.fsPath
+  const projectPath = workspacePath()
   if (projectPath === undefined) {
     vscode.window.showErrorMessage('GIM: No workspace folder open')
     return
@@ -963,6 +972,7 @@ async function updateIndexes() {
   console.log(`GIM: Project path is ${projectPath}, solution file is ${solutionFile}`)
   axios.post('http://127.0.0.1:8080/update-codebase-indexes', {
     projectPath: solutionFile,
+    workspace: projectPath,
   }, {
     headers: { 'Content-Type': 'application/json' },
   }).then((response) => {